@@ -0,0 +1,17 @@
+import pytest
+
+from bidsbase.manager.utils.synthetic import make_synthetic_dataset
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [100, 1000, 10000]
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=[f"{size}_sessions" for size in SIZES])
+def synthetic(request, tmp_path_factory):
+    """
+    A synthetic dataset of two sessions per subject, each with two DWI runs
+    and fieldmaps referencing them
+    """
+    root = tmp_path_factory.mktemp(f"synthetic_{request.param}") / "bids"
+    return make_synthetic_dataset(root, n_subjects=request.param // 2, n_sessions=2, dwi_runs=2)
@@ -0,0 +1,32 @@
+import pytest
+
+from bidsbase.manager.index import parse_filename
+
+# the file names of a session with fieldmaps, for a hundred subjects
+FILENAMES = [
+    f"sub-{subject:03d}_ses-1_{name}"
+    for subject in range(100)
+    for name in [
+        "T1w.nii.gz",
+        "dir-FWD_run-1_dwi.nii.gz",
+        "dir-FWD_run-2_dwi.bval",
+        "acq-dwi_dir-AP_epi.json",
+        "task-rest_acq-multiband_dir-PA_run-2_echo-1_bold.nii.gz",
+    ]
+]
+
+
+def test_parse_filename(benchmark):
+    parse = parse_filename.__wrapped__
+    benchmark(lambda: [parse(filename) for filename in FILENAMES])
+
+
+def test_parse_filename_cached(benchmark):
+    parse_filename.cache_clear()
+    benchmark(lambda: [parse_filename(filename) for filename in FILENAMES])
+
+
+def test_parse_file_entities_pybids(benchmark):
+    layout = pytest.importorskip("bids.layout")
+    paths = [f"/data/{filename.split('_')[0]}/ses-1/dwi/{filename}" for filename in FILENAMES]
+    benchmark.pedantic(lambda: [layout.parse_file_entities(path) for path in paths], rounds=3)
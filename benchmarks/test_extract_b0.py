@@ -0,0 +1,42 @@
+import logging
+import shutil
+
+import pytest
+
+from bidsbase.manager.session.common_fixes import extract_b0
+
+np = pytest.importorskip("numpy")
+nib = pytest.importorskip("nibabel")
+
+BACKENDS = [
+    "native",
+    pytest.param(
+        "mrtrix",
+        marks=pytest.mark.skipif(shutil.which("dwiextract") is None, reason="MRtrix is not installed"),
+    ),
+]
+
+
+@pytest.fixture(scope="module", params=["nii", "nii.gz"])
+def dwi(request, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("dwi")
+    n_volumes = 64
+    in_file = directory / f"dwi.{request.param}"
+    data = np.random.default_rng(0).integers(0, 4096, (96, 96, 60, n_volumes), dtype=np.int16)
+    nib.Nifti1Image(data, np.eye(4)).to_filename(str(in_file))
+    bvals = np.where(np.arange(n_volumes) % 8 == 0, 0, 1000)
+    np.savetxt(directory / "dwi.bval", bvals[None], fmt="%d")
+    np.savetxt(directory / "dwi.bvec", np.ones((3, n_volumes)), fmt="%d")
+    return in_file
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_extract_b0(benchmark, dwi, backend):
+    out_file = dwi.parent / f"b0_{backend}.nii.gz"
+    benchmark.pedantic(
+        extract_b0,
+        args=(dwi, dwi.parent / "dwi.bvec", dwi.parent / "dwi.bval", out_file),
+        kwargs={"logger": logging.getLogger("benchmark"), "backend": backend},
+        rounds=3,
+    )
+    assert nib.load(str(out_file)).shape == (96, 96, 60)
@@ -0,0 +1,43 @@
+from bidsbase.manager import index as index_module
+from bidsbase.manager.index import DatasetIndex
+
+
+def test_build_index(benchmark, synthetic):
+    index = benchmark(DatasetIndex, synthetic)
+    assert len(index.session_paths) == sum(len(sessions) for sessions in index.subjects.values())
+
+
+def test_glob_subjects_and_sessions(benchmark, synthetic):
+    # the access pattern DatasetIndex replaces
+    def glob_sessions():
+        subjects = [i.name.split("-")[-1] for i in synthetic.glob("sub-*")]
+        return {subject: list(synthetic.glob(f"sub-{subject}/ses-*")) for subject in subjects}
+
+    benchmark(glob_sessions)
+
+
+def test_session_lookups(benchmark, synthetic):
+    index = DatasetIndex(synthetic)
+
+    def lookup_sessions():
+        return [index.sessions(subject) for subject in index.subjects]
+
+    assert len(benchmark(lookup_sessions)) == len(index.subjects)
+
+
+def test_entity_query(benchmark, synthetic):
+    index = DatasetIndex(synthetic)
+    index.query()
+
+    def query_first_runs():
+        return index.query(datatype="dwi", suffix="dwi", extension=".nii.gz", run=1)
+
+    assert len(benchmark(query_first_runs)) == len(index.session_paths)
+
+
+def test_build_cached_index(benchmark, synthetic, tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "RACY_MTIME_NS", 0)
+    cache = tmp_path / index_module.INDEX_NAME
+    DatasetIndex(synthetic, cache=cache)
+    index = benchmark(DatasetIndex, synthetic, cache=cache)
+    assert index.cache_misses == 0
@@ -0,0 +1,72 @@
+import itertools
+
+from bidsbase.manager.index import DatasetIndex
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.session.fieldmaps import FieldmapIndex
+from bidsbase.manager.utils.copy import copy_tree_python
+
+ROUNDS = 3
+
+
+def fresh_directories(tmp_path):
+    """
+    Yield a new working copy and work directory for every benchmark round
+    """
+    for i in itertools.count():
+        yield tmp_path / f"copy_{i}", tmp_path / f"work_{i}"
+
+
+def test_create_copy(benchmark, synthetic, tmp_path):
+    directories = fresh_directories(tmp_path)
+
+    def setup():
+        copy_to, work_dir = next(directories)
+        return (), {"root": synthetic, "validate": False, "copy_to": copy_to, "work_dir": work_dir}
+
+    manager = benchmark.pedantic(Manager, setup=setup, rounds=ROUNDS)
+    assert not any(result.failed for result in manager.copy_results)
+
+
+def test_fix_dataset(benchmark, synthetic, tmp_path):
+    directories = fresh_directories(tmp_path)
+
+    def setup():
+        copy_to, work_dir = next(directories)
+        manager = Manager(synthetic, validate=False, copy_to=copy_to, work_dir=work_dir, copy_mode="hardlink")
+        return (manager,), {}
+
+    summary = benchmark.pedantic(lambda manager: manager.fix_dataset(), setup=setup, rounds=ROUNDS)
+    assert summary
+
+
+def test_fix_unchanged_dataset(benchmark, synthetic, tmp_path):
+    directories = fresh_directories(tmp_path)
+
+    def setup():
+        copy_to, work_dir = next(directories)
+        manager = Manager(synthetic, validate=False, copy_to=copy_to, work_dir=work_dir, copy_mode="hardlink")
+        manager.fix_dataset()
+        return (manager,), {}
+
+    summary = benchmark.pedantic(lambda manager: manager.fix_dataset(), setup=setup, rounds=ROUNDS)
+    assert not summary
+
+
+def test_rewrite_sidecars(benchmark, synthetic, tmp_path):
+    directories = fresh_directories(tmp_path)
+
+    def setup():
+        copy_to, _ = next(directories)
+        copy_tree_python(synthetic, copy_to, mode="hardlink")
+        index = DatasetIndex(copy_to)
+        return (list(index.session_paths.values()),), {}
+
+    def rewrite_sidecars(session_paths):
+        # drop the first DWI run from the IntendedFor fields of every session
+        for session_path in session_paths:
+            fieldmaps = FieldmapIndex(session_path)
+            first_run = next(session_path.glob("dwi/*_run-1_dwi.nii*"))
+            fieldmaps.apply({first_run: None})
+            fieldmaps.flush()
+
+    benchmark.pedantic(rewrite_sidecars, setup=setup, rounds=ROUNDS)
@@ -14,18 +14,262 @@ Why does this file exist, and why not put this in __main__?
 
   Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
+import argparse
+import json
 import sys
+import tempfile
+from pathlib import Path
 
+COMMANDS = {
+    "copy": "Create or update the working copy of the dataset",
+    "fix": "Update the working copy, then apply the known fixes to it",
+    "index": "List the sessions selected by the filters and the shard",
+    "plan": "Print the operations the fixes would apply, without changing anything",
+    "watch": "Copy and fix the dataset, then the sessions arriving in it, until interrupted",
+    "bench": "Time the copy and the fixes of a synthetic dataset",
+}
 
-def main(argv=sys.argv):
+
+def parse_shard(value: str) -> tuple:
+    """
+    Parse a shard given as "index/count", with a 0-based index
+
+    Parameters
+    ----------
+    value : str
+        The shard (e.g. "3/10")
+
+    Returns
+    -------
+    tuple
+        The (index, count) pair
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}, expected index/count (e.g. 0/4)")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}, the index must be between 0 and {count - 1}")
+    return index, count
+
+
+def _add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments shared by the commands processing a dataset
+    """
+    parser.add_argument("root", help="The root directory of the BIDS dataset")
+    parser.add_argument("--copy-to", help="Where to create the working copy of the dataset")
+    parser.add_argument("--work-dir", help="Where to store logs and summaries of the applied fixes")
+    parser.add_argument("--no-validate", action="store_true", help="Skip the validation of the BIDS dataset")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="The number of sessions processed at the same time")
+    parser.add_argument("--participant-label", nargs="+", help="The subjects to process (with or without sub-), by default all")
+    parser.add_argument("--session-label", nargs="+", help="The sessions to process (with or without ses-), by default all")
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help=(
+            "Process only one shard of the sessions, given as index/count with a 0-based index (e.g. $SLURM_ARRAY_TASK_ID/10). "
+            "The shards may run on several hosts: the databases of the working directory then use a rollback journal "
+            "instead of WAL, and the working directory must be on a filesystem with working POSIX locks"
+        ),
+    )
+    parser.add_argument("--resume", action="store_true", help="Skip the sessions completed by a previous run")
+    parser.add_argument("--stop-on-first-crash", action="store_true", help="Stop at the first session that fails")
+    parser.add_argument("--json-logs", action="store_true", help="Write the log as JSON lines")
+    parser.add_argument("--metrics", action="store_true", help="Write the time spent in each stage to the working directory")
+    parser.add_argument("--progress", action="store_true", help="Display the progress of copies and fixes")
+
+
+def _add_copy_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments of the commands copying the dataset
+    """
+    parser.add_argument("--force-copy", action="store_true", help="Overwrite existing copies of sessions")
+    parser.add_argument("--copy-backend", choices=["python", "rsync"], default="python", help="The backend used to copy sessions")
+    parser.add_argument(
+        "--copy-mode",
+        choices=["full", "hardlink", "reflink", "symlink"],
+        default="full",
+        help="How files are copied to the working copy",
+    )
+    parser.add_argument("--checksum", action="store_true", help="Compare file contents when syncing an existing copy")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser of the command line app
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The argument parser
+    """
+    parser = argparse.ArgumentParser(prog="bidsbase", description="A BIDS manager for The Base scanning protocol(s)")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    for command, description in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        if command == "bench":
+            subparser.add_argument("--output", help="Where to create the synthetic dataset, by default a temporary directory")
+            subparser.add_argument("--subjects", type=int, default=10, help="The number of subjects")
+            subparser.add_argument("--sessions", type=int, default=1, help="The number of sessions per subject")
+            subparser.add_argument("--dwi-runs", type=int, default=2, help="The number of DWI runs per session")
+            subparser.add_argument("--payload", choices=["tiny", "sparse"], default="tiny", help="The payload of the images")
+            subparser.add_argument("-j", "--jobs", type=int, default=1, help="The number of sessions processed at the same time")
+            subparser.add_argument(
+                "--copy-mode",
+                choices=["full", "hardlink", "reflink", "symlink"],
+                default="full",
+                help="How files are copied to the working copy",
+            )
+            continue
+        _add_run_arguments(subparser)
+        if command in ("copy", "fix", "watch"):
+            _add_copy_arguments(subparser)
+        if command in ("copy", "fix"):
+            subparser.add_argument(
+                "--run-id",
+                help=(
+                    "Share the sessions with the other processes given the same run id (e.g. $SLURM_ARRAY_JOB_ID) through lease files. "
+                    "The processes may run on several hosts: the databases of the working directory then use a rollback journal "
+                    "instead of WAL, and the working directory must be on a filesystem with working POSIX locks"
+                ),
+            )
+            subparser.add_argument(
+                "--lease-ttl", type=float, default=600.0, help="How long the lease of a crashed process blocks its sessions, in seconds"
+            )
+        if command in ("copy", "fix"):
+            subparser.add_argument(
+                "--dedup", action="store_true", help="Replace the files of the working copy identical to others by hard links"
+            )
+        if command == "fix":
+            subparser.add_argument("--skip-copy", action="store_true", help="Fix the existing working copy without updating it")
+            subparser.add_argument("--force-fix", action="store_true", help="Run the fixes on the sessions unchanged since they were fixed")
+        if command == "watch":
+            subparser.add_argument(
+                "--quiet", type=float, default=60.0, help="How long a session must not change before it is processed, in seconds"
+            )
+            subparser.add_argument("--interval", type=float, default=5.0, help="How often to poll the dataset without inotify, in seconds")
+            subparser.add_argument("--polling", action="store_true", help="Poll the dataset instead of using inotify")
+        if command == "plan":
+            subparser.add_argument("--source", action="store_true", help="Plan the fixes on the source dataset instead of the working copy")
+    return parser
+
+
+def _manager(args, auto_copy: bool):
+    """
+    Create the Manager of a command
+    """
+    from bidsbase.manager.manager import Manager
+
+    copy_arguments = {}
+    if hasattr(args, "copy_mode"):
+        copy_arguments.update(
+            force_copy=args.force_copy,
+            copy_backend=args.copy_backend,
+            copy_mode=args.copy_mode,
+            checksum=args.checksum,
+        )
+    if hasattr(args, "run_id"):
+        copy_arguments.update(run_id=args.run_id, lease_ttl=args.lease_ttl)
+    return Manager(
+        root=args.root,
+        validate=not args.no_validate,
+        copy_to=args.copy_to,
+        work_dir=args.work_dir,
+        stop_on_first_crash=args.stop_on_first_crash,
+        jobs=args.jobs,
+        json_logs=args.json_logs,
+        metrics=args.metrics,
+        progress=args.progress,
+        participant_label=args.participant_label,
+        session_label=args.session_label,
+        shard=args.shard,
+        resume=args.resume,
+        auto_copy=auto_copy,
+        **copy_arguments,
+    )
+
+
+def _bench(args) -> int:
+    """
+    Build a synthetic dataset, copy and fix it, and print the metrics of the run
+    """
+    from bidsbase.manager.manager import Manager
+    from bidsbase.manager.utils.synthetic import make_synthetic_dataset
+
+    with tempfile.TemporaryDirectory(prefix="bidsbase-bench-") as directory:
+        output = Path(args.output) if args.output is not None else Path(directory)
+        root = make_synthetic_dataset(
+            output / "bids",
+            n_subjects=args.subjects,
+            n_sessions=args.sessions,
+            dwi_runs=args.dwi_runs,
+            payload=args.payload,
+        )
+        manager = Manager(
+            root,
+            validate=False,
+            work_dir=output / "work",
+            jobs=args.jobs,
+            copy_mode=args.copy_mode,
+            metrics=True,
+        )
+        manager.fix_dataset()
+        print(json.dumps(manager.metrics.to_dict(), indent=4))
+    return 0
+
+
+def main(argv=None):
     """
     Args:
-        argv (list): List of arguments
+        argv (list): List of arguments, by default the arguments of the process
 
     Returns:
-        int: A return code
+        int: A return code, 1 if any session failed
 
-    Does stuff.
+    Runs one of the commands on a dataset (see ``bidsbase --help``).
     """
-    print(argv)
-    return 0
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 0
+    if args.command == "bench":
+        return _bench(args)
+    if args.command == "index":
+        manager = _manager(args, auto_copy=False)
+        for subject, session in manager.selected_sessions():
+            print(f"sub-{subject}/ses-{session}")
+        return 0
+    if args.command == "plan":
+        manager = _manager(args, auto_copy=False)
+        for path, plan in manager.plan_dataset(source=args.source).items():
+            print(f"{path}: {plan.cost()}")
+            for operation in plan.operations:
+                print(f"    {operation}")
+        return 0
+    if args.command == "watch":
+        manager = _manager(args, auto_copy=True)
+        manager.fix_dataset()
+        try:
+            manager.watch(quiet=args.quiet, interval=args.interval, use_inotify=not args.polling)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.run_id is not None:
+        if args.command == "fix" and args.skip_copy:
+            parser.error("--skip-copy cannot be used with --run-id, sessions are copied before they are fixed")
+        if args.dedup:
+            parser.error("--dedup cannot be used with --run-id, the working copy changes while the sessions are fixed")
+        manager = _manager(args, auto_copy=False)
+        manager.process_dataset(fix=args.command == "fix")
+    else:
+        manager = _manager(args, auto_copy=args.command == "copy" or not args.skip_copy)
+        if args.dedup:
+            manager.deduplicate()
+        if args.command == "fix":
+            manager.fix_dataset(force=args.force_fix)
+    failed = any(result.failed for result in manager.copy_results) or manager.fix_errors
+    if failed:
+        print("Some sessions failed, see the log for details", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,559 @@
+import functools
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Union
+
+from bidsbase.manager.utils.state import JOURNAL_MODE
+
+INDEX_NAME = "index.sqlite"
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER,
+    entries TEXT NOT NULL
+)
+"""
+# directories modified this recently may change again within the same mtime tick, so their listing is not trusted
+RACY_MTIME_NS = 2_000_000_000
+
+# BIDS filename keys and the names pybids uses for the corresponding entities
+ENTITY_NAMES = {
+    "sub": "subject",
+    "ses": "session",
+    "sample": "sample",
+    "task": "task",
+    "tracksys": "tracksys",
+    "acq": "acquisition",
+    "nuc": "nucleus",
+    "voi": "volume",
+    "ce": "ceagent",
+    "stain": "staining",
+    "trc": "tracer",
+    "rec": "reconstruction",
+    "dir": "direction",
+    "run": "run",
+    "mod": "modality",
+    "echo": "echo",
+    "flip": "flip",
+    "inv": "inv",
+    "mt": "mt",
+    "part": "part",
+    "proc": "proc",
+    "space": "space",
+    "recording": "recording",
+    "chunk": "chunk",
+}
+# the "key-value" pairs of a file name's stem, with the values pybids accepts
+ENTITY_PATTERN = re.compile(r"(?:^|_)([a-z]+)-([a-zA-Z0-9+]+)(?=_|$)")
+# the entities whose values are further restricted (as in pybids' configuration)
+ENTITY_VALUES = {
+    "run": str.isdigit,
+    "echo": str.isdigit,
+    "flip": str.isdigit,
+    "inv": str.isdigit,
+    "chunk": str.isdigit,
+    "mt": {"on", "off"}.__contains__,
+    "part": {"imag", "mag", "phase", "real"}.__contains__,
+}
+SUFFIX_PATTERN = re.compile(r"[a-zA-Z0-9+]+")
+
+
+class Entities:
+    """
+    The entities parsed from a file name, as an immutable record of (name, value) pairs
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: tuple):
+        self.items = items
+
+    def __repr__(self) -> str:
+        return f"<Entities {' '.join(f'{name}={value!r}' for name, value in self.items)}>"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Entities) and self.items == other.items
+
+    def __hash__(self) -> int:
+        return hash(self.items)
+
+    def __contains__(self, name: str) -> bool:
+        return any(key == name for key, _ in self.items)
+
+    def get(self, name: str, default=None):
+        """
+        Get the value of an entity, or a default if the file has no such entity
+        """
+        for key, value in self.items:
+            if key == name:
+                return value
+        return default
+
+    def to_dict(self) -> dict:
+        """
+        Get the entities as a new dictionary
+        """
+        return dict(self.items)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_filename(filename: str) -> Entities:
+    """
+    Parse the BIDS entities of a file name, with a cache of the last parsed names
+
+    Entities are recognized as pybids does, in any order: their values may
+    only hold letters, digits and "+", and run numbers are parsed as integers.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file (without its directory)
+
+    Returns
+    -------
+    Entities
+        The entities of the file, named as in pybids
+
+    Examples
+    --------
+    >>> parse_filename("sub-01_ses-1_dir-AP_run-2_dwi.nii.gz").to_dict()
+    {'subject': '01', 'session': '1', 'direction': 'AP', 'run': 2, 'suffix': 'dwi', 'extension': '.nii.gz'}
+    """
+    stem, dot, extension = filename.partition(".")
+    items = []
+    for key, value in ENTITY_PATTERN.findall(stem):
+        name = ENTITY_NAMES.get(key)
+        if name is not None:
+            valid = ENTITY_VALUES.get(key)
+            if valid is None or valid(value):
+                items.append((name, int(value) if key == "run" else value))
+    suffix = stem.rpartition("_")[2]
+    if SUFFIX_PATTERN.fullmatch(suffix):
+        items.append(("suffix", suffix))
+    if dot:
+        items.append(("extension", f".{extension}"))
+    return Entities(tuple(items))
+
+
+def parse_entities(filename: str) -> dict:
+    """
+    Parse the BIDS entities of a file name
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file (without its directory)
+
+    Returns
+    -------
+    dict
+        The entities of the file, named as in pybids (a new dictionary, that
+        the caller may change)
+    """
+    return parse_filename(filename).to_dict()
+
+
+class FileRecord:
+    """
+    A file indexed in a BIDS dataset
+    """
+
+    __slots__ = ("filename", "subject", "session", "datatype", "entities")
+
+    def __init__(self, filename: str, subject: str, session: str, datatype: str, entities: dict):
+        self.filename = filename
+        self.subject = subject
+        self.session = session
+        self.datatype = datatype
+        self.entities = entities
+
+    def __repr__(self) -> str:
+        return f"<FileRecord {self.filename}>"
+
+    @property
+    def path(self) -> Path:
+        # built on demand, creating a Path for every indexed file dominates the indexing time
+        return Path(self.filename)
+
+
+class CachedEntry:
+    """
+    A directory entry listed from the listing cache, standing for an ``os.DirEntry``
+    """
+
+    __slots__ = ("name", "path", "kind")
+
+    def __init__(self, name: str, path: str, kind: str):
+        self.name = name
+        self.path = path
+        # "d" for directories, "f" for files and "o" for anything else (e.g. broken links)
+        self.kind = kind
+
+    def is_dir(self) -> bool:
+        return self.kind == "d"
+
+    def is_file(self) -> bool:
+        return self.kind == "f"
+
+
+class ListingCache:
+    """
+    The listings of the directories of a dataset, kept in a SQLite database
+    with the directories' modification times
+
+    A directory's modification time changes whenever an entry is added to
+    it, removed from it or renamed in it, so a directory whose modification
+    time did not change does not need to be listed again. Only the
+    directories are stat'ed when the index is refreshed, not the files.
+    """
+
+    def __init__(self, path: Union[str, Path], root: Union[str, Path], timeout: float = 60.0, journal_mode: str = JOURNAL_MODE):
+        """
+        Load the listings of the directories under a root
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the database
+        root : Union[str, Path]
+            The directory whose listings are loaded
+        timeout : float, optional
+            How long to wait for a lock held by another writer, in seconds, by default 60
+        journal_mode : str, optional
+            The journal mode of the database, by default JOURNAL_MODE ("WAL")
+        """
+        self.path = Path(path)
+        self.root = os.path.abspath(root)
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.hits = 0
+        self.misses = 0
+        self._visited = set()
+        self._changed = {}
+        connection = self._connect()
+        try:
+            # every path under the root sorts between "root/" and "root0" ("0" follows "/")
+            rows = connection.execute(
+                "SELECT path, mtime, entries FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                (self.root, self.root + "/", self.root + "0"),
+            )
+            self._listings = {path: (mtime, entries) for path, mtime, entries in rows}
+        finally:
+            connection.close()
+
+    def __repr__(self) -> str:
+        return f"<ListingCache {self.path}: {len(self._listings)} directories>"
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are only held while loading and saving, so that the index can be used across forks
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(INDEX_SCHEMA)
+        return connection
+
+    def list(self, path: str) -> list:
+        """
+        List a directory, from the cache if it did not change since it was cached
+
+        Parameters
+        ----------
+        path : str
+            The directory
+
+        Returns
+        -------
+        list
+            A list of CachedEntry, sorted by name
+        """
+        key = os.path.abspath(path)
+        self._visited.add(key)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._listings.get(key)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            prefix = path if path.endswith(os.sep) else path + os.sep
+            return [CachedEntry(name, prefix + name, kind) for name, kind in json.loads(cached[1])]
+        self.misses += 1
+        entries = [
+            CachedEntry(entry.name, entry.path, "d" if entry.is_dir() else "f" if entry.is_file() else "o") for entry in _scandir(path)
+        ]
+        racy = time.time_ns() - mtime < RACY_MTIME_NS
+        self._changed[key] = (None if racy else mtime, json.dumps([[entry.name, entry.kind] for entry in entries]))
+        return entries
+
+    def save(self) -> None:
+        """
+        Write the listings of the directories that changed, and forget the directories that disappeared
+        """
+        removed = [(path,) for path in self._listings if path not in self._visited]
+        if not self._changed and not removed:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO directories (path, mtime, entries) VALUES (?, ?, ?)",
+                    [(path, mtime, entries) for path, (mtime, entries) in self._changed.items()],
+                )
+                connection.executemany("DELETE FROM directories WHERE path = ?", removed)
+        finally:
+            connection.close()
+        for path, _ in removed:
+            self._listings.pop(path)
+        self._listings.update(self._changed)
+        self._visited = set()
+        self._changed = {}
+
+
+class DatasetIndex:
+    """
+    An in-memory index of the subjects, sessions and files of a BIDS dataset,
+    built in a single walk of the directory tree
+
+    The files of the subjects are indexed with their entities, whether the
+    dataset has sessions or not. The files outside the subjects' directories
+    (e.g. dataset_description.json, derivatives/, sourcedata/, code/) are
+    only listed, so that they can be searched by name.
+
+    With a cache, the listings of the directories are saved to a SQLite
+    database, and the next index of the dataset only lists again the
+    directories modified since (see ``ListingCache``).
+    """
+
+    def __init__(self, root: Union[str, Path], cache: Union[str, Path] = None, journal_mode: str = JOURNAL_MODE):
+        """
+        Index a BIDS dataset
+
+        Parameters
+        ----------
+        root : Union[str, Path]
+            The root directory of the BIDS dataset
+        cache : Union[str, Path], optional
+            The path to the database caching the listings of the directories,
+            by default None (the whole tree is listed)
+        journal_mode : str, optional
+            The journal mode of the cache's database, by default JOURNAL_MODE ("WAL")
+        """
+        self.root = Path(root)
+        self.cache = cache
+        self.journal_mode = journal_mode
+        self.refresh()
+
+    def __repr__(self) -> str:
+        return f"<DatasetIndex {self.root}: {len(self.subjects)} subjects, {len(self.records)} files>"
+
+    def refresh(self) -> None:
+        """
+        (Re)build the index from the content of the dataset
+        """
+        # subject -> session -> datatype -> list of FileRecord
+        self.subjects = {}
+        self.subject_paths = {}
+        self.session_paths = {}
+        self.records = []
+        self.top_level = []
+        # the files outside the subjects' directories, at any depth
+        self.other_files = []
+        # entity -> value -> positions in self.records, built on the first query
+        self._postings = None
+        # the directories listed from the cache, and listed again
+        self.cache_hits = 0
+        self.cache_misses = 0
+        if not self.root.is_dir():
+            return
+        listings = ListingCache(self.cache, self.root, journal_mode=self.journal_mode) if self.cache is not None else None
+        self._list = listings.list if listings is not None else _scandir
+        try:
+            for entry in self._list(os.fspath(self.root)):
+                if not entry.name.startswith("sub-"):
+                    self.top_level.append(Path(entry.path))
+                    self._index_other(entry)
+                elif entry.is_dir():
+                    self._index_subject(entry)
+        finally:
+            self._list = _scandir
+        if listings is not None:
+            listings.save()
+            self.cache_hits, self.cache_misses = listings.hits, listings.misses
+
+    def update(self, sessions: list) -> None:
+        """
+        Index again some sessions (e.g. once they were copied or fixed), without walking the rest of the dataset
+
+        Parameters
+        ----------
+        sessions : list
+            The (subject, session) label pairs to index again; sessions whose
+            directory no longer exists are removed from the index
+        """
+        sessions = set(sessions)
+        self.records = [record for record in self.records if (record.subject, record.session) not in sessions]
+        self._postings = None
+        for subject, session in sorted(sessions):
+            subject_path = self.root / f"sub-{subject}"
+            path = subject_path / f"ses-{session}"
+            if not path.is_dir():
+                self.session_paths.pop((subject, session), None)
+                self.subjects.get(subject, {}).pop(session, None)
+                continue
+            self.subject_paths[subject] = subject_path
+            self.session_paths[(subject, session)] = path
+            datatypes = self.subjects.setdefault(subject, {})
+            datatypes[session] = {}
+            self._index_directory(os.fspath(path), subject, session, None, datatypes[session])
+            # new subjects and sessions are kept in the order of a full walk
+            self.subjects[subject] = dict(sorted(datatypes.items()))
+        self.subjects = dict(sorted(self.subjects.items()))
+
+    def _index_subject(self, subject_entry: os.DirEntry) -> None:
+        subject = subject_entry.name.split("-", 1)[-1]
+        self.subject_paths[subject] = Path(subject_entry.path)
+        sessions = self.subjects.setdefault(subject, {})
+        for entry in self._list(subject_entry.path):
+            if entry.name.startswith("ses-") and entry.is_dir():
+                session = entry.name.split("-", 1)[-1]
+                self.session_paths[(subject, session)] = Path(entry.path)
+                sessions[session] = {}
+                self._index_directory(entry.path, subject, session, None, sessions[session])
+            elif entry.is_dir():
+                # a dataset without sessions (e.g. sub-01/anat/sub-01_T1w.nii.gz)
+                self._index_directory(entry.path, subject, None, entry.name, {})
+            elif entry.is_file():
+                self._add(entry, subject, None, None)
+
+    def _index_other(self, entry: os.DirEntry) -> None:
+        if entry.is_dir():
+            for child in self._list(entry.path):
+                self._index_other(child)
+        elif entry.is_file():
+            self.other_files.append(Path(entry.path))
+
+    def _index_directory(self, path: str, subject: str, session: str, datatype: str, datatypes: dict) -> None:
+        for entry in self._list(path):
+            if entry.is_dir():
+                self._index_directory(entry.path, subject, session, datatype or entry.name, datatypes)
+            else:
+                datatypes.setdefault(datatype, []).append(self._add(entry, subject, session, datatype))
+
+    def _add(self, entry: os.DirEntry, subject: str, session: str, datatype: str) -> FileRecord:
+        entities = parse_entities(entry.name)
+        if datatype is not None:
+            entities["datatype"] = datatype
+        record = FileRecord(entry.path, subject, session, datatype, entities)
+        self.records.append(record)
+        return record
+
+    def sessions(self, subject: str) -> dict:
+        """
+        Get the sessions of a subject
+
+        Parameters
+        ----------
+        subject : str
+            The subject's label
+
+        Returns
+        -------
+        dict
+            A dictionary mapping session labels to session directories
+        """
+        return {session: self.session_paths[(subject, session)] for session in self.subjects.get(subject, {})}
+
+    def files(self, subject: str = None, session: str = None, datatype: str = None) -> list:
+        """
+        Get the indexed files, optionally restricted to a subject, session or datatype
+
+        Parameters
+        ----------
+        subject : str, optional
+            The subject's label, by default None
+        session : str, optional
+            The session's label, by default None
+        datatype : str, optional
+            The datatype (e.g. "dwi"), by default None
+
+        Returns
+        -------
+        list
+            A list of FileRecord
+        """
+        return [
+            record
+            for record in self.records
+            if (subject is None or record.subject == subject)
+            and (session is None or record.session == session)
+            and (datatype is None or record.datatype == datatype)
+        ]
+
+    def query(self, **entities) -> list:
+        """
+        Find the files whose entities have the given values
+
+        Queries are answered from inverted indexes of the entities, built on
+        the first query.
+
+        Parameters
+        ----------
+        **entities
+            The entities to match, named as in pybids (e.g. subject="01",
+            datatype="dwi", suffix="dwi", extension=".nii.gz", run=1). A list
+            of values matches any of them, and None matches the files without
+            the entity.
+
+        Returns
+        -------
+        list
+            A list of FileRecord, in the order of the index
+
+        Examples
+        --------
+        >>> index = DatasetIndex("/path/to/bids")  # doctest: +SKIP
+        >>> index.query(subject="01", suffix="dwi", extension=[".nii", ".nii.gz"])  # doctest: +SKIP
+        [<FileRecord /path/to/bids/sub-01/ses-1/dwi/sub-01_ses-1_dwi.nii.gz>]
+        """
+        if self._postings is None:
+            self._postings = self._build_postings()
+        if not entities:
+            return list(self.records)
+        candidates = []
+        for entity, value in entities.items():
+            postings = self._postings.get(entity, {})
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            positions = set()
+            for value in values:
+                if value is None:
+                    positions |= set(range(len(self.records))).difference(*postings.values())
+                else:
+                    positions |= postings.get(_normalize(entity, value), set())
+            candidates.append(positions)
+        # intersecting from the most selective entity keeps the intermediate sets small
+        candidates.sort(key=len)
+        matches = candidates[0].intersection(*candidates[1:])
+        return [self.records[position] for position in sorted(matches)]
+
+    def _build_postings(self) -> dict:
+        postings = {}
+        for position, record in enumerate(self.records):
+            for entity, value in record.entities.items():
+                postings.setdefault(entity, {}).setdefault(value, set()).add(position)
+        return postings
+
+
+def _normalize(entity: str, value) -> object:
+    """
+    Convert a queried value to the type it is indexed with (run numbers are integers)
+    """
+    if entity == "run" and isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def _scandir(path: Union[str, Path]) -> list:
+    with os.scandir(path) as it:
+        return sorted(it, key=lambda entry: entry.name)
@@ -1,14 +1,51 @@
+import collections
 import json
-import os
-import shutil
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable
 from typing import Union
 
-from bids.layout.validation import validate_root
-
+from bidsbase.manager.index import INDEX_NAME
+from bidsbase.manager.index import DatasetIndex
 from bidsbase.manager.session import COMMON_FIXES
+from bidsbase.manager.session import FIXES_VERSION
 from bidsbase.manager.session.session import Session
+from bidsbase.manager.session.session import fix_session
+from bidsbase.manager.utils.copy import copy_session
+from bidsbase.manager.utils.copy import copy_sessions
+from bidsbase.manager.utils.copy import copy_top_level_files
+from bidsbase.manager.utils.copy import get_copy_function
+from bidsbase.manager.utils.copy import get_file_copy_function
+from bidsbase.manager.utils.dedup import HASHES_NAME
+from bidsbase.manager.utils.dedup import DedupResult
+from bidsbase.manager.utils.dedup import deduplicate_tree
+from bidsbase.manager.utils.description import validate_root
+from bidsbase.manager.utils.lease import LEASE_POLL_INTERVAL
+from bidsbase.manager.utils.lease import LEASES_DIRECTORY
+from bidsbase.manager.utils.lease import LeaseDirectory
+from bidsbase.manager.utils.logger import WORKER_LOGGER_NAME
 from bidsbase.manager.utils.logger import initiate_logger
+from bidsbase.manager.utils.manifest import MANIFEST_NAME
+from bidsbase.manager.utils.manifest import TOP_LEVEL_KEY
+from bidsbase.manager.utils.manifest import Manifest
+from bidsbase.manager.utils.manifest import scan_files
+from bidsbase.manager.utils.metrics import Metrics
+from bidsbase.manager.utils.metrics import NullMetrics
+from bidsbase.manager.utils.metrics import get_progress
+from bidsbase.manager.utils.state import JOURNAL_MODE
+from bidsbase.manager.utils.state import SHARED_JOURNAL_MODE
+from bidsbase.manager.utils.state import STATE_NAME
+from bidsbase.manager.utils.state import RunState
+from bidsbase.manager.utils.state import fingerprint
+from bidsbase.manager.utils.watch import SessionWatcher
+
+# fix workers are started by a clean server process instead of being forked from the Manager, whose state
+# database connection must not be open in a child (nor its threads running, e.g. the leases' heartbeat)
+FIX_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
 
 
 class Manager:
@@ -23,6 +60,20 @@ class Manager:
         auto_fix: bool = True,
         work_dir: Union[str, Path] = None,
         stop_on_first_crash: bool = False,
+        jobs: int = 1,
+        copy_backend: str = "python",
+        copy_mode: str = "full",
+        checksum: bool = False,
+        json_logs: bool = False,
+        metrics: bool = False,
+        progress: bool = False,
+        participant_label: list = None,
+        session_label: list = None,
+        shard: tuple = None,
+        resume: bool = False,
+        auto_copy: bool = True,
+        run_id: str = None,
+        lease_ttl: float = 600.0,
     ):
         """
         Initialize a BIDS Manager
@@ -33,27 +84,99 @@ class Manager:
             The root directory of the BIDS dataset
         validate : bool, optional
             Whether to validate the BIDS dataset, by default True
+        jobs : int, optional
+            The number of sessions processed at the same time, by default 1
+        copy_backend : str, optional
+            The backend used to copy sessions ("python" or "rsync"), by default "python"
+        copy_mode : str, optional
+            How files are copied to the working copy ("full", "hardlink", "reflink" or "symlink"),
+            by default "full". Fixes never modify the source dataset, whatever the mode.
+        checksum : bool, optional
+            Whether to keep content hashes of the copied files in the manifest, so that
+            files whose content did not change are not copied again, by default False
+        json_logs : bool, optional
+            Whether to write the log as JSON lines instead of text, by default False
+        metrics : bool, optional
+            Whether to record the time spent in each stage and counters of the work done,
+            written to metrics.json and metrics.prom in the working directory, by default False
+        progress : bool, optional
+            Whether to display the progress of copies and fixes, by default False
+        participant_label : list, optional
+            The subjects to process (with or without the "sub-" prefix), by default all
+        session_label : list, optional
+            The sessions to process (with or without the "ses-" prefix), by default all
+        shard : tuple, optional
+            An (index, count) pair, to process only every count-th session starting
+            at index (0-based), so that several processes or nodes can split the
+            dataset between them. By default, all sessions are processed.
+            The databases of the working directory then use a rollback journal
+            instead of WAL, which only works on a single host.
+        resume : bool, optional
+            Whether to skip the sessions whose copy or fixes completed in a previous
+            run, as recorded in the run state database of the working directory.
+            Sessions that failed are processed again. By default False
+        auto_copy : bool, optional
+            Whether to create (or update) the working copy right away, by default True.
+            Ignored for cooperative runs (see ``run_id``).
+        run_id : str, optional
+            The identifier of a cooperative run (e.g. $SLURM_ARRAY_JOB_ID). The processes
+            given the same run id and working directory share the sessions through lease
+            files, each pulling the next free session (see ``process_dataset``).
+            As the processes may run on several hosts, the databases of the working
+            directory then use a rollback journal instead of WAL, which only works on
+            a single host. By default None, sessions are not leased.
+        lease_ttl : float, optional
+            How long the lease of a session outlives a process that stopped renewing it
+            (e.g. a node that crashed), in seconds, by default 600
         """
         self.work_dir = Path(work_dir) if work_dir is not None else Path(root).parent / "BIDSBase"
         self.work_dir.mkdir(parents=True, exist_ok=True)
         self.stop_on_first_crash = stop_on_first_crash
-        self.logger = initiate_logger(Path(root).parent, name="BIDSBase")
+        self.jobs = jobs
+        self.copy_backend = copy_backend
+        self.copy_mode = copy_mode
+        self.checksum = checksum
+        self.metrics = Metrics() if metrics else NullMetrics()
+        self.progress = progress
+        self.participant_label = [label.removeprefix("sub-") for label in participant_label or []]
+        self.session_label = [label.removeprefix("ses-") for label in session_label or []]
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise ValueError(f"Invalid shard {shard[0]}/{shard[1]}: the index must be between 0 and {shard[1] - 1}")
+        self.shard = shard
+        self.resume = resume
+        self.journal_mode = SHARED_JOURNAL_MODE if run_id is not None or shard is not None else JOURNAL_MODE
+        self.state = RunState(self.work_dir / STATE_NAME, journal_mode=self.journal_mode)
+        self.logger = initiate_logger(Path(root).parent, name="BIDSBase", json_lines=json_logs)
         self.logger.info(f"Initializing BIDS Manager for {root}")
+        self.run_id = run_id
+        self.leases = None
+        if run_id is not None:
+            self.leases = LeaseDirectory(self.work_dir / LEASES_DIRECTORY / run_id, ttl=lease_ttl, logger=self.logger)
         self.logger.info(f"Validating BIDS dataset: {validate}")
         try:
-            self.root, self.description = validate_root(root, validate=validate)
+            self.root, self.description = validate_root(root, validate=validate, logger=self.logger)
             self.logger.info("Successfully validated BIDS dataset:" + "\n" + json.dumps(self.description, indent=4))
         except Exception as e:
             self.logger.error(f"Failed to validate BIDS dataset: {e}")
             raise e
         self._copy_to = self.root.parent / f"{self.root.name}_BIDSBase" if copy_to is None else Path(copy_to)
         self.auto_fix = auto_fix
-        self.create_copy(force=force_copy)
+        self.copy_results = []
+        self.fix_errors = {}
+        self._source_index = None
+        self._copy_index = None
+        self._sessions = None
+        if auto_copy and self.leases is None:
+            self.create_copy(force=force_copy)
 
     def search(self, suffix: str) -> list:
         """
         Search for files with a specific suffix in the BIDS directory
 
+        The search is answered from the dataset's index and covers the whole
+        dataset: the subjects' directories, with or without sessions, and the
+        files outside of them (e.g. derivatives/, sourcedata/, code/).
+
         Parameters
         ----------
         suffix : str
@@ -64,56 +187,598 @@ class Manager:
         list
             A list of paths to files with the specified suffix
         """
-        return list(self.root.glob(f'**/*{suffix}'))
+        index = self.source_index
+        paths = [record.path for record in index.records] + index.other_files
+        return [path for path in paths if path.name.endswith(suffix)]
+
+    def query(self, **entities) -> list:
+        """
+        Find the files of the BIDS dataset whose entities have the given values
+
+        The query is answered from the dataset's index, without walking the
+        directory tree.
+
+        Parameters
+        ----------
+        **entities
+            The entities to match, named as in pybids (e.g. subject="01",
+            session="1", datatype="dwi", suffix="dwi", extension=".nii.gz", run=1).
+            A list of values matches any of them, and None matches the files
+            without the entity.
+
+        Returns
+        -------
+        list
+            A list of FileRecord, with the file's path and entities
+        """
+        return self.source_index.query(**entities)
+
+    def refresh(self) -> None:
+        """
+        Invalidate the cached indexes of the source dataset and its copy,
+        to pick up changes made outside of the Manager
+        """
+        self._source_index = None
+        self._copy_index = None
+        self._sessions = None
 
-    def create_copy(self, force=False):
+    def selected_sessions(self) -> list:
         """
-        Create a copy of the BIDS dataset in a new directory
+        Get the sessions to process, after applying the label filters and the shard
+
+        Sessions are sorted by subject and session, so that every process
+        splitting the dataset in shards agrees on the sessions of each shard.
+
+        Returns
+        -------
+        list
+            A list of (subject, session) label pairs
+        """
+        sessions = [
+            (subject, session)
+            for subject in self.subjects
+            if not self.participant_label or subject in self.participant_label
+            for session in self.source_index.sessions(subject)
+            if not self.session_label or session in self.session_label
+        ]
+        if self.shard is not None:
+            index, count = self.shard
+            sessions = sessions[index::count]
+        return sessions
+
+    @property
+    def source_index(self) -> DatasetIndex:
+        """
+        The (cached) index of the source BIDS dataset
+        """
+        if self._source_index is None:
+            with self.metrics.stage("index"):
+                self._source_index = DatasetIndex(self.root, cache=self.work_dir / INDEX_NAME, journal_mode=self.journal_mode)
+        return self._source_index
+
+    @property
+    def copy_index(self) -> DatasetIndex:
+        """
+        The (cached) index of the working copy of the dataset
+        """
+        if self._copy_index is None:
+            with self.metrics.stage("index"):
+                self._copy_index = DatasetIndex(self.copy_to, cache=self.work_dir / INDEX_NAME, journal_mode=self.journal_mode)
+        return self._copy_index
+
+    def create_copy(self, force=False, sessions: list = None, top_level: bool = True) -> list:
+        """
+        Create a copy of the BIDS dataset in a new directory, or bring an
+        existing copy up to date
+
+        Sessions are copied concurrently by up to ``self.jobs`` workers. The
+        files of each copied session are recorded in a manifest in the working
+        directory, so that later runs only copy new or changed files and remove
+        files that were removed from the source.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Whether to copy all sessions again from scratch, by default False
+        sessions : list, optional
+            The (subject, session) label pairs to copy, even if a previous run copied them,
+            by default ``self.selected_sessions()``
+        top_level : bool, optional
+            Whether to copy the files and directories at the top of the dataset too, by default True
+
+        Returns
+        -------
+        list
+            A list of CopyResult, one for each session
         """
         self.logger.info("Creating copy of BIDS dataset")
-        for subject in self.subjects:
-            for session in self.root.glob(f"sub-{subject}/ses-*"):
-                new_path = Path(self.copy_to / session.relative_to(self.root))
-                if new_path.exists() and not force:
-                    self.logger.info(f"Copy of session {session} already exists: {new_path}")
+        start = time.perf_counter()
+        copy_function = get_copy_function(self.copy_backend, self.copy_mode)
+        manifest = Manifest(self.work_dir / MANIFEST_NAME)
+        resume = self.resume and sessions is None
+        labels = sessions
+        sessions = [self.source_index.session_paths[key] for key in (self.selected_sessions() if sessions is None else sessions)]
+        if resume:
+            n_sessions = len(sessions)
+            sessions = [session for session in sessions if not self.state.is_done("copy", self._key(session, self.root))]
+            self.logger.info(f"Resuming: skipping {n_sessions - len(sessions)} sessions copied by a previous run")
+        sessions = [(session, self.copy_to / session.relative_to(self.root)) for session in sessions]
+        progress = get_progress(len(sessions), "Copying sessions", enabled=self.progress)
+        results = []
+        try:
+            copy_sessions(
+                sessions,
+                copy_function=copy_function,
+                logger=self.logger,
+                force=force,
+                jobs=self.jobs,
+                stop_on_first_crash=self.stop_on_first_crash,
+                manifest={source: manifest.get(source.relative_to(self.root).as_posix()) for source, _ in sessions},
+                file_copy_function=get_file_copy_function(self.copy_mode),
+                checksum=self.checksum,
+                metrics=self.metrics,
+                progress=progress,
+                results=results,
+            )
+        finally:
+            # with stop_on_first_crash, the sessions copied before the crash are still recorded
+            progress.close()
+            for result in results:
+                if not result.failed:
+                    manifest.update(self._key(result.source, self.root), result.entries)
+            manifest.save()
+            for result in results:
+                if result.failed:
+                    self.state.record("copy", self._key(result.source, self.root), "failed", error=str(result.error))
+                else:
+                    self.state.record("copy", self._key(result.source, self.root), "done", fingerprint=fingerprint(result.entries))
+        self.copy_to.mkdir(parents=True, exist_ok=True)
+        # with shards, the first one copies the top-level files, so the shards do not race on them
+        if top_level and (self.shard is None or self.shard[0] == 0):
+            self._copy_top_level(copy_function, manifest, force)
+        n_failed = len([result for result in results if result.failed])
+        if n_failed:
+            self.logger.warning(f"Failed to copy {n_failed} out of {len(results)} sessions")
+        self.logger.info(
+            "Successfully created copy of BIDS dataset: "
+            f"{len([result for result in results if result.status == 'copied'])} sessions copied, "
+            f"{len([result for result in results if result.status == 'updated'])} updated "
+            f"({sum(len(result.added) + len(result.changed) for result in results if result.status == 'updated')} files copied, "
+            f"{sum(len(result.removed) for result in results)} removed)"
+        )
+        self.copy_results = results
+        if labels is None:
+            self._copy_index = None
+            self._sessions = None
+        else:
+            # e.g. a batch of process_dataset: the rest of the copy did not change, so it is not indexed again
+            self._update_copy_index(labels)
+        self.metrics.add_time("create_copy", time.perf_counter() - start)
+        self.metrics.save(self.work_dir)
+        return results
+
+    def _copy_top_level(self, copy_function: Callable, manifest: Manifest, force: bool = False) -> None:
+        """
+        Copy the entries at the root of the dataset other than the subjects
+        (e.g. dataset_description.json, derivatives/), or bring their copies up to date
+
+        As for sessions, only the files that changed since the previous copy
+        are copied. The directories are recorded in the manifest under their
+        name, and the files under ".".
+        """
+        file_copy_function = get_file_copy_function(self.copy_mode)
+        results = {
+            TOP_LEVEL_KEY: copy_top_level_files(
+                self.root, self.copy_to, force, manifest.get(TOP_LEVEL_KEY), file_copy_function, self.checksum
+            )
+        }
+        for directory in sorted(self.root.iterdir()):
+            if directory.name.startswith("sub-") or not directory.is_dir():
+                continue
+            results[directory.name] = copy_session(
+                directory,
+                self.copy_to / directory.name,
+                copy_function,
+                force,
+                manifest.get(directory.name),
+                file_copy_function,
+                self.checksum,
+            )
+        for key, result in results.items():
+            if not result.failed:
+                manifest.update(key, result.entries)
+        manifest.save()
+        for result in results.values():
+            if result.failed:
+                self.logger.error(f"Failed to copy {result.source}: {result.error}")
+                raise result.error
+
+    def deduplicate(self) -> DedupResult:
+        """
+        Replace the files of the working copy that are identical to others
+        (e.g. repeated localizers or shared sidecars) by hard links
+
+        Only files of the same size are hashed, and their hashes are kept in
+        the working directory, so that later passes only hash new or changed
+        files. Fixes replace files instead of writing them in place, so they
+        never change the other links of a file.
+
+        Returns
+        -------
+        DedupResult
+            The number of files seen, hashed and linked, and the disk space reclaimed
+        """
+        self.logger.info(f"Deduplicating the working copy {self.copy_to}")
+        with self.metrics.stage("deduplicate"):
+            result = deduplicate_tree(
+                self.copy_to, cache=self.work_dir / HASHES_NAME, logger=self.logger, journal_mode=self.journal_mode
+            )
+        self.metrics.count("files_hashed", result.hashed)
+        self.metrics.count("files_deduplicated", result.linked)
+        self.metrics.count("bytes_reclaimed", result.bytes_reclaimed)
+        self.metrics.save(self.work_dir)
+        self._copy_index = None
+        self._sessions = None
+        return result
+
+    def process_dataset(self, fix: bool = True, batch_size: int = None) -> dict:
+        """
+        Copy and fix the dataset cooperatively with the other processes of the run
+
+        The sessions are pulled in batches: this process takes the lease of
+        the next free sessions, copies and fixes them, and marks their leases
+        as done (or failed) so that the other processes skip them. Sessions
+        leased by other processes are retried once this process runs out of
+        free sessions, until they are done or their lease expires (their
+        holder died) and they can be taken over. The first process to take
+        the lease of the top-level files copies them.
+
+        Parameters
+        ----------
+        fix : bool, optional
+            Whether to fix the sessions after copying them, by default True
+        batch_size : int, optional
+            The number of sessions leased at a time, by default four per job
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the sessions fixed by this process to their changed files
+        """
+        if self.leases is None:
+            raise ValueError("Cooperative processing needs a run id")
+        batch_size = batch_size if batch_size is not None else 4 * self.jobs
+        self.logger.info(f"Processing BIDS dataset cooperatively as {self.leases.owner} (run {self.run_id})")
+        summary = {}
+        copy_results = []
+        remaining = collections.deque(self.selected_sessions())
+        waiting = collections.deque()
+        try:
+            if self.leases.acquire("top-level"):
+                copy_results += self.create_copy(sessions=[])
+                self.leases.release("top-level", "done")
+            while remaining or waiting:
+                if not remaining:
+                    # only sessions leased by other processes are left, wait for them to finish or expire
+                    time.sleep(min(LEASE_POLL_INTERVAL, self.leases.heartbeat))
+                    remaining, waiting = waiting, collections.deque()
+                batch = []
+                while remaining and len(batch) < batch_size:
+                    session = remaining.popleft()
+                    key = self._key(self.source_index.session_paths[session], self.root)
+                    if self.leases.acquire(key):
+                        batch.append((session, key))
+                    elif not self.leases.is_final(key):
+                        waiting.append(session)
+                if not batch:
                     continue
-                elif new_path.exists() and force:
-                    self.logger.info(f"Removing existing copy of session {session}")
-                    shutil.rmtree(new_path)
-                self.logger.info(f"Copying session {session} to {new_path}")
-                new_path.mkdir(parents=True, exist_ok=True)
-                os.system(f"rsync -azPL {session}/* {new_path}")
-                self.logger.info(f"Successfully copied session {session} to {new_path}")
-        for additional_file in self.root.glob("*"):
-            if not additional_file.name.startswith("sub-*"):
-                os.system(f"rsync -azPL {additional_file} {self.copy_to}")
-        self.logger.info("Successfully created copy of BIDS dataset")
-
-    def fix_dataset(self):
+                self.metrics.count("sessions_leased", len(batch))
+                results = self.create_copy(sessions=[session for session, _ in batch], top_level=False)
+                copy_results += results
+                failed = {self._key(result.source, self.root) for result in results if result.failed}
+                if fix:
+                    summary.update(self.fix_dataset(sessions=[session for session, key in batch if key not in failed]))
+                    failed |= {self._key(path, self.copy_to) for path in self.fix_errors}
+                for _, key in batch:
+                    self.leases.release(key, "failed" if key in failed else "done")
+        finally:
+            # sessions left unprocessed (e.g. on a crash) can be taken by the other processes
+            self.leases.close()
+        self.copy_results = copy_results
+        return summary
+
+    def fix_dataset(self, jobs: int = None, force: bool = False, sessions: list = None) -> dict:
         """
         Fix the BIDS dataset according to known issues
+
+        With more than one job, sessions are fixed in a pool of processes.
+        The workers send their log records and changed files back to this
+        process, which logs them and writes the summaries in the order of the
+        sessions.
+
+        Once fixed, a session's fingerprint (the names, sizes and modification
+        times of its files, and the version of the fixes) is written to
+        ``fingerprint.json`` in its working directory. Sessions whose
+        fingerprint did not change since are skipped without running the fixes.
+
+        Parameters
+        ----------
+        jobs : int, optional
+            The number of sessions fixed at the same time, by default ``self.jobs``
+        force : bool, optional
+            Whether to run the fixes on unchanged sessions too, by default False
+        sessions : list, optional
+            The (subject, session) label pairs to fix, even if a previous run fixed them,
+            by default ``self.selected_sessions()``
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the fixed sessions' paths to their changed files
         """
+        jobs = self.jobs if jobs is None else jobs
+        if jobs > 1 and not self.auto_fix:
+            raise ValueError("Fixes can only run in parallel with auto_fix=True, as they may ask for user input otherwise")
         self.logger.info("Fixing BIDS dataset")
-        for subject in self.subjects:
-            for session in self.sessions[subject].values():
+        start = time.perf_counter()
+        resume = self.resume and sessions is None
+        selected = sessions
+        sessions = [
+            self.sessions[subject][session]
+            for subject, session in (self.selected_sessions() if sessions is None else sessions)
+            if session in self.sessions.get(subject, {})
+        ]
+        if resume:
+            n_sessions = len(sessions)
+            sessions = [session for session in sessions if not self.state.is_done("fix", self._key(session.path, self.copy_to))]
+            self.logger.info(f"Resuming: skipping {n_sessions - len(sessions)} sessions fixed by a previous run")
+        if not force:
+            n_sessions = len(sessions)
+            with self.metrics.stage("fingerprint"):
+                sessions = [session for session in sessions if not self._is_unchanged(session)]
+            self.metrics.count("sessions_unchanged", n_sessions - len(sessions))
+            self.logger.info(f"Skipping {n_sessions - len(sessions)} sessions unchanged since they were fixed")
+        summary = {}
+        progress = get_progress(len(sessions), "Fixing sessions", enabled=self.progress)
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context(FIX_START_METHOD)) as executor:
+                futures = [
+                    executor.submit(
+                        fix_session, session.path, self.FIXES, self.auto_fix, self._journal_dir(session), self.metrics.enabled
+                    )
+                    for session in sessions
+                ]
+                # results are handled in submission order, so the log stays ordered by session
+                for session, future in zip(sessions, futures):
+                    result = future.result()
+                    for record in result.records:
+                        record.name = self.logger.name + record.name[len(WORKER_LOGGER_NAME):]
+                        self.logger.handle(record)
+                    session.fixed = result.fixed
+                    self.metrics.merge(result.metrics)
+                    progress.update()
+                    try:
+                        self._handle_fix_result(session, result.changed_files, result.error, summary)
+                    except Exception:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+        else:
+            for session in sessions:
+                changed_files, error = {}, None
                 try:
-                    changed_files = session.fix(fixes=self.FIXES)
+                    with self.metrics.stage("fix_session"):
+                        changed_files = session.fix(fixes=self.FIXES, journal_dir=self._journal_dir(session))
                 except Exception as e:
-                    self.logger.error(f"Failed to fix BIDS dataset for subject {subject}, " f"session {session}: {e}")
-                    if self.stop_on_first_crash:
-                        raise e
+                    error = e
+                progress.update()
+                self._handle_fix_result(session, changed_files, error, summary)
+        progress.close()
+        # the fixes renamed and removed files in the copy
+        if selected is None:
+            self._copy_index = None
+        elif self._copy_index is not None:
+            self._copy_index.update(selected)
+        self.metrics.add_time("fix_dataset", time.perf_counter() - start)
+        self.metrics.save(self.work_dir)
+        return summary
+
+    def watch(self, quiet: float = 60.0, interval: float = 5.0, stop: threading.Event = None, use_inotify: bool = True) -> None:
+        """
+        Copy and fix the sessions arriving in (or changing in) the source dataset, until stopped
+
+        A watcher thread puts the sessions that stopped changing for ``quiet``
+        seconds in a work queue, and they are copied and fixed in batches, so
+        that changes keep being collected while a batch is processed. Only the
+        sessions selected by the label filters and the shard are processed.
+        The sessions present when the watch starts are not processed unless
+        they change: copy and fix the dataset first.
+
+        Parameters
+        ----------
+        quiet : float, optional
+            How long a session must not change before it is processed, in seconds, by default 60
+        interval : float, optional
+            How often the dataset is polled when inotify is not available, in seconds, by default 5
+        stop : threading.Event, optional
+            An event stopping the watch once set, by default the watch runs until interrupted
+        use_inotify : bool, optional
+            Whether to use inotify when it is available, by default True
+        """
+        stop = stop if stop is not None else threading.Event()
+        arrivals = queue.Queue()
+        errors = []
+        watcher = SessionWatcher(self.root, quiet=quiet, interval=interval, logger=self.logger, use_inotify=use_inotify)
+        self.logger.info(f"Watching {self.root} for new sessions: {watcher}")
+
+        def collect():
+            try:
+                while not stop.is_set():
+                    for session in watcher.poll(timeout=min(interval, quiet)):
+                        arrivals.put(session)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                watcher.close()
+
+        thread = threading.Thread(target=collect, name="bidsbase-watch", daemon=True)
+        thread.start()
+        try:
+            while not stop.is_set():
+                try:
+                    batch = [arrivals.get(timeout=interval)]
+                except queue.Empty:
                     continue
-                if session.fixed:
-                    session_work_dir = self.work_dir / session.path.relative_to(self.copy_to)
-                    session_work_dir.mkdir(parents=True, exist_ok=True)
-                    self.logger.info(
-                        f"Fixed BIDS dataset for subject {subject}, "
-                        f"session {session}.\n"
-                        "Summary of changed files can be located at "
-                        f"{session_work_dir / 'fixes.json'}",
-                    )
-                    with open(session_work_dir / "fixes.json", "w") as f:
-                        json.dump(changed_files, f, indent=4)
+                while not arrivals.empty():
+                    batch.append(arrivals.get_nowait())
+                self._process_arrivals(batch)
+        finally:
+            stop.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _process_arrivals(self, sessions: list) -> None:
+        """
+        Copy and fix the sessions reported by the watcher
+        """
+        # only the reported sessions changed, the rest of the dataset is not indexed again
+        if self._source_index is not None:
+            self._source_index.update(sessions)
+        selected = set(self.selected_sessions())
+        sessions = sorted(session for session in set(sessions) if session in selected)
+        if not sessions:
+            return
+        labels = ", ".join(f"sub-{sub}/ses-{ses}" for sub, ses in sessions)
+        self.logger.info(f"Processing {len(sessions)} new or changed sessions: {labels}")
+        results = self.create_copy(sessions=sessions)
+        failed = {result.source for result in results if result.failed}
+        self.fix_dataset(sessions=[session for session in sessions if self.source_index.session_paths[session] not in failed])
+
+    def plan_dataset(self, source: bool = False) -> dict:
+        """
+        Plan the fixes of every session of the dataset, without changing it
+
+        Parameters
+        ----------
+        source : bool, optional
+            Whether to plan the fixes on the source dataset instead of the
+            working copy, e.g. before copying it, by default False
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the sessions' paths to their plans
+        """
+        self.logger.info("Planning fixes of BIDS dataset")
+        plans = {}
+        total = {"operations": 0, "files": 0, "bytes": 0}
+        for subject, label in self.selected_sessions():
+            if source:
+                path = self.source_index.session_paths[(subject, label)]
+                session = Session(path=path, auto_fix=self.auto_fix, logger=self.logger, metrics=self.metrics)
+            elif label in self.sessions.get(subject, {}):
+                session = self.sessions[subject][label]
+            else:
+                continue
+            # the working copy's journals are recovered too, so the plans start from a consistent copy
+            plan = session.plan(fixes=self.FIXES, journal_dir=None if source else self._journal_dir(session))
+            if not plan.operations:
+                continue
+            plans[session.path] = plan
+            for key, value in plan.cost().items():
+                total[key] += value
+        self.logger.info(
+            f"Planned {total['operations']} operations in {len(plans)} sessions, "
+            f"touching {total['files']} files and {total['bytes']} bytes"
+        )
+        return plans
+
+    def _update_copy_index(self, sessions: list) -> None:
+        """
+        Index again some sessions of the working copy, and their Session objects, once they were copied
+        """
+        if self._copy_index is not None:
+            self._copy_index.update(sessions)
+        if self._sessions is None:
+            return
+        for subject, label in sessions:
+            path = self.copy_to / f"sub-{subject}" / f"ses-{label}"
+            if not path.is_dir():
+                self._sessions.get(subject, {}).pop(label, None)
+            elif label not in self._sessions.get(subject, {}):
+                session = Session(path=path, auto_fix=self.auto_fix, logger=self.logger, metrics=self.metrics)
+                self._sessions[subject] = dict(sorted({**self._sessions.get(subject, {}), label: session}.items()))
+        self._sessions = dict(sorted(self._sessions.items()))
+
+    @staticmethod
+    def _key(path: Path, root: Path) -> str:
+        """
+        Get the key of a session in the manifest and the run state: its path relative to the dataset's root
+        """
+        return path.relative_to(root).as_posix()
+
+    def _session_work_dir(self, session: Session) -> Path:
+        """
+        Get the directory of a session's summaries in the working directory
+        """
+        return self.work_dir / session.path.relative_to(self.copy_to)
+
+    def _fingerprint(self, session: Session) -> str:
+        """
+        Compute the fingerprint of a session of the working copy, for the current fixes
+        """
+        fixes = [f"{fix.__module__}.{fix.__qualname__}" for fix in self.FIXES]
+        return fingerprint({"files": scan_files(session.path), "fixes": fixes, "version": FIXES_VERSION})
+
+    def _is_unchanged(self, session: Session) -> bool:
+        """
+        Whether a session was fixed and did not change since
+        """
+        target = self._session_work_dir(session) / "fingerprint.json"
+        if not target.exists():
+            return False
+        with open(target, "r") as f:
+            recorded = json.load(f)
+        return recorded.get("fingerprint") == self._fingerprint(session)
+
+    def _journal_dir(self, session: Session) -> Path:
+        """
+        Get the directory of a session's journal in the working directory
+        """
+        return self.work_dir / "journal" / session.path.relative_to(self.copy_to)
+
+    def _handle_fix_result(self, session: Session, changed_files: dict, error: Exception, summary: dict) -> None:
+        """
+        Log the outcome of fixing a session and write its summary of changed files
+        """
+        subject = session.path.parent.name.split("-", 1)[-1]
+        key = self._key(session.path, self.copy_to)
+        session_work_dir = self._session_work_dir(session)
+        if error is not None:
+            (session_work_dir / "fingerprint.json").unlink(missing_ok=True)
+            self.logger.error(f"Failed to fix BIDS dataset for subject {subject}, " f"session {session}: {error}")
+            self.fix_errors[session.path] = error
+            self.state.record("fix", key, "failed", error=str(error))
+            if self.stop_on_first_crash:
+                raise error
+            return
+        session_work_dir.mkdir(parents=True, exist_ok=True)
+        if session.fixed:
+            self.logger.info(
+                f"Fixed BIDS dataset for subject {subject}, "
+                f"session {session}.\n"
+                "Summary of changed files can be located at "
+                f"{session_work_dir / 'fixes.json'}",
+            )
+            with open(session_work_dir / "fixes.json", "w") as f:
+                json.dump(changed_files, f, indent=4)
+            summary[session.path] = changed_files
+        session_fingerprint = self._fingerprint(session)
+        with open(session_work_dir / "fingerprint.json", "w") as f:
+            json.dump({"version": FIXES_VERSION, "fingerprint": session_fingerprint}, f, indent=4)
+        self.state.record("fix", key, "done", fingerprint=session_fingerprint, outputs=changed_files)
 
     @property
     def subjects(self) -> list:
@@ -125,25 +790,29 @@ class Manager:
         list
             A list of subjects
         """
-        return [i.name.split("-")[-1] for i in self.root.glob("sub-*")]
+        return list(self.source_index.subjects)
 
     @property
     def sessions(self) -> dict:
         """
         Get a dictionary of sessions for each subject in the BIDS dataset
 
+        The Session objects are cached until the next call to ``refresh``.
+
         Returns
         -------
         dict
             A dictionary of sessions for each subject
         """
-        return {
-            subject: {
-                i.name.split("-")[-1]: Session(path=i, auto_fix=self.auto_fix, logger=self.logger)
-                for i in self.copy_to.glob(f"sub-{subject}/ses-*")
+        if self._sessions is None:
+            self._sessions = {
+                subject: {
+                    session: Session(path=path, auto_fix=self.auto_fix, logger=self.logger, metrics=self.metrics)
+                    for session, path in self.copy_index.sessions(subject).items()
+                }
+                for subject in self.subjects
             }
-            for subject in self.subjects
-        }
+        return self._sessions
 
     @property
     def copy_to(self):
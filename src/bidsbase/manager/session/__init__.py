@@ -1,3 +1,7 @@
 from bidsbase.manager.session.common_fixes import fix_multiple_dwi_runs
+from bidsbase.manager.session.common_fixes import normalize_nifti_compression
 
-COMMON_FIXES = [fix_multiple_dwi_runs]
+# the images are converted last, so that the images removed by the other fixes are not converted
+COMMON_FIXES = [fix_multiple_dwi_runs, normalize_nifti_compression]
+# bump whenever a fix changes what it detects or how it fixes it, so that fixed sessions are checked again
+FIXES_VERSION = 2
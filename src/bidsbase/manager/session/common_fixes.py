@@ -1,16 +1,47 @@
-import json
+import importlib.util
 import logging
 import subprocess
 from pathlib import Path
 from typing import Union
 
-from bids.layout import parse_file_entities
+from bidsbase.manager.session.fieldmaps import FieldmapIndex
+from bidsbase.manager.session.plan import Plan
+from bidsbase.manager.session.snapshot import SessionSnapshot
+from bidsbase.manager.session.snapshot import stem
+from bidsbase.manager.utils.nifti import compress_file
+from bidsbase.manager.utils.nifti import decompress_file
+from bidsbase.manager.utils.nifti import get_n_volumes
+from bidsbase.manager.utils.nifti import mean_b0
+from bidsbase.manager.utils.sidecars import read_json
+from bidsbase.manager.utils.sidecars import write_json
+
+NIFTI_EXTENSIONS = (".nii", ".nii.gz")
+
+
+def find_images(snapshot: SessionSnapshot, **entities) -> list:
+    """
+    Find the NIfTI images of a session whose entities have the given values
+
+    Parameters
+    ----------
+    snapshot : SessionSnapshot
+        The snapshot of the session
+    **entities
+        The entities to match (e.g. datatype="dwi", suffix="dwi")
+
+    Returns
+    -------
+    list
+        A sorted list of paths
+    """
+    return [path for path in snapshot.query(**entities) if snapshot.entities(path).get("extension") in NIFTI_EXTENSIONS]
 
 
 def update_fieldmap_json(
     files_mapping: dict,
     logger: logging.Logger,
     session_path: Union[str, Path],
+    plan: Plan = None,
 ) -> None:
     """
     Update the IntendedFor field of the fieldmap json files
@@ -23,38 +54,29 @@ def update_fieldmap_json(
         The logger
     session_path : Union[str, Path]
         The path to the session directory
+    plan : Plan, optional
+        The session's plan, whose fieldmap index is updated and written when
+        the plan is executed. By default, the fieldmaps are indexed and
+        written right away.
 
     Returns
     -------
     None
     """
     logger.info(f"Updating fieldmap json files in {session_path}")
-    session_path = Path(session_path)
-    for fieldmap_json in session_path.glob("fmap/*.json"):
-        with open(fieldmap_json, "r") as f:
-            fieldmap_json_dict = json.load(f)
-        if "IntendedFor" in fieldmap_json_dict:
-            intended_for = fieldmap_json_dict["IntendedFor"]
-            for key, val in files_mapping.items():
-                intended_for_key = str(Path(key).relative_to(session_path.parent))
-                if intended_for_key in intended_for:
-                    if val is not None:
-                        intended_for_val = str(Path(val).relative_to(session_path.parent))
-                        logger.info(f"Updating {intended_for_key} to {intended_for_val}")
-                        intended_for[intended_for.index(intended_for_key)] = intended_for_val
-                    else:
-                        logger.info(f"Removing {intended_for_key} from {fieldmap_json}")
-                        intended_for.remove(intended_for_key)
-            fieldmap_json_dict["IntendedFor"] = intended_for
-            with open(fieldmap_json, "w") as f:
-                json.dump(fieldmap_json_dict, f, indent=4)
-            logger.info(f"Updated {fieldmap_json}")
+    if plan is not None:
+        plan.fieldmaps.apply(files_mapping)
+        return
+    fieldmaps = FieldmapIndex(session_path, logger=logger)
+    fieldmaps.apply(files_mapping)
+    fieldmaps.flush()
 
 
 def fix_multiple_dwi_runs(
     logger: logging.Logger,
     session_path: Union[str, Path],
     auto_fix: bool = True,
+    plan: Plan = None,
 ) -> bool:
     """
     Fix multiple DWI runs in a session directory
@@ -67,6 +89,9 @@ def fix_multiple_dwi_runs(
         The path to the session directory
     auto_fix : bool, optional
         Whether to automatically fix the issue, by default False
+    plan : Plan, optional
+        The session's plan, to which the fix adds its operations. By default,
+        the fix plans its operations and executes them right away.
 
     Returns
     -------
@@ -77,17 +102,18 @@ def fix_multiple_dwi_runs(
     files_mapping = {}
     logger.info(f"Searching for multiple DWI runs in {session_path}")
     session_path = Path(session_path)
-    dwi_runs = list(session_path.glob("dwi/*run*_dwi.nii*"))
+    execute = plan is None
+    plan = Plan(session_path, logger=logger) if execute else plan
+    snapshot = plan.snapshot
+    dwi_runs = [dwi for dwi in find_images(snapshot, datatype="dwi", suffix="dwi") if "run" in snapshot.entities(dwi)]
     n_runs = len(dwi_runs)
     if n_runs == 0:
         logger.info(f"No multiple DWI runs found in {session_path}. Skipping...")
     if n_runs > 1:
         logger.warning(f"Multiple DWI runs found in {session_path}. Fixing...")
         logger.info(f"Configuration for fix_multiple_dwi_runs:\nauto_fix={auto_fix}")
-        # locate the number of volumes in each run by looking at the corresponding .bval file
-        dwi_volumes = [
-            len(Path(dwi_run.parent / dwi_run.name.split(".")[0]).with_suffix(".bval").read_text().split()) for dwi_run in dwi_runs
-        ]
+        # locate the number of volumes in each run from the image headers
+        dwi_volumes = [count_dwi_volumes(snapshot.physical(dwi_run), logger) for dwi_run in dwi_runs]
         # sort the volumns and runs by number of volumes
         dwi_runs, dwi_volumes = zip(*sorted(zip(dwi_runs, dwi_volumes), key=lambda x: x[1]))
         if not auto_fix:
@@ -107,27 +133,160 @@ def fix_multiple_dwi_runs(
             + f"\nChosen run: {choice}"
         )
         logger.info(fix_message)
-        files_mapping = rename_dwi(dwi_runs[choice - 1])
+        files_mapping = rename_dwi(dwi_runs[choice - 1], plan=plan)
         logger.info(f"Renamed {files_mapping}")
         # remove the other runs
         for dwi_run in dwi_runs:
-            for associated_file in dwi_run.parent.glob(f"{dwi_run.name.split('.')[0]}*"):
+            for associated_file in snapshot.associated(dwi_run):
                 logger.info(f"Removing {associated_file}")
-                associated_file.unlink()
+                plan.delete(associated_file)
                 files_mapping[associated_file] = None
-        update_fieldmap_json(files_mapping, logger, session_path)
+        update_fieldmap_json(files_mapping, logger, session_path, plan=plan)
+        fixed = True
+    if execute:
+        plan.execute()
+    return fixed, files_mapping
+
+
+def normalize_nifti_compression(
+    logger: logging.Logger,
+    session_path: Union[str, Path],
+    auto_fix: bool = True,
+    plan: Plan = None,
+    compress: bool = True,
+) -> tuple:
+    """
+    Compress the uncompressed NIfTI images of a session (or the reverse)
+
+    Each image is streamed into its new file, then removed. The images are
+    compressed in blocks, in parallel, into standard gzip files.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger
+    session_path : Union[str, Path]
+        The path to the session directory
+    auto_fix : bool, optional
+        Unused, the images are always converted, by default True
+    plan : Plan, optional
+        The session's plan, to which the fix adds its operations. By default,
+        the fix plans its operations and executes them right away.
+    compress : bool, optional
+        Whether to compress the .nii images, or to decompress the .nii.gz ones
+        (see ``decompress_nifti_images``), by default True
+
+    Returns
+    -------
+    tuple
+        Whether the session directory was fixed, and a dictionary mapping the
+        old file names to the new file names
+    """
+    fixed = False
+    files_mapping = {}
+    extension, new_extension = (".nii", ".nii.gz") if compress else (".nii.gz", ".nii")
+    logger.info(f"Searching for {extension} images in {session_path}")
+    session_path = Path(session_path)
+    execute = plan is None
+    plan = Plan(session_path, logger=logger) if execute else plan
+    snapshot = plan.snapshot
+    for image in snapshot.query(extension=extension):
+        new_image = image.with_name(f"{stem(image)}{new_extension}")
+        if snapshot.exists(new_image):
+            logger.warning(f"Both {image} and {new_image} exist, leaving them as they are")
+            continue
+        plan.create(new_image, compress_file if compress else decompress_file, reads=[image], in_file=image, out_file=new_image)
+        plan.delete(image)
+        files_mapping[image] = new_image
+        logger.info(f"Planned the conversion of {image} to {new_image}")
+    if files_mapping:
+        update_fieldmap_json(files_mapping, logger, session_path, plan=plan)
         fixed = True
+    else:
+        logger.info(f"No {extension} images found in {session_path}. Skipping...")
+    if execute:
+        plan.execute()
     return fixed, files_mapping
 
 
-def rename_dwi(dwi_file: Union[str, Path]) -> str:
+def decompress_nifti_images(
+    logger: logging.Logger,
+    session_path: Union[str, Path],
+    auto_fix: bool = True,
+    plan: Plan = None,
+) -> tuple:
+    """
+    Decompress the .nii.gz images of a session, the reverse of ``normalize_nifti_compression``
+
+    Use it in place of ``normalize_nifti_compression`` in the list of fixes
+    (e.g. ``Manager.FIXES``) for tools that only read uncompressed images.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger
+    session_path : Union[str, Path]
+        The path to the session directory
+    auto_fix : bool, optional
+        Unused, the images are always converted, by default True
+    plan : Plan, optional
+        The session's plan, to which the fix adds its operations. By default,
+        the fix plans its operations and executes them right away.
+
+    Returns
+    -------
+    tuple
+        Whether the session directory was fixed, and a dictionary mapping the
+        old file names to the new file names
+    """
+    return normalize_nifti_compression(logger, session_path, auto_fix=auto_fix, plan=plan, compress=False)
+
+
+def count_dwi_volumes(dwi_file: Union[str, Path], logger: logging.Logger) -> int:
+    """
+    Count the volumes of a DWI file from its NIfTI header, cross-checked with its .bval file
+
+    Parameters
+    ----------
+    dwi_file : Union[str, Path]
+        The path to the DWI file
+    logger : logging.Logger
+        The logger
+
+    Returns
+    -------
+    int
+        The number of volumes
+    """
+    dwi_file = Path(dwi_file)
+    bval = get_bvec_bval_json(dwi_file)[1]
+    n_bvals = len(bval.read_text().split()) if bval.exists() else None
+    try:
+        n_volumes = get_n_volumes(dwi_file)
+    except (OSError, ValueError) as e:
+        if n_bvals is None:
+            raise ValueError(f"Could not count the volumes of {dwi_file}: {e}") from e
+        logger.warning(f"Could not read the header of {dwi_file} ({e}), counting the volumes of {bval} instead")
+        return n_bvals
+    if n_bvals is not None and n_bvals != n_volumes:
+        logger.warning(f"{dwi_file} has {n_volumes} volumes, but {bval} holds {n_bvals} b-values")
+    return n_volumes
+
+
+def rename_dwi(dwi_file: Union[str, Path], plan: Plan = None) -> str:
     """
     Rename a DWI file to the BIDS standard
 
+    Renaming only changes the working copy's directory entries, so it is safe
+    even when the files are linked to the source dataset.
+
     Parameters
     ----------
     dwi_file : Union[str, Path]
         The path to the DWI file
+    plan : Plan, optional
+        The session's plan, to which the renames are added. By default, the
+        files are renamed right away.
 
     Returns
     -------
@@ -135,12 +294,16 @@ def rename_dwi(dwi_file: Union[str, Path]) -> str:
         A dictionary mapping the old file names to the new file names
     """
     dwi_file = Path(dwi_file)
+    execute = plan is None
+    plan = Plan(dwi_file.parent.parent, logger=logging.getLogger(__name__)) if execute else plan
     files_mapping = {}
-    for associated_file in dwi_file.parent.glob(f"{dwi_file.name.split('.')[0]}*"):
-        run = parse_file_entities(str(associated_file)).get("run")
-        new_name = associated_file.name.replace(f"_run-{run}", "")
-        associated_file.rename(associated_file.parent / new_name)
+    for associated_file in plan.snapshot.associated(dwi_file):
+        stem, dot, extension = associated_file.name.partition(".")
+        new_name = "_".join(part for part in stem.split("_") if not part.startswith("run-")) + dot + extension
+        plan.rename(associated_file, associated_file.parent / new_name)
         files_mapping[associated_file] = associated_file.parent / new_name
+    if execute:
+        plan.execute()
     return files_mapping
 
 
@@ -148,6 +311,7 @@ def generate_fieldmap_from_dwi(
     logger: logging.Logger,
     session_path: Union[str, Path],
     auto_fix: bool = True,
+    plan: Plan = None,
 ):
     """
     Generate a fieldmap from a DWI file
@@ -160,6 +324,9 @@ def generate_fieldmap_from_dwi(
         The path to the session directory
     auto_fix : bool, optional
         Whether to automatically fix the issue, by default False
+    plan : Plan, optional
+        The session's plan, to which the fix adds its operations. By default,
+        the fix plans its operations and executes them right away.
 
     Returns
     -------
@@ -170,8 +337,11 @@ def generate_fieldmap_from_dwi(
     files_mapping = {}
     logger.info(f"Searching for reversed-phased DWIs in {session_path}")
     session_path = Path(session_path)
-    forwared_phased_dwis = list(session_path.glob("dwi/*dir-FWD*_dwi.nii*"))
-    reversed_phased_dwis = list(session_path.glob("dwi/*dir-REV*_dwi.nii*"))
+    execute = plan is None
+    plan = Plan(session_path, logger=logger) if execute else plan
+    snapshot = plan.snapshot
+    forwared_phased_dwis = find_images(snapshot, datatype="dwi", suffix="dwi", direction="FWD")
+    reversed_phased_dwis = find_images(snapshot, datatype="dwi", suffix="dwi", direction="REV")
     n_reversed_phased_dwis = len(reversed_phased_dwis)
     if n_reversed_phased_dwis == 0:
         logger.info(f"No reversed-phased DWIs found in {session_path}. Skipping...")
@@ -179,38 +349,42 @@ def generate_fieldmap_from_dwi(
         reversed_phased_dwi = reversed_phased_dwis[0]
         logger.info(f"Found reversed-phased DWI: {reversed_phased_dwi}")
         bvec, bval, json_file = get_bvec_bval_json(reversed_phased_dwi)
-        base_entities = parse_file_entities(str(reversed_phased_dwi))
+        base_entities = snapshot.entities(reversed_phased_dwi)
         base_entities.update({"suffix": "epi", "datatype": "fmap", "acquisition": "dwi"})
         new_base_name = generate_fieldmap_name(base_entities)
         out_nifti = session_path / f"{new_base_name}.nii.gz"
         new_json_file = session_path / f"{new_base_name}.json"
-        if out_nifti.exists() and new_json_file.exists():
+        if snapshot.exists(out_nifti) and snapshot.exists(new_json_file):
             logger.info(f"Fieldmap already exists in {session_path}. Skipping...")
         else:
-            out_nifti.parent.mkdir(exist_ok=True, parents=True)
-            extract_b0(reversed_phased_dwi, bvec, bval, out_nifti, logger=logger)
+            plan.create(
+                out_nifti,
+                extract_b0,
+                reads=[reversed_phased_dwi],
+                in_file=reversed_phased_dwi,
+                bvec=bvec,
+                bval=bval,
+                out_file=out_nifti,
+                logger=logger,
+            )
             files_mapping[reversed_phased_dwi] = out_nifti
-            logger.info(f"Extracted b0 from {reversed_phased_dwi} to {out_nifti}")
+            logger.info(f"Planned the extraction of b0 from {reversed_phased_dwi} to {out_nifti}")
             # copy the json file and edit it to match the new file
             copy_and_edit_fieldmap_json(
                 json_file,
                 new_json_file,
                 forwared_phased_dwis,
                 session_path.parent,
+                plan=plan,
             )
             files_mapping[json_file] = new_json_file
             logger.info(f"Copied {json_file} to {new_json_file}")
             # remove dwis from acq-rest fieldmaps
-            for fmap in session_path.glob("fmap/*_acq-rest_*.json"):
-                logger.info(f"Removing forward phased dwi from {fmap}")
-                with open(fmap, "r") as f:
-                    json_data = json.load(f)
-                intended_for = json_data["IntendedFor"]
-                json_data["IntendedFor"] = [i for i in intended_for if parse_file_entities(i)["datatype"] != "dwi"]
-                with open(fmap, "w") as f:
-                    json.dump(json_data, f, indent=4)
-
+            logger.info(f"Removing forward phased dwis from acq-rest fieldmaps in {session_path}")
+            plan.fieldmaps.filter("fmap/*_acq-rest_*.json", keep=lambda target: Path(target).parent.name != "dwi")
             fixed = True
+    if execute:
+        plan.execute()
     return fixed, files_mapping
 
 
@@ -219,6 +393,7 @@ def copy_and_edit_fieldmap_json(
     new_json_file: Union[str, Path],
     intended_for: list[Path],
     relative_to: Path,
+    plan: Plan = None,
 ):
     """
     Copy a fieldmap json file and edit it to match the new file
@@ -233,15 +408,26 @@ def copy_and_edit_fieldmap_json(
         The list of files the new json file is intended for
     relative_to : Path
         The path to the directory the new json file is relative to
+    plan : Plan, optional
+        The session's plan, to which the new json file is added instead of
+        being written right away, by default None
     """
-    with open(json_file, "r") as f:
-        json_data = json.load(f)
+    json_data = plan.snapshot.read_json(json_file) if plan is not None else read_json(json_file)
     json_data["IntendedFor"] = [str(file.relative_to(relative_to)) for file in intended_for]
-    with open(new_json_file, "w") as f:
-        json.dump(json_data, f, indent=4)
+    if plan is not None:
+        plan.add_sidecar(new_json_file, json_data)
+    else:
+        write_json(new_json_file, json_data)
 
 
-def extract_b0(in_file: str, bvec: str, bval: str, out_file: str, logger: logging.Logger):
+def extract_b0(
+    in_file: str,
+    bvec: str,
+    bval: str,
+    out_file: str,
+    logger: logging.Logger,
+    backend: str = None,
+):
     """
     Extract the b0 volumes from a dwi file
 
@@ -255,10 +441,29 @@ def extract_b0(in_file: str, bvec: str, bval: str, out_file: str, logger: loggin
         The bval file
     out_file : str
         The output file
+    backend : str, optional
+        Either "native" (NumPy/nibabel, in-process) or "mrtrix" (dwiextract | mrmath),
+        by default "native" when nibabel is installed and "mrtrix" otherwise
     """
-    cmd = f"dwiextract {in_file} -bzero -fslgrad {bvec} {bval} - | mrmath - mean {out_file} -axis 3 -force"
-    logger.info(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=True)
+    if backend is None:
+        backend = "native" if importlib.util.find_spec("nibabel") is not None else "mrtrix"
+    if backend == "native":
+        logger.info(f"Averaging the b0 volumes of {in_file} into {out_file}")
+        mean_b0(in_file, bval, out_file)
+    elif backend == "mrtrix":
+        extract_cmd = ["dwiextract", str(in_file), "-bzero", "-fslgrad", str(bvec), str(bval), "-"]
+        mean_cmd = ["mrmath", "-", "mean", str(out_file), "-axis", "3", "-force"]
+        logger.info(f"Running: {' '.join(extract_cmd)} | {' '.join(mean_cmd)}")
+        extract = subprocess.Popen(extract_cmd, stdout=subprocess.PIPE)
+        try:
+            subprocess.run(mean_cmd, stdin=extract.stdout, check=True)
+        finally:
+            extract.stdout.close()
+            extract.wait()
+        if extract.returncode != 0:
+            raise subprocess.CalledProcessError(extract.returncode, extract_cmd)
+    else:
+        raise ValueError(f"Unknown b0 extraction backend {backend}. Available backends: ['native', 'mrtrix']")
 
 
 def generate_fieldmap_name(entities: dict) -> str:
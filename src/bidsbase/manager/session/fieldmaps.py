@@ -0,0 +1,181 @@
+import logging
+from pathlib import Path
+from typing import Callable
+from typing import Union
+
+from bidsbase.manager.session.snapshot import SessionSnapshot
+from bidsbase.manager.utils.sidecars import read_jsons
+from bidsbase.manager.utils.sidecars import write_jsons
+
+
+class FieldmapIndex:
+    """
+    A reverse index from the files of a session to the fieldmap sidecars
+    whose IntendedFor field references them
+
+    The sidecars are read once. Changes are made in memory and written by
+    ``flush``, so each sidecar is written at most once however many fixes
+    changed it.
+    """
+
+    def __init__(self, session_path: Union[str, Path], logger: logging.Logger = None, snapshot: SessionSnapshot = None):
+        """
+        Index the fieldmap sidecars of a session
+
+        Parameters
+        ----------
+        session_path : Union[str, Path]
+            The path to the session directory
+        logger : logging.Logger, optional
+            The logger, by default None
+        snapshot : SessionSnapshot, optional
+            The snapshot of the session, from which the sidecars are read
+            instead of the directory, by default None
+        """
+        self.session_path = Path(session_path)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        # IntendedFor entries are relative to the subject's directory
+        self.relative_to = self.session_path.parent
+        self.sidecars = {}
+        self.targets = {}
+        self.dirty = set()
+        if snapshot is not None:
+            sidecars = snapshot.read_jsons(snapshot.glob("fmap/*.json"))
+        else:
+            sidecars = read_jsons(sorted(self.session_path.glob("fmap/*.json")))
+        for sidecar, data in sidecars.items():
+            self._register(sidecar, data)
+
+    def _register(self, sidecar: Path, data: dict) -> None:
+        self.sidecars[sidecar] = data
+        if "IntendedFor" not in data:
+            return
+        if isinstance(data["IntendedFor"], str):
+            data["IntendedFor"] = [data["IntendedFor"]]
+        for target in data["IntendedFor"]:
+            self.targets.setdefault(target, {})[sidecar] = None
+
+    def relative(self, path: Union[str, Path]) -> str:
+        """
+        Get the IntendedFor entry referencing a file
+        """
+        return str(Path(path).relative_to(self.relative_to))
+
+    def referencing(self, path: Union[str, Path]) -> list:
+        """
+        Get the sidecars whose IntendedFor field references a file
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The referenced file
+
+        Returns
+        -------
+        list
+            A list of sidecar paths
+        """
+        return list(self.targets.get(self.relative(path), {}))
+
+    def apply(self, files_mapping: dict) -> None:
+        """
+        Update the IntendedFor fields after files were renamed or removed
+
+        Parameters
+        ----------
+        files_mapping : dict
+            A dictionary mapping the old file names to the new file names,
+            or to None for removed files
+        """
+        mapping = {
+            self.relative(key): self.relative(val) if val is not None else None
+            for key, val in files_mapping.items()
+            if Path(key).is_relative_to(self.relative_to)
+        }
+        affected = {sidecar for target in mapping for sidecar in self.targets.get(target, {})}
+        for target, new_target in mapping.items():
+            sidecars = self.targets.pop(target, {})
+            if new_target is not None:
+                self.targets.setdefault(new_target, {}).update(sidecars)
+        for sidecar in sorted(affected):
+            intended_for = self.sidecars[sidecar]["IntendedFor"]
+            for target in intended_for:
+                if target in mapping:
+                    if mapping[target] is None:
+                        self.logger.info(f"Removing {target} from {sidecar}")
+                    else:
+                        self.logger.info(f"Updating {target} to {mapping[target]} in {sidecar}")
+            self.sidecars[sidecar]["IntendedFor"] = [
+                mapping.get(target, target) for target in intended_for if mapping.get(target, target) is not None
+            ]
+            self.dirty.add(sidecar)
+
+    def filter(self, pattern: str, keep: Callable) -> None:
+        """
+        Remove IntendedFor entries from the sidecars matching a pattern
+
+        Parameters
+        ----------
+        pattern : str
+            A glob pattern, relative to the session directory (e.g. "fmap/*_acq-rest_*.json")
+        keep : Callable
+            A function telling whether an IntendedFor entry should be kept
+        """
+        for sidecar in sorted(self.sidecars):
+            if not sidecar.relative_to(self.session_path).match(pattern) or "IntendedFor" not in self.sidecars[sidecar]:
+                continue
+            intended_for = self.sidecars[sidecar]["IntendedFor"]
+            kept = [target for target in intended_for if keep(target)]
+            for target in set(intended_for) - set(kept):
+                self.logger.info(f"Removing {target} from {sidecar}")
+                self.targets.get(target, {}).pop(sidecar, None)
+            if kept != intended_for:
+                self.sidecars[sidecar]["IntendedFor"] = kept
+                self.dirty.add(sidecar)
+
+    def add(self, sidecar: Union[str, Path], data: dict) -> None:
+        """
+        Add a new sidecar, to be written on the next flush
+
+        Parameters
+        ----------
+        sidecar : Union[str, Path]
+            The path of the new sidecar
+        data : dict
+            The content of the new sidecar
+        """
+        sidecar = Path(sidecar)
+        self._register(sidecar, data)
+        self.dirty.add(sidecar)
+
+    def pop_dirty(self) -> dict:
+        """
+        Get the sidecars that were changed since the last call, and mark them as clean
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the changed sidecars' paths to their content
+        """
+        dirty = {sidecar: self.sidecars[sidecar] for sidecar in sorted(self.dirty)}
+        self.dirty = set()
+        return dirty
+
+    def flush(self) -> list:
+        """
+        Write the sidecars that were changed since the last flush, at once
+
+        Sidecars whose content on disk is already up to date are not written.
+
+        Returns
+        -------
+        list
+            The paths of the written sidecars
+        """
+        dirty = self.pop_dirty()
+        for sidecar in dirty:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+        written = write_jsons(dirty)
+        for sidecar in written:
+            self.logger.info(f"Updated {sidecar}")
+        return written
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Union
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+def default_journal_dir(session_path: Union[str, Path]) -> Path:
+    """
+    Get the journal directory of a session when none is given: a hidden
+    directory next to the session's, always the same so that the next run
+    finds an unfinished batch and rolls it back
+
+    Parameters
+    ----------
+    session_path : Union[str, Path]
+        The path to the session directory
+
+    Returns
+    -------
+    Path
+        The journal directory (e.g. "sub-01/.ses-1.journal")
+    """
+    session_path = Path(session_path)
+    return session_path.parent / f".{session_path.name}.journal"
+
+
+class Journal:
+    """
+    A write-ahead journal of the filesystem operations applied to a session
+
+    Every operation is recorded (and synced to disk) before it is applied.
+    Removed and overwritten files are moved to the journal's trash instead of
+    being deleted, so that a failed or interrupted batch can be rolled back.
+    """
+
+    def __init__(self, directory: Union[str, Path], logger: logging.Logger = None):
+        """
+        Open a journal
+
+        Parameters
+        ----------
+        directory : Union[str, Path]
+            The directory holding the journal and its trash
+        logger : logging.Logger, optional
+            The logger, by default None
+        """
+        self.directory = Path(directory)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.path = self.directory / JOURNAL_NAME
+        self.trash = self.directory / "trash"
+        self.n_entries = 0
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether the journal holds a batch that was neither committed nor rolled back
+        """
+        return self.path.exists()
+
+    def recover(self) -> bool:
+        """
+        Roll back an unfinished batch, left by a process that died while applying it
+
+        Returns
+        -------
+        bool
+            Whether a batch was rolled back
+        """
+        if not self.pending:
+            return False
+        self.logger.warning(f"Found an unfinished batch in {self.directory}, rolling it back")
+        self.rollback()
+        return True
+
+    def begin(self) -> None:
+        """
+        Start a new batch, rolling back any unfinished one first
+        """
+        self.recover()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.trash.mkdir(parents=True)
+        self.path.touch()
+        self.n_entries = 0
+
+    def record(self, entry: dict) -> None:
+        """
+        Durably record an operation before it is applied
+
+        Parameters
+        ----------
+        entry : dict
+            The description of the operation
+        """
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.n_entries += 1
+
+    def remove(self, path: Union[str, Path]) -> None:
+        """
+        Remove a file, keeping it in the trash until the batch is committed
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The file to remove
+        """
+        trash = self.trash / str(self.n_entries)
+        self.record({"op": "remove", "path": str(path), "trash": str(trash)})
+        shutil.move(str(path), str(trash))
+
+    def rename(self, source: Union[str, Path], destination: Union[str, Path]) -> None:
+        """
+        Rename a file, moving an existing destination to the trash first
+
+        Parameters
+        ----------
+        source : Union[str, Path]
+            The file to rename
+        destination : Union[str, Path]
+            Its new path
+        """
+        if os.path.lexists(destination):
+            self.remove(destination)
+        self.record({"op": "rename", "source": str(source), "destination": str(destination)})
+        os.rename(source, destination)
+
+    def create(self, path: Union[str, Path]) -> None:
+        """
+        Announce the creation of a file, moving an existing one to the trash first
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The file about to be created
+        """
+        if os.path.lexists(path):
+            self.remove(path)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.record({"op": "create", "path": str(path)})
+
+    def commit(self) -> None:
+        """
+        Finish the batch and empty the trash
+        """
+        self.path.unlink()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def rollback(self) -> None:
+        """
+        Undo the operations of the batch, in reverse order
+        """
+        with open(self.path, "r") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in reversed(entries):
+            if entry["op"] == "rename" and os.path.lexists(entry["destination"]):
+                os.rename(entry["destination"], entry["source"])
+            elif entry["op"] == "remove" and os.path.lexists(entry["trash"]):
+                shutil.move(entry["trash"], entry["path"])
+            elif entry["op"] == "create" and os.path.lexists(entry["path"]):
+                os.unlink(entry["path"])
+        self.logger.info(f"Rolled back {len(entries)} operations recorded in {self.path}")
+        self.path.unlink()
+        shutil.rmtree(self.directory, ignore_errors=True)
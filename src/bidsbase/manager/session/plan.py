@@ -0,0 +1,310 @@
+import json
+import logging
+from pathlib import Path
+from typing import Callable
+from typing import Union
+
+from bidsbase.manager.session.fieldmaps import FieldmapIndex
+from bidsbase.manager.session.journal import Journal
+from bidsbase.manager.session.journal import default_journal_dir
+from bidsbase.manager.session.snapshot import SessionSnapshot
+from bidsbase.manager.utils.metrics import Metrics
+from bidsbase.manager.utils.metrics import NullMetrics
+from bidsbase.manager.utils.sidecars import write_json
+from bidsbase.manager.utils.sidecars import write_jsons
+
+
+class Rename:
+    """
+    Rename a file
+    """
+
+    kind = "rename"
+
+    def __init__(self, source: Path, destination: Path):
+        self.source = source
+        self.destination = destination
+
+    def __repr__(self) -> str:
+        return f"<Rename {self.source} -> {self.destination}>"
+
+    def paths(self) -> list:
+        return [self.source, self.destination]
+
+    def size(self) -> int:
+        return 0
+
+    def apply(self, journal: Journal) -> None:
+        journal.rename(self.source, self.destination)
+
+
+class Delete:
+    """
+    Delete a file
+    """
+
+    kind = "delete"
+
+    def __init__(self, path: Path, size: int = 0):
+        self.path = path
+        self._size = size
+
+    def __repr__(self) -> str:
+        return f"<Delete {self.path}>"
+
+    def paths(self) -> list:
+        return [self.path]
+
+    def size(self) -> int:
+        return self._size
+
+    def apply(self, journal: Journal) -> None:
+        journal.remove(self.path)
+
+
+class WriteJSON:
+    """
+    Write (or overwrite) a JSON sidecar
+    """
+
+    kind = "write_json"
+
+    def __init__(self, path: Path, data: dict):
+        self.path = path
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"<WriteJSON {self.path}>"
+
+    def paths(self) -> list:
+        return [self.path]
+
+    def size(self) -> int:
+        return len(json.dumps(self.data, indent=4))
+
+    def apply(self, journal: Journal) -> None:
+        journal.create(self.path)
+        write_json(self.path, self.data)
+
+
+class Create:
+    """
+    Create a file by calling a function (e.g. extracting an image from another)
+    """
+
+    kind = "create"
+
+    def __init__(self, path: Path, function: Callable, kwargs: dict, reads: list = None, size: int = 0):
+        self.path = path
+        self.function = function
+        self.kwargs = kwargs
+        self.reads = reads or []
+        self._size = size
+
+    def __repr__(self) -> str:
+        return f"<Create {self.path} with {self.function.__name__}>"
+
+    def paths(self) -> list:
+        return [self.path] + list(self.reads)
+
+    def size(self) -> int:
+        return self._size
+
+    def apply(self, journal: Journal) -> None:
+        journal.create(self.path)
+        self.function(**self.kwargs)
+
+
+class Plan:
+    """
+    The operations fixing a session, computed without touching the filesystem
+
+    Fixes add operations to the plan instead of changing the session directly.
+    The plan keeps a snapshot of the session's files, updated with every
+    planned operation, so that each fix sees the changes planned by the
+    previous ones. Executing the plan applies all operations in one batch,
+    recorded in a journal so that the batch is rolled back if any operation
+    fails.
+
+    Files are never rewritten in place: overwritten files are moved away and
+    replaced by new files, so that files linked to the source dataset are
+    never changed.
+
+    A batch left unfinished in the journal directory by a process that died
+    is rolled back before the session is scanned, so that the plan never
+    starts from a half-applied batch. This is the only change a plan makes
+    before it is executed.
+    """
+
+    def __init__(
+        self,
+        session_path: Union[str, Path],
+        logger: logging.Logger = None,
+        metrics: Metrics = None,
+        journal_dir: Union[str, Path] = None,
+    ):
+        """
+        Start an empty plan for a session
+
+        Parameters
+        ----------
+        session_path : Union[str, Path]
+            The path to the session directory
+        logger : logging.Logger, optional
+            The logger, by default None
+        metrics : Metrics, optional
+            Where to record the time spent applying each kind of operation, by default None
+        journal_dir : Union[str, Path], optional
+            Where to keep the journal of the batch, by default a hidden
+            directory next to the session's (see ``default_journal_dir``)
+        """
+        self.session_path = Path(session_path)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.journal_dir = Path(journal_dir) if journal_dir is not None else default_journal_dir(self.session_path)
+        Journal(self.journal_dir, logger=self.logger).recover()
+        self.metrics = metrics if metrics is not None else NullMetrics()
+        self.operations = []
+        self.executed = False
+        self.files_changed = {}
+        self.applied_fixes = []
+        with self.metrics.stage("plan.scan"):
+            self.snapshot = SessionSnapshot(self.session_path)
+            self.fieldmaps = FieldmapIndex(self.session_path, logger=self.logger, snapshot=self.snapshot)
+        self.metrics.count("files_scanned", len(self.snapshot))
+
+    def __repr__(self) -> str:
+        return f"<Plan {self.session_path}: {len(self.operations)} operations>"
+
+    def rename(self, source: Union[str, Path], destination: Union[str, Path]) -> None:
+        """
+        Plan the renaming of a file
+        """
+        source, destination = Path(source), Path(destination)
+        self.operations.append(Rename(source, destination))
+        self.snapshot.rename(source, destination)
+
+    def delete(self, path: Union[str, Path]) -> None:
+        """
+        Plan the deletion of a file
+        """
+        path = Path(path)
+        self.operations.append(Delete(path, size=self.snapshot.size(path)))
+        self.snapshot.delete(path)
+
+    def write_json(self, path: Union[str, Path], data: dict) -> None:
+        """
+        Plan the writing of a JSON sidecar, unless it already holds this content on disk
+
+        Sidecars created or rewritten by the plan are always written, even if
+        their planned content is the same (e.g. sidecars added to the fieldmap
+        index, whose content is already in the snapshot).
+        """
+        path = Path(path)
+        if self.snapshot.exists(path) and not self.snapshot.is_planned(path) and self.snapshot.read_json(path) == data:
+            return
+        self.operations.append(WriteJSON(path, data))
+        self.snapshot.create(path, data)
+
+    def create(self, path: Union[str, Path], function: Callable, reads: list = (), **kwargs) -> None:
+        """
+        Plan the creation of a file by a function
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The file created by the function
+        function : Callable
+            The function creating the file, called with ``kwargs``
+        reads : list, optional
+            The files read by the function, by default ()
+        """
+        path = Path(path)
+        size = sum(self.snapshot.size(read) for read in reads)
+        self.operations.append(Create(path, function, kwargs, reads=[Path(read) for read in reads], size=size))
+        self.snapshot.create(path)
+
+    def add_sidecar(self, path: Union[str, Path], data: dict) -> None:
+        """
+        Plan the creation of a fieldmap sidecar, which is then kept in the
+        fieldmap index and written when the plan is finalized
+        """
+        path = Path(path)
+        self.fieldmaps.add(path, data)
+        self.snapshot.create(path, data)
+
+    def finalize(self) -> None:
+        """
+        Add the writes of the fieldmap sidecars changed by the planned fixes
+        """
+        for sidecar, data in self.fieldmaps.pop_dirty().items():
+            self.write_json(sidecar, data)
+
+    def cost(self) -> dict:
+        """
+        Summarize the planned operations
+
+        Returns
+        -------
+        dict
+            The number of operations, of distinct files touched and of bytes
+            read, written or removed
+        """
+        return {
+            "operations": len(self.operations),
+            "files": len({path for operation in self.operations for path in operation.paths()}),
+            "bytes": sum(operation.size() for operation in self.operations),
+        }
+
+    def execute(self, journal_dir: Union[str, Path] = None) -> None:
+        """
+        Apply the planned operations in one batch, rolling them back if any fails
+
+        Parameters
+        ----------
+        journal_dir : Union[str, Path], optional
+            Where to keep the journal of the batch, by default the plan's journal directory
+        """
+        if self.executed:
+            raise RuntimeError(f"The plan of {self.session_path} was already executed")
+        self.finalize()
+        self.executed = True
+        if not self.operations:
+            return
+        journal = Journal(journal_dir if journal_dir is not None else self.journal_dir, logger=self.logger)
+        journal.begin()
+        try:
+            sidecars = []
+            for operation in self.operations:
+                if operation.kind == "write_json":
+                    # consecutive sidecar writes are applied together
+                    sidecars.append(operation)
+                    continue
+                self._write_sidecars(sidecars, journal)
+                sidecars = []
+                self.logger.info(f"Applying {operation}")
+                stage = f"apply.{operation.kind}"
+                if operation.kind == "create":
+                    stage += f".{operation.function.__name__}"
+                with self.metrics.stage(stage):
+                    operation.apply(journal)
+                self.metrics.count(f"operations.{operation.kind}")
+            self._write_sidecars(sidecars, journal)
+        except Exception:
+            self.logger.error(f"Failed to apply the plan of {self.session_path}, rolling back")
+            journal.rollback()
+            raise
+        journal.commit()
+
+    def _write_sidecars(self, operations: list, journal: Journal) -> None:
+        """
+        Apply sidecar writes at once, the sidecars being written concurrently
+        """
+        if not operations:
+            return
+        for operation in operations:
+            self.logger.info(f"Applying {operation}")
+            journal.create(operation.path)
+        with self.metrics.stage("apply.write_json"):
+            write_jsons({operation.path: operation.data for operation in operations}, skip_unchanged=False)
+        self.metrics.count("operations.write_json", len(operations))
+        self.metrics.count("sidecars_rewritten", len(operations))
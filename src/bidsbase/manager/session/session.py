@@ -1,9 +1,16 @@
 import logging
+from dataclasses import dataclass
+from dataclasses import field
 from pathlib import Path
 from typing import Union
 
 from bidsbase.manager.session import COMMON_FIXES
+from bidsbase.manager.session.plan import Plan
+from bidsbase.manager.utils.logger import WORKER_LOGGER_NAME
+from bidsbase.manager.utils.logger import get_session_logger
 from bidsbase.manager.utils.logger import initiate_logger
+from bidsbase.manager.utils.metrics import Metrics
+from bidsbase.manager.utils.metrics import NullMetrics
 
 
 class Session:
@@ -16,6 +23,7 @@ class Session:
         path: Union[str, Path],
         auto_fix: bool = True,
         logger: logging.Logger = None,
+        metrics: Metrics = None,
     ):
         """
         Initialize a Session object
@@ -24,10 +32,20 @@ class Session:
         ----------
         path : Union[str, Path]
             The path to the session directory
+        auto_fix : bool, optional
+            Whether to automatically fix the issues, by default True
+        logger : logging.Logger, optional
+            The parent of the session's logger, by default a logger writing
+            next to the dataset, shared by all sessions
+        metrics : Metrics, optional
+            Where to record the time spent in each fix, by default None
         """
         self.path = Path(path)
         self.auto_fix = auto_fix
-        self.logger = logger if logger is not None else initiate_logger(self.path.parent.parent.parent, name="Session")
+        if logger is None:
+            logger = initiate_logger(self.path.parent.parent.parent, name="Session")
+        self.logger = get_session_logger(logger, self.path)
+        self.metrics = metrics if metrics is not None else NullMetrics()
         self.logger.info(f"Initializing Session object for {self.path}")
         self.fixed = False
 
@@ -53,32 +71,155 @@ class Session:
         """
         return self.name
 
-    def fix(self, fixes: list = COMMON_FIXES):
+    def plan(self, fixes: list = COMMON_FIXES, journal_dir: Union[str, Path] = None) -> Plan:
+        """
+        Plan the fixes of the session directory, without changing it
+
+        A batch left unfinished in the journal directory is rolled back first.
+
+        Parameters
+        ----------
+        fixes : list, optional
+            The list of fixes to plan, by default COMMON_FIXES
+        journal_dir : Union[str, Path], optional
+            Where to keep the journal of the batch, by default a hidden
+            directory next to the session's directory
+
+        Returns
+        -------
+        Plan
+            The planned operations, along with the fixes that apply to the
+            session and the files they change
+        """
+        self.logger.info(f"Planning fixes of session {self.name}")
+        plan = Plan(self.path, logger=self.logger, metrics=self.metrics, journal_dir=journal_dir)
+        for fix in fixes:
+            self.logger.info(f"Planning fix {fix.__name__}")
+            with self.metrics.stage(f"fix.{fix.__name__}"):
+                fixed, fix_changed = fix(
+                    logger=self.logger,
+                    session_path=self.path,
+                    auto_fix=self.auto_fix,
+                    plan=plan,
+                )
+            if fixed:
+                plan.applied_fixes.append(fix.__name__)
+                plan.files_changed.update(fix_changed)
+        plan.finalize()
+        return plan
+
+    def fix(self, fixes: list = COMMON_FIXES, journal_dir: Union[str, Path] = None):
         """
         Fix the session directory
 
+        The fixes are planned first and then applied in a single batch, which
+        is rolled back if any of its operations fails.
+
         Parameters
         ----------
         fixes : list, optional
             The list of fixes to apply, by default COMMON_FIXES
+        journal_dir : Union[str, Path], optional
+            Where to keep the journal of the batch, by default a hidden
+            directory next to the session's directory. A batch left
+            unfinished there by a previous run is rolled back first.
         """
         self.logger.info(f"Fixing session {self.name}")
-        files_changed = {}
-        for fix in fixes:
-            self.logger.info(f"Applying fix {fix.__name__}")
-            fixed, fix_changed = fix(
-                logger=self.logger,
-                session_path=self.path,
-                auto_fix=self.auto_fix,
-            )
-            if fixed:
-                self.fixed = True
-                self.logger.info(f"Successfully applied fix {fix.__name__}")
-                files_changed.update(fix_changed)
+        plan = self.plan(fixes=fixes, journal_dir=journal_dir)
+        with self.metrics.stage("execute"):
+            plan.execute()
+        for fix_name in plan.applied_fixes:
+            self.fixed = True
+            self.logger.info(f"Successfully applied fix {fix_name}")
         # change files changed keys and values to be strings
-        files_changed = {str(k): str(v) if v is not None else "deleted" for k, v in files_changed.items()}
+        files_changed = {str(k): str(v) if v is not None else "deleted" for k, v in plan.files_changed.items()}
         return files_changed
 
     @property
     def name(self):
         return self.path.name.split('-')[-1]
+
+
+@dataclass
+class FixResult:
+    """
+    The outcome of fixing a single session in a worker process
+    """
+
+    path: Path
+    fixed: bool = False
+    changed_files: dict = field(default_factory=dict)
+    records: list = field(default_factory=list)
+    error: Exception = None
+    metrics: dict = field(default_factory=dict)
+
+
+class _RecordCollector(logging.Handler):
+    """
+    Keep the log records of a worker, so they can be sent back to the parent process
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # make the record picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def fix_session(
+    path: Union[str, Path],
+    fixes: list = COMMON_FIXES,
+    auto_fix: bool = True,
+    journal_dir: Union[str, Path] = None,
+    metrics: bool = False,
+) -> FixResult:
+    """
+    Fix a session directory, collecting its log records instead of writing them
+
+    This is the unit of work of parallel runs of ``Manager.fix_dataset``.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path to the session directory
+    fixes : list, optional
+        The list of fixes to apply, by default COMMON_FIXES
+    auto_fix : bool, optional
+        Whether to automatically fix the issues, by default True
+    journal_dir : Union[str, Path], optional
+        Where to keep the journal of the session's batch, by default None
+    metrics : bool, optional
+        Whether to record the time spent in each fix, by default False
+
+    Returns
+    -------
+    FixResult
+        The outcome of the fixes, including the log records they emitted
+    """
+    collector = _RecordCollector()
+    # the records stop at the worker's logger, the parent process writes them
+    logger = logging.getLogger(WORKER_LOGGER_NAME)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(collector)
+    result = FixResult(path=Path(path), records=collector.records)
+    session_metrics = Metrics() if metrics else NullMetrics()
+    try:
+        session = Session(path=path, auto_fix=auto_fix, logger=logger, metrics=session_metrics)
+        with session_metrics.stage("fix_session"):
+            result.changed_files = session.fix(fixes=fixes, journal_dir=journal_dir)
+        result.fixed = session.fixed
+    except Exception as e:
+        result.error = e
+    finally:
+        logger.removeHandler(collector)
+    if metrics:
+        result.metrics = session_metrics.to_dict()
+    return result
@@ -0,0 +1,255 @@
+import copy
+import fnmatch
+import os
+from pathlib import Path
+from typing import Union
+
+from bidsbase.manager.index import parse_entities
+from bidsbase.manager.utils.sidecars import read_json
+from bidsbase.manager.utils.sidecars import read_jsons
+
+
+def stem(path: Union[str, Path]) -> str:
+    """
+    Get the name of a file without its extension (e.g. "sub-01_dwi" for "sub-01_dwi.nii.gz")
+    """
+    return Path(path).name.split(".")[0]
+
+
+class SessionSnapshot:
+    """
+    The files of a session, taken in a single walk of its directory, with
+    their parsed entities and the content of their JSON sidecars
+
+    Fixes read the session through its snapshot instead of globbing the
+    directory. The snapshot is only changed by the session's plan, which
+    applies the renames, deletions and new files it plans to the snapshot,
+    so that every fix sees the session as left by the previous ones without
+    rescanning it.
+    """
+
+    def __init__(self, session_path: Union[str, Path]):
+        """
+        Take a snapshot of a session
+
+        Parameters
+        ----------
+        session_path : Union[str, Path]
+            The path to the session directory
+        """
+        self.session_path = Path(session_path)
+        # virtual path -> path currently holding its content on disk (None for planned files)
+        self.files = {}
+        self._entities = {}
+        self._sizes = {}
+        self._sidecars = {}
+        self._written = {}
+        for dirpath, _, filenames in os.walk(self.session_path):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                self._add(path, path)
+
+    def __repr__(self) -> str:
+        return f"<SessionSnapshot {self.session_path}: {len(self.files)} files>"
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, path: Union[str, Path]) -> bool:
+        return Path(path) in self.files
+
+    def _add(self, path: Path, physical: Path) -> None:
+        self.files[path] = physical
+        entities = parse_entities(path.name)
+        relative = path.relative_to(self.session_path).parts
+        if len(relative) > 1:
+            entities["datatype"] = relative[0]
+        self._entities[path] = entities
+
+    def entities(self, path: Union[str, Path]) -> dict:
+        """
+        Get the entities of a file, named as in pybids (with its datatype)
+        """
+        return dict(self._entities[Path(path)])
+
+    def query(self, **entities) -> list:
+        """
+        Find the files whose entities have the given values
+
+        Parameters
+        ----------
+        **entities
+            The entities to match (e.g. datatype="dwi", suffix="dwi"). An
+            entity given as None matches the files without it.
+
+        Returns
+        -------
+        list
+            A sorted list of paths
+        """
+        return sorted(
+            path
+            for path, file_entities in self._entities.items()
+            if all(file_entities.get(key) == value for key, value in entities.items())
+        )
+
+    def glob(self, pattern: str) -> list:
+        """
+        Find the files matching a pattern
+
+        Parameters
+        ----------
+        pattern : str
+            A glob pattern, relative to the session directory (e.g. "dwi/*_dwi.nii*")
+
+        Returns
+        -------
+        list
+            A sorted list of paths
+        """
+        parts = pattern.split("/")
+        matches = []
+        for path in self.files:
+            relative = path.relative_to(self.session_path).parts
+            if len(relative) == len(parts) and all(fnmatch.fnmatchcase(name, part) for name, part in zip(relative, parts)):
+                matches.append(path)
+        return sorted(matches)
+
+    def associated(self, path: Union[str, Path]) -> list:
+        """
+        Get the files sharing the name of a file, up to the extension (e.g. its bval, bvec and JSON sidecar)
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The file
+
+        Returns
+        -------
+        list
+            A sorted list of paths, including the file itself
+        """
+        path = Path(path)
+        name = stem(path)
+        return sorted(other for other in self.files if other.parent == path.parent and stem(other) == name)
+
+    def sidecar(self, path: Union[str, Path]) -> Path:
+        """
+        Get the JSON sidecar of a file, or None if it has none
+        """
+        path = Path(path)
+        sidecar = path.parent / f"{stem(path)}.json"
+        return sidecar if sidecar in self.files else None
+
+    def exists(self, path: Union[str, Path]) -> bool:
+        """
+        Whether a file exists
+        """
+        return Path(path) in self.files
+
+    def is_planned(self, path: Union[str, Path]) -> bool:
+        """
+        Whether the content of a file is planned, i.e. the file is created or rewritten by the plan rather than read from disk
+        """
+        path = Path(path)
+        return self.files[path] is None or path in self._written
+
+    def physical(self, path: Union[str, Path]) -> Path:
+        """
+        Get the path currently holding the content of a file on disk
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path of the file in the snapshot
+
+        Returns
+        -------
+        Path
+            The path of the file on disk
+        """
+        physical = self.files[Path(path)]
+        if physical is None:
+            raise FileNotFoundError(f"{path} is only created when the plan is executed")
+        return physical
+
+    def size(self, path: Union[str, Path]) -> int:
+        """
+        Get the size of a file, 0 for planned files
+        """
+        physical = self.files.get(Path(path))
+        if physical is None:
+            return 0
+        if physical not in self._sizes:
+            self._sizes[physical] = os.path.getsize(physical)
+        return self._sizes[physical]
+
+    def read_json(self, path: Union[str, Path]) -> dict:
+        """
+        Read a JSON sidecar, as planned so far
+
+        Sidecars are read from disk at most once.
+        """
+        path = Path(path)
+        if path in self._written:
+            return copy.deepcopy(self._written[path])
+        physical = self.physical(path)
+        if physical not in self._sidecars:
+            self._sidecars[physical] = read_json(physical)
+        return copy.deepcopy(self._sidecars[physical])
+
+    def read_jsons(self, paths: list) -> dict:
+        """
+        Read many JSON sidecars at once, as planned so far
+
+        The sidecars not read yet are read concurrently.
+
+        Parameters
+        ----------
+        paths : list
+            The sidecars
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the sidecars' paths to their content
+        """
+        paths = [Path(path) for path in paths]
+        unread = {self.physical(path) for path in paths if path not in self._written} - set(self._sidecars)
+        self._sidecars.update(read_jsons(sorted(unread)))
+        return {path: self.read_json(path) for path in paths}
+
+    def rename(self, source: Union[str, Path], destination: Union[str, Path]) -> None:
+        """
+        Record the renaming of a file
+        """
+        source, destination = Path(source), Path(destination)
+        self._add(destination, self.files.pop(source))
+        self._entities.pop(source)
+        if source in self._written:
+            self._written[destination] = self._written.pop(source)
+
+    def delete(self, path: Union[str, Path]) -> None:
+        """
+        Record the deletion of a file
+        """
+        path = Path(path)
+        self.files.pop(path)
+        self._entities.pop(path)
+        self._written.pop(path, None)
+
+    def create(self, path: Union[str, Path], data: dict = None) -> None:
+        """
+        Record the creation (or overwriting) of a file
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The new file
+        data : dict, optional
+            The content of a new JSON sidecar, by default None
+        """
+        path = Path(path)
+        self._add(path, None)
+        if data is not None:
+            self._written[path] = data
@@ -0,0 +1,509 @@
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from dataclasses import field
+from functools import partial
+from pathlib import Path
+from typing import Callable
+from typing import Union
+
+from bidsbase.manager.utils.manifest import compare_entries
+from bidsbase.manager.utils.manifest import scan_files
+from bidsbase.manager.utils.metrics import Metrics
+from bidsbase.manager.utils.metrics import NullMetrics
+from bidsbase.manager.utils.metrics import NullProgress
+
+COPY_BACKENDS = ["python", "rsync"]
+COPY_MODES = ["full", "hardlink", "reflink", "symlink"]
+
+# ioctl request cloning a whole file on Linux (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+@dataclass
+class CopyResult:
+    """
+    The outcome of copying a single session
+    """
+
+    source: Path
+    destination: Path
+    status: str
+    error: Exception = None
+    entries: dict = None
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+
+    @property
+    def failed(self) -> bool:
+        return self.status == "failed"
+
+
+def _remove_existing(destination: Union[str, Path]) -> None:
+    """
+    Remove an existing destination before copying over it
+
+    Writing through an existing hard or symbolic link would change the source
+    dataset, so the destination is always unlinked first.
+    """
+    if os.path.lexists(destination):
+        os.unlink(destination)
+
+
+def full_copy_file(source: Union[str, Path], destination: Union[str, Path]) -> Union[str, Path]:
+    """
+    Copy the content and metadata of a file
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to copy
+    destination : Union[str, Path]
+        The path of the copy
+
+    Returns
+    -------
+    Union[str, Path]
+        The destination
+    """
+    _remove_existing(destination)
+    return shutil.copy2(source, destination)
+
+
+def hardlink_file(source: Union[str, Path], destination: Union[str, Path]) -> Union[str, Path]:
+    """
+    Hard link a file, falling back to a full copy across filesystems
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to link
+    destination : Union[str, Path]
+        The path of the new link
+
+    Returns
+    -------
+    Union[str, Path]
+        The destination
+    """
+    _remove_existing(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        return shutil.copy2(source, destination)
+    return destination
+
+
+def reflink_file(source: Union[str, Path], destination: Union[str, Path]) -> Union[str, Path]:
+    """
+    Clone a file (copy-on-write), falling back to a full copy where the
+    filesystem does not support it
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to clone
+    destination : Union[str, Path]
+        The path of the clone
+
+    Returns
+    -------
+    Union[str, Path]
+        The destination
+    """
+    _remove_existing(destination)
+    try:
+        import fcntl
+
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+    except (ImportError, OSError):
+        return shutil.copy2(source, destination)
+    return destination
+
+
+def symlink_file(source: Union[str, Path], destination: Union[str, Path]) -> Union[str, Path]:
+    """
+    Create an absolute symbolic link to a file, so that the link stays valid
+    when it is renamed or moved
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to link to
+    destination : Union[str, Path]
+        The path of the new link
+
+    Returns
+    -------
+    Union[str, Path]
+        The destination
+    """
+    _remove_existing(destination)
+    os.symlink(os.path.realpath(source), destination)
+    return destination
+
+
+def get_file_copy_function(mode: str = "full") -> Callable:
+    """
+    Get the function copying a single file in a given copy mode
+
+    Parameters
+    ----------
+    mode : str, optional
+        The copy mode, one of COPY_MODES, by default "full"
+
+    Returns
+    -------
+    Callable
+        A function copying a source file to a destination file
+    """
+    functions = {
+        "full": full_copy_file,
+        "hardlink": hardlink_file,
+        "reflink": reflink_file,
+        "symlink": symlink_file,
+    }
+    if mode not in functions:
+        raise ValueError(f"Unknown copy mode {mode}. Available modes: {COPY_MODES}")
+    return functions[mode]
+
+
+def copy_file(source: Union[str, Path], destination: Union[str, Path], mode: str = "full") -> Union[str, Path]:
+    """
+    Copy a single file in a given copy mode
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to copy
+    destination : Union[str, Path]
+        The path of the copy
+    mode : str, optional
+        The copy mode, one of COPY_MODES, by default "full"
+
+    Returns
+    -------
+    Union[str, Path]
+        The destination
+    """
+    return get_file_copy_function(mode)(source, destination)
+
+
+def copy_tree_python(source: Union[str, Path], destination: Union[str, Path], mode: str = "full") -> None:
+    """
+    Copy the content of a directory using the standard library
+
+    Symbolic links are followed and file metadata (including modification
+    times) is preserved, matching ``rsync -aL``.
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The directory to copy
+    destination : Union[str, Path]
+        The directory to copy into
+    mode : str, optional
+        How files are copied, one of COPY_MODES, by default "full"
+    """
+    shutil.copytree(source, destination, symlinks=False, copy_function=get_file_copy_function(mode), dirs_exist_ok=True)
+
+
+def copy_tree_rsync(source: Union[str, Path], destination: Union[str, Path], mode: str = "full") -> None:
+    """
+    Copy the content of a directory with rsync
+
+    rsync is started with an argument vector (no shell) and without
+    compression, which only costs CPU on local copies.
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The directory to copy
+    destination : Union[str, Path]
+        The directory to copy into
+    mode : str, optional
+        How files are copied, either "full" or "hardlink", by default "full"
+    """
+    if mode not in ["full", "hardlink"]:
+        raise ValueError(f"The rsync backend does not support the {mode} copy mode")
+    cmd = ["rsync", "-aL"]
+    if mode == "hardlink":
+        cmd.append(f"--link-dest={Path(source).resolve()}")
+    subprocess.run(
+        cmd + [f"{Path(source)}/", f"{Path(destination)}/"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+
+def get_copy_function(backend: str, mode: str = "full") -> Callable:
+    """
+    Get the function implementing a copy backend
+
+    Parameters
+    ----------
+    backend : str
+        The name of the backend, one of COPY_BACKENDS
+    mode : str, optional
+        How files are copied, one of COPY_MODES, by default "full"
+
+    Returns
+    -------
+    Callable
+        A function copying a source directory into a destination directory
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode {mode}. Available modes: {COPY_MODES}")
+    if backend == "python":
+        return partial(copy_tree_python, mode=mode)
+    if backend == "rsync":
+        if mode not in ["full", "hardlink"]:
+            raise ValueError(f"The rsync backend does not support the {mode} copy mode")
+        return partial(copy_tree_rsync, mode=mode)
+    raise ValueError(f"Unknown copy backend {backend}. Available backends: {COPY_BACKENDS}")
+
+
+def copy_session(
+    source: Path,
+    destination: Path,
+    copy_function: Callable,
+    force: bool = False,
+    previous: dict = None,
+    file_copy_function: Callable = full_copy_file,
+    checksum: bool = False,
+) -> CopyResult:
+    """
+    Copy a single session directory, or bring an existing copy up to date
+
+    A session that was not copied yet is copied as a whole. For an existing
+    copy, only the files that were added or changed in the source since the
+    previous copy (as recorded in ``previous``) are copied, and the files that
+    were removed from the source are removed from the copy. An existing copy
+    without a previous record is kept as is.
+
+    Parameters
+    ----------
+    source : Path
+        The session directory to copy
+    destination : Path
+        Where the session should be copied to
+    copy_function : Callable
+        The function copying a whole directory
+    force : bool, optional
+        Whether to remove an existing copy first, by default False
+    previous : dict, optional
+        The entries recorded at the previous copy of the session, by default None
+    file_copy_function : Callable, optional
+        The function copying a single file, by default full_copy_file
+    checksum : bool, optional
+        Whether to compare content hashes of files whose size or
+        modification time changed, by default False
+
+    Returns
+    -------
+    CopyResult
+        The outcome of the copy
+    """
+    full_copy = force or not destination.exists()
+    try:
+        entries = scan_files(source, previous=previous, checksum=checksum)
+        if full_copy:
+            if destination.exists():
+                shutil.rmtree(destination)
+            destination.mkdir(parents=True, exist_ok=True)
+            copy_function(source, destination)
+            return CopyResult(source, destination, "copied", entries=entries, added=sorted(entries))
+        if previous is None:
+            return CopyResult(source, destination, "skipped", entries=entries)
+        added, changed, removed = compare_entries(previous, entries)
+        for relative in added + changed:
+            (destination / relative).parent.mkdir(parents=True, exist_ok=True)
+            file_copy_function(source / relative, destination / relative)
+        for relative in removed:
+            if os.path.lexists(destination / relative):
+                (destination / relative).unlink()
+    except Exception as e:
+        if full_copy:
+            # never leave a partial copy behind, it would be skipped on the next run
+            shutil.rmtree(destination, ignore_errors=True)
+        return CopyResult(source, destination, "failed", e)
+    status = "updated" if added or changed or removed else "skipped"
+    return CopyResult(source, destination, status, entries=entries, added=added, changed=changed, removed=removed)
+
+
+def copy_top_level_files(
+    source: Path,
+    destination: Path,
+    force: bool = False,
+    previous: dict = None,
+    file_copy_function: Callable = full_copy_file,
+    checksum: bool = False,
+) -> CopyResult:
+    """
+    Copy the files directly under the root of a dataset (e.g. dataset_description.json),
+    or bring their copies up to date
+
+    As for sessions, only the files that were added or changed since the
+    previous copy (as recorded in ``previous``) are copied, and the files
+    that were removed from the source are removed from the copy.
+
+    Parameters
+    ----------
+    source : Path
+        The root of the dataset
+    destination : Path
+        The root of the copy
+    force : bool, optional
+        Whether to copy every file again, by default False
+    previous : dict, optional
+        The entries recorded at the previous copy of the files, by default None
+    file_copy_function : Callable, optional
+        The function copying a single file, by default full_copy_file
+    checksum : bool, optional
+        Whether to compare content hashes of files whose size or
+        modification time changed, by default False
+
+    Returns
+    -------
+    CopyResult
+        The outcome of the copy
+    """
+    previous = None if force else previous
+    try:
+        entries = scan_files(source, previous=previous, checksum=checksum, recursive=False)
+        added, changed, removed = compare_entries(previous or {}, entries)
+        destination.mkdir(parents=True, exist_ok=True)
+        for relative in added + changed:
+            file_copy_function(source / relative, destination / relative)
+        for relative in removed:
+            if os.path.lexists(destination / relative):
+                (destination / relative).unlink()
+    except Exception as e:
+        return CopyResult(source, destination, "failed", e)
+    if previous is None:
+        status = "copied"
+    else:
+        status = "updated" if added or changed or removed else "skipped"
+    return CopyResult(source, destination, status, entries=entries, added=added, changed=changed, removed=removed)
+
+
+def copy_sessions(
+    sessions: list,
+    copy_function: Callable,
+    logger: logging.Logger,
+    force: bool = False,
+    jobs: int = 1,
+    stop_on_first_crash: bool = False,
+    manifest: dict = None,
+    file_copy_function: Callable = full_copy_file,
+    checksum: bool = False,
+    metrics: Metrics = None,
+    progress=None,
+    results: list = None,
+) -> list:
+    """
+    Copy multiple session directories using a bounded pool of workers
+
+    Parameters
+    ----------
+    sessions : list
+        A list of (source, destination) tuples
+    copy_function : Callable
+        The function copying a whole directory
+    logger : logging.Logger
+        The logger
+    force : bool, optional
+        Whether to remove existing copies first, by default False
+    jobs : int, optional
+        The maximal number of sessions copied at the same time, by default 1
+    stop_on_first_crash : bool, optional
+        Whether to cancel the remaining copies once one has failed, by default False
+    manifest : dict, optional
+        The entries recorded at the previous copy, for each source session, by default None
+    file_copy_function : Callable, optional
+        The function copying a single file, by default full_copy_file
+    checksum : bool, optional
+        Whether to compare content hashes of modified files, by default False
+    metrics : Metrics, optional
+        Where to record the time spent copying and the files and bytes copied, by default None
+    progress : optional
+        A progress display, updated after each session, by default None
+    results : list, optional
+        The list to which the results are appended as the copies complete, so
+        that the completed copies are known even when ``stop_on_first_crash``
+        raises, by default a new list
+
+    Returns
+    -------
+    list
+        A list of CopyResult, one for each session that was processed
+    """
+    manifest = manifest or {}
+    metrics = metrics if metrics is not None else NullMetrics()
+    progress = progress if progress is not None else NullProgress()
+    results = results if results is not None else []
+
+    def timed_copy_session(*args):
+        with metrics.stage("copy_session"):
+            return copy_session(*args)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [
+            executor.submit(
+                timed_copy_session,
+                source,
+                destination,
+                copy_function,
+                force,
+                manifest.get(source),
+                file_copy_function,
+                checksum,
+            )
+            for source, destination in sessions
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            progress.update()
+            if metrics.enabled:
+                _count_copy(metrics, result)
+            if result.status == "skipped":
+                logger.info(f"Copy of session {result.source} is up to date: {result.destination}")
+            elif result.status == "copied":
+                logger.info(f"Successfully copied session {result.source} to {result.destination}")
+            elif result.status == "updated":
+                logger.info(
+                    f"Updated copy of session {result.source}: {len(result.added)} added, "
+                    f"{len(result.changed)} changed and {len(result.removed)} removed files"
+                )
+            else:
+                logger.error(f"Failed to copy session {result.source} to {result.destination}: {result.error}")
+                if stop_on_first_crash:
+                    for pending in futures:
+                        pending.cancel()
+                    raise result.error
+    return results
+
+
+def _count_copy(metrics: Metrics, result: CopyResult) -> None:
+    """
+    Record the files scanned and copied for a session
+    """
+    metrics.count(f"sessions_{result.status}")
+    metrics.count("files_scanned", len(result.entries or {}))
+    if result.status == "copied":
+        copied = list(result.entries)
+    elif result.status == "updated":
+        copied = result.added + result.changed
+    else:
+        return
+    metrics.count("files_copied", len(copied))
+    metrics.count("bytes_copied", sum(result.entries[name]["size"] for name in copied if name in result.entries))
@@ -0,0 +1,262 @@
+import logging
+import os
+import sqlite3
+import stat as stat_module
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Union
+
+from bidsbase.manager.utils.manifest import file_hash
+from bidsbase.manager.utils.state import JOURNAL_MODE
+
+HASHES_NAME = "hashes.sqlite"
+HASHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (device, inode)
+)
+"""
+# hashing is bound by the disk rather than the CPU (hashlib releases the GIL on large buffers)
+HASH_JOBS = min(8, os.cpu_count() or 1)
+
+
+@dataclass
+class DedupResult:
+    """
+    The outcome of a deduplication pass
+    """
+
+    files: int = 0
+    hashed: int = 0
+    linked: int = 0
+    bytes_reclaimed: int = 0
+
+
+class HashCache:
+    """
+    The content hashes of files, kept in a SQLite database and keyed by
+    (device, inode) along with the files' size and modification time
+
+    A file whose inode, size and modification time did not change since it
+    was hashed is not hashed again. Files hard linked together share their
+    inode, so they are hashed once.
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: float = 60.0, journal_mode: str = JOURNAL_MODE):
+        """
+        Load the hashes
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the database
+        timeout : float, optional
+            How long to wait for a lock held by another writer, in seconds, by default 60
+        journal_mode : str, optional
+            The journal mode of the database, by default JOURNAL_MODE ("WAL")
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.hits = 0
+        self.misses = 0
+        self._visited = set()
+        self._changed = {}
+        # files are hashed by several threads at once
+        self._lock = threading.Lock()
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT device, inode, size, mtime, hash FROM hashes")
+            self._hashes = {(device, inode): (size, mtime, digest) for device, inode, size, mtime, digest in rows}
+        finally:
+            connection.close()
+
+    def __repr__(self) -> str:
+        return f"<HashCache {self.path}: {len(self._hashes)} files>"
+
+    def __contains__(self, stat: os.stat_result) -> bool:
+        cached = self._hashes.get((stat.st_dev, stat.st_ino))
+        return cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns)
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are only held while loading and saving, as for the listing cache
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(HASHES_SCHEMA)
+        return connection
+
+    def hash(self, path: Union[str, Path], stat: os.stat_result) -> str:
+        """
+        Get the content hash of a file, from the cache if the file did not change since it was hashed
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The file
+        stat : os.stat_result
+            The status of the file
+
+        Returns
+        -------
+        str
+            The hexadecimal digest of the file
+        """
+        key = (stat.st_dev, stat.st_ino)
+        with self._lock:
+            self._visited.add(key)
+            if stat in self:
+                self.hits += 1
+                return self._hashes[key][2]
+            self.misses += 1
+        digest = file_hash(path)
+        with self._lock:
+            self._changed[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def save(self) -> None:
+        """
+        Write the new hashes, and forget the files that were not seen since the cache was loaded
+        """
+        removed = [key for key in self._hashes if key not in self._visited]
+        if not self._changed and not removed:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO hashes (device, inode, size, mtime, hash) VALUES (?, ?, ?, ?, ?)",
+                    [(*key, *value) for key, value in self._changed.items()],
+                )
+                connection.executemany("DELETE FROM hashes WHERE device = ? AND inode = ?", removed)
+        finally:
+            connection.close()
+        for key in removed:
+            self._hashes.pop(key)
+        self._hashes.update(self._changed)
+        self._visited = set()
+        self._changed = {}
+
+
+def _replace_with_link(canonical: str, duplicate: str, stat: os.stat_result, logger: logging.Logger) -> bool:
+    """
+    Atomically replace a file with a hard link to another one, unless it changed since it was hashed
+    """
+    try:
+        current = os.lstat(duplicate)
+    except FileNotFoundError:
+        return False
+    if (current.st_ino, current.st_size, current.st_mtime_ns) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+        return False
+    temporary = os.path.join(os.path.dirname(duplicate), f".{os.path.basename(duplicate)}.dedup")
+    try:
+        if os.path.lexists(temporary):
+            os.unlink(temporary)
+        os.link(canonical, temporary)
+        os.replace(temporary, duplicate)
+    except OSError as e:
+        # e.g. the maximum number of links to a file was reached
+        logger.warning(f"Could not link {duplicate} to {canonical}: {e}")
+        return False
+    return True
+
+
+def deduplicate_tree(
+    root: Union[str, Path],
+    cache: Union[str, Path] = None,
+    jobs: int = HASH_JOBS,
+    logger: logging.Logger = None,
+    journal_mode: str = JOURNAL_MODE,
+) -> DedupResult:
+    """
+    Replace the files with identical content under a directory by hard links to a single copy
+
+    Only files of the same size can be identical, so the files whose size
+    is unique are never read. The others are hashed in a pool of threads,
+    and each group of files with the same size and hash is linked to one of
+    its files: the one already linked the most, then the one hashed by a
+    previous pass, then the first by path, so that files deduplicated before
+    keep their inode. Files are only linked within a filesystem.
+
+    The linked files share their content, so they must never be written in
+    place. Neither copies nor fixes do: they replace files instead.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The directory to deduplicate (e.g. the working copy)
+    cache : Union[str, Path], optional
+        The database of the content hashes, so that later passes only hash
+        new or changed files, by default None (every candidate is hashed)
+    jobs : int, optional
+        The number of files hashed at the same time, by default HASH_JOBS
+    logger : logging.Logger, optional
+        The logger, by default None
+    journal_mode : str, optional
+        The journal mode of the database of the content hashes, by default JOURNAL_MODE ("WAL")
+
+    Returns
+    -------
+    DedupResult
+        The number of files seen, hashed and linked, and the disk space reclaimed
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    result = DedupResult()
+    # (device, size) -> (device, inode) -> [paths], symbolic links and empty files left aside
+    by_size = defaultdict(lambda: defaultdict(list))
+    stats = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            stat = os.lstat(path)
+            result.files += 1
+            if not stat_module.S_ISREG(stat.st_mode) or stat.st_size == 0:
+                continue
+            by_size[(stat.st_dev, stat.st_size)][(stat.st_dev, stat.st_ino)].append(path)
+            stats[(stat.st_dev, stat.st_ino)] = stat
+    candidates = [inode for inodes in by_size.values() if len(inodes) > 1 for inode in inodes]
+    hashes = HashCache(cache, journal_mode=journal_mode) if cache is not None else None
+    known = {inode for inode in candidates if hashes is not None and stats[inode] in hashes}
+
+    def hash_inode(inode: tuple) -> str:
+        path = by_size[(inode[0], stats[inode].st_size)][inode][0]
+        return hashes.hash(path, stats[inode]) if hashes is not None else file_hash(path)
+
+    if len(candidates) > 1 and jobs > 1:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(candidates))) as executor:
+            digests = dict(zip(candidates, executor.map(hash_inode, candidates)))
+    else:
+        digests = {inode: hash_inode(inode) for inode in candidates}
+    result.hashed = len(candidates) - len(known)
+    groups = defaultdict(list)
+    for inode, digest in digests.items():
+        groups[(inode[0], stats[inode].st_size, digest)].append(inode)
+    for (_, size, _), inodes in groups.items():
+        if len(inodes) < 2:
+            continue
+        paths = by_size[(inodes[0][0], size)]
+        inodes.sort(key=lambda inode: (-len(paths[inode]), inode not in known, paths[inode][0]))
+        canonical = paths[inodes[0]][0]
+        for inode in inodes[1:]:
+            linked = [path for path in paths[inode] if _replace_with_link(canonical, path, stats[inode], logger)]
+            result.linked += len(linked)
+            # the content is only freed once no link to it is left, inside or outside the directory
+            if linked and len(linked) == stats[inode].st_nlink:
+                result.bytes_reclaimed += size
+            for path in linked:
+                logger.debug(f"Linked {path} to {canonical}")
+    if hashes is not None:
+        hashes.save()
+    logger.info(
+        f"Deduplicated {root}: {result.linked} files linked to identical ones, "
+        f"{result.bytes_reclaimed / (1 << 20):.1f} MiB reclaimed ({result.hashed} of {result.files} files hashed)"
+    )
+    return result
@@ -0,0 +1,76 @@
+import json
+import logging
+from pathlib import Path
+from typing import Union
+
+DESCRIPTION_NAME = "dataset_description.json"
+MANDATORY_FIELDS = ("Name", "BIDSVersion")
+
+
+def check_root(root: Union[str, Path], logger: logging.Logger = None) -> tuple:
+    """
+    Check the root of a BIDS dataset and read its description, without pybids
+
+    This is the lightweight check used when the full validation is turned
+    off: a missing or incomplete ``dataset_description.json`` is reported as
+    a warning instead of an error.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The root directory of the BIDS dataset
+    logger : logging.Logger, optional
+        The logger, by default None
+
+    Returns
+    -------
+    tuple
+        The absolute path to the root directory, and the dataset's description
+        (None if it is missing or is not valid JSON)
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    root = Path(root).absolute()
+    if not root.is_dir():
+        raise ValueError(f"BIDS root does not exist: {root}")
+    target = root / DESCRIPTION_NAME
+    if not target.exists():
+        logger.warning(f"'{DESCRIPTION_NAME}' is missing from {root}")
+        return root, None
+    try:
+        with open(target, "r", encoding="utf-8") as f:
+            description = json.load(f)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        logger.warning(f"'{DESCRIPTION_NAME}' is not a valid JSON file: {e}")
+        return root, None
+    missing = [field for field in MANDATORY_FIELDS if field not in description]
+    if missing:
+        logger.warning(f"Mandatory fields missing from '{DESCRIPTION_NAME}': {', '.join(missing)}")
+    return root, description
+
+
+def validate_root(root: Union[str, Path], validate: bool = True, logger: logging.Logger = None) -> tuple:
+    """
+    Validate the root of a BIDS dataset and read its description
+
+    pybids is only imported for the full validation.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The root directory of the BIDS dataset
+    validate : bool, optional
+        Whether to validate the dataset with pybids, by default True.
+        Otherwise, only the lightweight ``check_root`` is run.
+    logger : logging.Logger, optional
+        The logger, by default None
+
+    Returns
+    -------
+    tuple
+        The absolute path to the root directory, and the dataset's description
+    """
+    if not validate:
+        return check_root(root, logger=logger)
+    from bids.layout.validation import validate_root as bids_validate_root
+
+    return bids_validate_root(root, validate=True)
@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Union
+
+LEASES_DIRECTORY = "leases"
+FINAL_STATUSES = ("done", "failed")
+# how often a process with no free session left checks on the sessions leased by the others, in seconds
+LEASE_POLL_INTERVAL = 5.0
+
+
+class LeaseDirectory:
+    """
+    Leases on the sessions of a dataset, kept as lock files in a directory
+    shared by every process of a run (possibly on several nodes)
+
+    A lease is taken by creating its file exclusively, which is atomic on
+    local and network filesystems. While a process holds leases, a background
+    thread renews them by touching their files every ``heartbeat`` seconds. A
+    lease not renewed for ``ttl`` seconds is stale: its holder is assumed dead
+    and the lease can be taken over. Once processed, a session's lease is
+    kept with a final status ("done" or "failed"), so that the other
+    processes of the run skip it.
+
+    The ages of the leases are measured with the filesystem's clock (the
+    modification time of a file touched by this process), not with the
+    clocks of the nodes, which may drift apart.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        ttl: float = 600.0,
+        heartbeat: float = None,
+        owner: str = None,
+        logger: logging.Logger = None,
+    ):
+        """
+        Open (or create) a directory of leases
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The directory of the leases
+        ttl : float, optional
+            How long a lease lives without being renewed, in seconds, by default 600
+        heartbeat : float, optional
+            How often the held leases are renewed, in seconds, by default a third of ttl
+        owner : str, optional
+            The name of this process in the leases, by default its host name, pid and a random suffix
+        logger : logging.Logger, optional
+            The logger, by default None
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.heartbeat = heartbeat if heartbeat is not None else ttl / 3
+        self.owner = owner if owner is not None else f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self) -> str:
+        return f"<LeaseDirectory {self.path}: {len(self._held)} leases held by {self.owner}>"
+
+    @property
+    def held(self) -> list:
+        """
+        The keys of the leases held by this process
+        """
+        with self._lock:
+            return sorted(self._held)
+
+    def _path(self, key: str) -> Path:
+        return self.path / f"{key.replace('/', '_')}.lease"
+
+    def _read(self, path: Path) -> dict:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # a lease being created is still empty
+            return {}
+
+    def _now(self) -> float:
+        """
+        Get the current time of the filesystem's clock
+        """
+        clock = self.path / f".clock.{self.owner}"
+        clock.touch()
+        return clock.stat().st_mtime
+
+    def status(self, key: str) -> str:
+        """
+        Get the status of a session's lease
+
+        Parameters
+        ----------
+        key : str
+            The session's key (e.g. "sub-01/ses-1")
+
+        Returns
+        -------
+        str
+            None if there is no lease, "held" or a final status ("done" or "failed")
+        """
+        path = self._path(key)
+        if not path.exists():
+            return None
+        return self._read(path).get("status", "held")
+
+    def is_final(self, key: str) -> bool:
+        """
+        Whether a session was processed by a process of the run
+        """
+        return self.status(key) in FINAL_STATUSES
+
+    def acquire(self, key: str) -> bool:
+        """
+        Take the lease of a session, if it is free, stale or held by no one
+
+        Parameters
+        ----------
+        key : str
+            The session's key (e.g. "sub-01/ses-1")
+
+        Returns
+        -------
+        bool
+            Whether the lease was taken
+        """
+        path = self._path(key)
+        # a second attempt after taking over a stale lease
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"owner": self.owner, "status": "held", "acquired": time.time()}, f)
+            with self._lock:
+                self._held[key] = path
+            self._start_heartbeat()
+            return True
+        return False
+
+    def _break_stale(self, path: Path) -> bool:
+        """
+        Remove a lease whose holder stopped renewing it
+
+        Returns
+        -------
+        bool
+            Whether the lease is gone
+        """
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        lease = self._read(path)
+        if lease.get("status") in FINAL_STATUSES or self._now() - mtime < self.ttl:
+            return False
+        # renaming is atomic, so only one of the processes breaking the lease succeeds
+        stale = path.with_name(f"{path.name}.stale.{self.owner}")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return True
+        if self._read(stale).get("owner") != lease.get("owner") or self._now() - stale.stat().st_mtime < self.ttl:
+            # the lease was renewed or taken over in the meantime, put it back
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        self.logger.warning(f"Took over the stale lease of {lease.get('owner')} on {path.stem}")
+        return True
+
+    def release(self, key: str, status: str = None) -> None:
+        """
+        Release the lease of a session
+
+        Parameters
+        ----------
+        key : str
+            The session's key (e.g. "sub-01/ses-1")
+        status : str, optional
+            The final status of the session ("done" or "failed"), kept in its lease so
+            that the other processes skip it. By default None, the lease is removed and
+            the session can be taken by another process.
+        """
+        with self._lock:
+            path = self._held.pop(key, None)
+        if path is None:
+            return
+        if status is None:
+            path.unlink(missing_ok=True)
+            return
+        temporary = path.with_name(f".{path.name}.{self.owner}")
+        with open(temporary, "w") as f:
+            json.dump({"owner": self.owner, "status": status, "released": time.time()}, f)
+        os.replace(temporary, path)
+
+    def renew(self) -> None:
+        """
+        Renew the leases held by this process
+        """
+        with self._lock:
+            held = dict(self._held)
+        for key, path in held.items():
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                with self._lock:
+                    if self._held.get(key) != path:
+                        # released in the meantime
+                        continue
+                    self._held.pop(key)
+                self.logger.error(f"Lost the lease on {key}, another process may be processing it too")
+
+    def _start_heartbeat(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._beat, name="bidsbase-leases", daemon=True)
+        self._thread.start()
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.heartbeat):
+            self.renew()
+
+    def close(self) -> None:
+        """
+        Stop renewing the leases, and release those still held so that other processes can take them
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+        for key in self.held:
+            self.release(key)
+        (self.path / f".clock.{self.owner}").unlink(missing_ok=True)
@@ -1,34 +1,160 @@
+import atexit
 import datetime
+import json
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
 from pathlib import Path
 from typing import Union
 
+LOGGER_NAME = "bidsbase"
+WORKER_LOGGER_NAME = f"{LOGGER_NAME}.worker"
+
+_lock = threading.Lock()
+_listener = None
+_dispatcher = None
+_file_handlers = {}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format log records as JSON objects, one per line
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class _Dispatcher(logging.Handler):
+    """
+    Route the records read from the queue to the file handlers, which can be
+    added while the listener is running
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.handlers = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        for handler in list(self.handlers):
+            if record.levelno >= handler.level and handler.filter(record):
+                handler.handle(record)
+
+
+def _start_listener() -> None:
+    """
+    Attach a queue to the package's logger, and start the thread writing its records
+    """
+    global _listener, _dispatcher
+    log_queue = queue.SimpleQueue()
+    _dispatcher = _Dispatcher()
+    _listener = QueueListener(log_queue, _dispatcher)
+    _listener.start()
+    package_logger = logging.getLogger(LOGGER_NAME)
+    package_logger.setLevel(logging.DEBUG)
+    package_logger.addHandler(QueueHandler(log_queue))
+    atexit.unregister(shutdown_logging)
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Write the queued records and close the log files
+    """
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        package_logger = logging.getLogger(LOGGER_NAME)
+        for handler in list(package_logger.handlers):
+            if isinstance(handler, QueueHandler):
+                package_logger.removeHandler(handler)
+        for handler in _file_handlers.values():
+            handler.close()
+        _file_handlers.clear()
+
 
 def initiate_logger(
     destination: Union[str, Path],
     name: str = "logger",
+    json_lines: bool = False,
 ):
     """
     Initiate a logger
 
+    The records of all loggers are put on a queue and written to their files
+    by a single background thread, so logging never blocks on disk. A log
+    file is created once per destination and name, however many times the
+    logger is initiated.
+
     Parameters
     ----------
+    destination : Union[str, Path]
+        The directory of the log file
     name : str, optional
         The name of the logger, by default "logger"
+    json_lines : bool, optional
+        Whether to write JSON lines instead of text, by default False
 
     Returns
     -------
     logging.Logger
         The logger
     """
-    log_filename = datetime.datetime.now().strftime(f"{name}_%Y-%m-%d_%H-%M-%S.txt")
-    log_path = Path(destination) / log_filename
-    logger = logging.getLogger("logger")
-    logger.setLevel(logging.DEBUG)
-    file_handler = logging.FileHandler(log_path)
-    file_handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    logger = logging.getLogger(f"{LOGGER_NAME}.{name}")
+    key = (str(Path(destination).resolve()), name, json_lines)
+    with _lock:
+        if _listener is None:
+            _start_listener()
+        if key in _file_handlers:
+            return logger
+        extension = "jsonl" if json_lines else "txt"
+        log_filename = datetime.datetime.now().strftime(f"{name}_%Y-%m-%d_%H-%M-%S.{extension}")
+        log_path = Path(destination) / log_filename
+        file_handler = logging.FileHandler(log_path)
+        file_handler.setLevel(logging.DEBUG)
+        if json_lines:
+            file_handler.setFormatter(JsonLinesFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        file_handler.addFilter(logging.Filter(logger.name))
+        _file_handlers[key] = file_handler
+        _dispatcher.handlers.append(file_handler)
     logger.info(f"Log file created at {log_path}")
     return logger
+
+
+def get_session_logger(logger: logging.Logger, session_path: Union[str, Path]) -> logging.Logger:
+    """
+    Get the child logger of a session
+
+    Child loggers write to the files of their parent, so no file is opened per session.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The parent logger
+    session_path : Union[str, Path]
+        The path to the session directory
+
+    Returns
+    -------
+    logging.Logger
+        The session's logger
+    """
+    session_path = Path(session_path)
+    return logger.getChild(f"{session_path.parent.name}_{session_path.name}")
@@ -0,0 +1,205 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Union
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# the key of the files directly under the root of the dataset
+TOP_LEVEL_KEY = "."
+
+
+def file_hash(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """
+    Compute a fast content hash of a file
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The file to hash
+    chunk_size : int, optional
+        The number of bytes read at a time, by default 1 MiB
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_files(
+    directory: Union[str, Path],
+    previous: dict = None,
+    checksum: bool = False,
+    recursive: bool = True,
+) -> dict:
+    """
+    Describe every file under a directory by its size and modification time
+
+    Parameters
+    ----------
+    directory : Union[str, Path]
+        The directory to scan
+    previous : dict, optional
+        A previous scan of the same directory, whose hashes are reused for
+        files that did not change, by default None
+    checksum : bool, optional
+        Whether to also store a content hash of each file, by default False
+    recursive : bool, optional
+        Whether to scan the subdirectories too, or only the files directly
+        under the directory, by default True
+
+    Returns
+    -------
+    dict
+        A dictionary mapping paths relative to the directory to their entries
+    """
+    previous = previous or {}
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(directory, followlinks=True):
+        if not recursive:
+            dirnames.clear()
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relative = Path(path).relative_to(directory).as_posix()
+            stat = os.stat(path)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+            if checksum:
+                old = previous.get(relative, {})
+                same = old.get("size") == entry["size"] and old.get("mtime") == entry["mtime"]
+                entry["hash"] = old["hash"] if same and "hash" in old else file_hash(path)
+            entries[relative] = entry
+    return entries
+
+
+def compare_entries(previous: dict, current: dict) -> tuple:
+    """
+    Compare two scans of the same directory
+
+    A file is considered changed when its size or modification time differ,
+    unless both scans hold a content hash and the hashes are identical.
+
+    Parameters
+    ----------
+    previous : dict
+        The scan recorded at the last copy
+    current : dict
+        The current scan
+
+    Returns
+    -------
+    Tuple(list, list, list)
+        The added, changed and removed relative paths
+    """
+    added = sorted(set(current) - set(previous))
+    removed = sorted(set(previous) - set(current))
+    changed = []
+    for relative in sorted(set(current) & set(previous)):
+        old, new = previous[relative], current[relative]
+        if (old["size"], old["mtime"]) == (new["size"], new["mtime"]):
+            continue
+        if "hash" in old and "hash" in new and old["hash"] == new["hash"]:
+            continue
+        changed.append(relative)
+    return added, changed, removed
+
+
+class Manifest:
+    """
+    The record of the source files copied to the working copy, per session
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Load a manifest, or start an empty one if it does not exist yet
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the manifest file
+        """
+        self.path = Path(path)
+        self.sessions = self._load()
+        # the sessions changed since loading, written over the file's current content on save
+        self._changed = set()
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        return data["sessions"] if data.get("version") == MANIFEST_VERSION else {}
+
+    def get(self, session: str) -> dict:
+        """
+        Get the entries recorded for a session
+
+        Parameters
+        ----------
+        session : str
+            The path of the session relative to the dataset's root
+
+        Returns
+        -------
+        dict
+            The recorded entries, or None if the session was never recorded
+        """
+        return self.sessions.get(session)
+
+    def update(self, session: str, entries: dict) -> None:
+        """
+        Record the entries of a session
+
+        Parameters
+        ----------
+        session : str
+            The path of the session relative to the dataset's root
+        entries : dict
+            The entries of the session's files
+        """
+        self.sessions[session] = entries
+        self._changed.add(session)
+
+    def remove(self, session: str) -> None:
+        """
+        Forget a session
+
+        Parameters
+        ----------
+        session : str
+            The path of the session relative to the dataset's root
+        """
+        self.sessions.pop(session, None)
+        self._changed.add(session)
+
+    def save(self) -> None:
+        """
+        Write the manifest to disk, atomically
+
+        The changes are merged into the manifest's current content under a
+        lock, so that processes copying different sessions (e.g. shards of
+        the dataset on several nodes) do not overwrite each other's records.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f".{self.path.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            sessions = self._load()
+            for session in self._changed:
+                if session in self.sessions:
+                    sessions[session] = self.sessions[session]
+                else:
+                    sessions.pop(session, None)
+            fd, temporary = tempfile.mkstemp(prefix=f".{self.path.name}.", dir=self.path.parent)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "sessions": sessions}, f)
+            os.replace(temporary, self.path)
+        self.sessions = sessions
+        self._changed = set()
@@ -0,0 +1,230 @@
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+METRICS_NAME = "metrics"
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Metrics:
+    """
+    The time spent in each stage of a run, and counters of the work done
+
+    Stages and counters are identified by names (e.g. "copy_session",
+    "fix.fix_multiple_dwi_runs", "bytes_copied"). Metrics can be updated from
+    several threads, and merged with the metrics of worker processes.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<Metrics: {len(self.stages)} stages, {len(self.counters)} counters>"
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """
+        Add time spent in a stage
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += calls
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increase a counter
+
+        Parameters
+        ----------
+        name : str
+            The name of the counter
+        value : int, optional
+            The increment, by default 1
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other: dict) -> None:
+        """
+        Add the metrics of another run (e.g. of a worker process)
+
+        Parameters
+        ----------
+        other : dict
+            The metrics, as returned by ``to_dict``
+        """
+        for name, stage in other.get("stages", {}).items():
+            self.add_time(name, stage["seconds"], stage["calls"])
+        for name, value in other.get("counters", {}).items():
+            self.count(name, value)
+
+    def to_dict(self) -> dict:
+        """
+        Get the metrics as a JSON-serializable dictionary
+        """
+        with self._lock:
+            return {
+                "stages": {name: dict(stage) for name, stage in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Get the metrics in the Prometheus text exposition format
+        """
+        metrics = self.to_dict()
+        lines = [
+            "# HELP bidsbase_stage_seconds_total Time spent in each stage.",
+            "# TYPE bidsbase_stage_seconds_total counter",
+        ]
+        lines += [f'bidsbase_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}' for name, stage in metrics["stages"].items()]
+        lines += [
+            "# HELP bidsbase_stage_calls_total Number of times each stage ran.",
+            "# TYPE bidsbase_stage_calls_total counter",
+        ]
+        lines += [f'bidsbase_stage_calls_total{{stage="{name}"}} {stage["calls"]}' for name, stage in metrics["stages"].items()]
+        for name, value in metrics["counters"].items():
+            metric = "bidsbase_" + re.sub(r"[^a-zA-Z0-9_]", "_", name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def save(self, directory: Union[str, Path]) -> None:
+        """
+        Write the metrics to ``metrics.json`` and ``metrics.prom`` in a directory
+
+        Parameters
+        ----------
+        directory : Union[str, Path]
+            The destination directory
+        """
+        directory = Path(directory)
+        for extension, content in [("json", json.dumps(self.to_dict(), indent=4)), ("prom", self.to_prometheus())]:
+            path = directory / f"{METRICS_NAME}.{extension}"
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text(content)
+            os.replace(tmp_path, path)
+
+
+class NullMetrics(Metrics):
+    """
+    Metrics that record nothing, used when metrics are turned off
+    """
+
+    enabled = False
+
+    def stage(self, name: str):
+        return _NULL_STAGE
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+    def merge(self, other: dict) -> None:
+        pass
+
+    def save(self, directory: Union[str, Path]) -> None:
+        pass
+
+
+class Progress:
+    """
+    A single-line progress display with throughput and estimated time left
+    """
+
+    def __init__(self, total: int, description: str, stream=None, interval: float = 0.1):
+        """
+        Start a progress display
+
+        Parameters
+        ----------
+        total : int
+            The number of items to process
+        description : str
+            What is being processed (e.g. "Copying sessions")
+        stream : optional
+            Where to write the display, by default sys.stderr
+        interval : float, optional
+            The minimal time between two refreshes, in seconds, by default 0.1
+        """
+        self.total = total
+        self.description = description
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.done = 0
+        self.start = time.monotonic()
+        self._last = 0.0
+
+    def update(self, n: int = 1) -> None:
+        """
+        Mark items as processed
+        """
+        self.done += n
+        now = time.monotonic()
+        if now - self._last >= self.interval or self.done >= self.total:
+            self._last = now
+            self.stream.write("\r" + self.format(now - self.start))
+            self.stream.flush()
+
+    def format(self, elapsed: float) -> str:
+        """
+        Format the display line
+        """
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float("nan")
+        eta = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta == eta else "--:--:--"
+        return f"{self.description}: {self.done}/{self.total} ({rate:.1f}/s, ETA {eta})"
+
+    def close(self) -> None:
+        """
+        End the display line
+        """
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class NullProgress:
+    """
+    A progress display that shows nothing
+    """
+
+    def update(self, n: int = 1) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def get_progress(total: int, description: str, enabled: bool = True):
+    """
+    Get a progress display, or a no-op one when it is disabled
+    """
+    return Progress(total, description) if enabled else NullProgress()
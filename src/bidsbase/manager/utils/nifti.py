@@ -0,0 +1,228 @@
+import gzip
+import os
+import shutil
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+# b-values up to this threshold are considered b0 volumes (as MRtrix's BZeroThreshold)
+B0_THRESHOLD = 10.0
+
+# images are compressed in blocks of this size, one block per thread at a time
+GZIP_BLOCK_SIZE = 1 << 20
+GZIP_JOBS = min(8, os.cpu_count() or 1)
+# the size of deflate's window, the history a block is compressed against
+DEFLATE_WINDOW = 1 << 15
+# a gzip header without file name nor modification time, so that compressing the same image always gives the same bytes
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def mean_b0(
+    in_file: Union[str, Path],
+    bval: Union[str, Path],
+    out_file: Union[str, Path],
+    b0_threshold: float = B0_THRESHOLD,
+) -> Path:
+    """
+    Average the b0 volumes of a dwi series into a 3D image
+
+    The image is memory-mapped (or streamed, when compressed) and the b0
+    volumes are read one at a time, so the peak memory is a single volume
+    rather than the whole 4D series.
+
+    Parameters
+    ----------
+    in_file : Union[str, Path]
+        The dwi file
+    bval : Union[str, Path]
+        The bval file
+    out_file : Union[str, Path]
+        The output file
+    b0_threshold : float, optional
+        The largest b-value of a b0 volume, by default B0_THRESHOLD
+
+    Returns
+    -------
+    Path
+        The output file
+    """
+    import nibabel as nib
+    import numpy as np
+
+    bvals = np.loadtxt(bval, ndmin=1)
+    b0_volumes = np.flatnonzero(bvals <= b0_threshold)
+    if len(b0_volumes) == 0:
+        raise ValueError(f"No b0 volumes found in {bval}")
+    image = nib.load(str(in_file), mmap=True, keep_file_open=True)
+    if len(image.shape) != 4 or image.shape[3] != len(bvals):
+        raise ValueError(f"{in_file} of shape {image.shape} does not match the {len(bvals)} b-values of {bval}")
+    total = np.zeros(image.shape[:3], dtype=np.float64)
+    for volume in b0_volumes:
+        total += np.asarray(image.dataobj[..., int(volume)], dtype=np.float64)
+    mean = (total / len(b0_volumes)).astype(np.float32)
+    header = image.header.copy()
+    header.set_data_dtype(np.float32)
+    header.set_slope_inter(1, 0)
+    type(image)(mean, image.affine, header).to_filename(str(out_file))
+    return Path(out_file)
+
+
+def read_shape(path: Union[str, Path]) -> tuple:
+    """
+    Get the shape of a NIfTI-1 or NIfTI-2 image by reading its header only
+
+    Compressed images are streamed, and decompression stops right after the
+    header. Results are memoized per file path and modification time.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The image file (.nii or .nii.gz)
+
+    Returns
+    -------
+    tuple
+        The shape of the image
+    """
+    stat = os.stat(path)
+    return _read_shape(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4096)
+def _read_shape(path: str, mtime: int, size: int) -> tuple:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        header = f.read(NIFTI1_HEADER_SIZE)
+        if len(header) < NIFTI1_HEADER_SIZE:
+            raise ValueError(f"{path} is too short to be a NIfTI image")
+        for endianness in "<>":
+            sizeof_hdr = struct.unpack(f"{endianness}i", header[:4])[0]
+            if sizeof_hdr == NIFTI1_HEADER_SIZE:
+                dims = struct.unpack(f"{endianness}8h", header[40:56])
+                break
+            if sizeof_hdr == NIFTI2_HEADER_SIZE:
+                header += f.read(NIFTI2_HEADER_SIZE - NIFTI1_HEADER_SIZE)
+                dims = struct.unpack(f"{endianness}8q", header[16:80])
+                break
+        else:
+            raise ValueError(f"{path} is not a NIfTI-1 or NIfTI-2 image")
+    if not 0 < dims[0] <= 7:
+        raise ValueError(f"{path} has an invalid number of dimensions: {dims[0]}")
+    return tuple(int(dim) for dim in dims[1:dims[0] + 1])
+
+
+def get_n_volumes(path: Union[str, Path]) -> int:
+    """
+    Get the number of volumes of a NIfTI image from its header
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The image file (.nii or .nii.gz)
+
+    Returns
+    -------
+    int
+        The size of the image's fourth dimension (1 for 3D images)
+    """
+    shape = read_shape(path)
+    return shape[3] if len(shape) > 3 else 1
+
+
+def _deflate_block(block: bytes, dictionary: bytes, last: bool, level: int) -> bytes:
+    """
+    Compress a block of a gzip stream into raw deflate data
+
+    A block that is not the last one ends on a byte boundary without closing
+    the stream, so that the compressed blocks can simply be concatenated.
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def compress_file(
+    in_file: Union[str, Path],
+    out_file: Union[str, Path],
+    level: int = 6,
+    block_size: int = GZIP_BLOCK_SIZE,
+    jobs: int = GZIP_JOBS,
+) -> Path:
+    """
+    Compress a file into a gzip file, in blocks compressed in parallel
+
+    As in pigz, the file is read in blocks that are deflated by a pool of
+    threads (zlib releases the GIL), each against the last 32 KiB of the
+    previous block, and written in order as a single standard gzip stream.
+    Only a few blocks per thread are held in memory at a time.
+
+    Parameters
+    ----------
+    in_file : Union[str, Path]
+        The file to compress (e.g. a .nii image)
+    out_file : Union[str, Path]
+        The gzip file (e.g. a .nii.gz image)
+    level : int, optional
+        The compression level, by default 6 (as gzip)
+    block_size : int, optional
+        The size of the blocks, by default GZIP_BLOCK_SIZE
+    jobs : int, optional
+        The number of blocks compressed at the same time, by default GZIP_JOBS
+
+    Returns
+    -------
+    Path
+        The gzip file
+    """
+    crc, size = 0, 0
+    with open(in_file, "rb") as source, open(out_file, "wb") as destination, ThreadPoolExecutor(max_workers=jobs) as executor:
+        destination.write(GZIP_HEADER)
+        pending = deque()
+        dictionary = b""
+        block = source.read(block_size)
+        while True:
+            next_block = source.read(block_size)
+            last = not next_block
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pending.append(executor.submit(_deflate_block, block, dictionary, last, level))
+            while pending and (last or len(pending) > 2 * jobs):
+                destination.write(pending.popleft().result())
+            if last:
+                break
+            dictionary = block[-DEFLATE_WINDOW:]
+            block = next_block
+        destination.write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+    return Path(out_file)
+
+
+def decompress_file(in_file: Union[str, Path], out_file: Union[str, Path], block_size: int = GZIP_BLOCK_SIZE) -> Path:
+    """
+    Decompress a gzip file, streaming it block by block
+
+    Parameters
+    ----------
+    in_file : Union[str, Path]
+        The gzip file (e.g. a .nii.gz image)
+    out_file : Union[str, Path]
+        The decompressed file (e.g. a .nii image)
+    block_size : int, optional
+        The size of the blocks, by default GZIP_BLOCK_SIZE
+
+    Returns
+    -------
+    Path
+        The decompressed file
+    """
+    with gzip.open(in_file, "rb") as source, open(out_file, "wb") as destination:
+        shutil.copyfileobj(source, destination, block_size)
+    return Path(out_file)
@@ -0,0 +1,153 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# sidecars are small, reading and writing them is bound by the filesystem's latency, not by the CPU
+SIDECAR_JOBS = 16
+
+
+def loads(content: bytes) -> dict:
+    """
+    Parse the content of a JSON sidecar, with orjson when it is installed
+
+    Parameters
+    ----------
+    content : bytes
+        The content of the sidecar
+
+    Returns
+    -------
+    dict
+        The parsed content
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # e.g. NaN values, which the standard library accepts
+            pass
+    return json.loads(content)
+
+
+def dumps(data: dict) -> str:
+    """
+    Serialize the content of a JSON sidecar
+
+    Sidecars are always written by the standard library, with an indentation
+    of four spaces, so that their formatting does not depend on whether
+    orjson is installed.
+    """
+    return json.dumps(data, indent=4)
+
+
+def read_json(path: Union[str, Path]) -> dict:
+    """
+    Read a JSON sidecar
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The sidecar file
+
+    Returns
+    -------
+    dict
+        The content of the sidecar
+    """
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def write_json(path: Union[str, Path], data: dict, skip_unchanged: bool = True) -> bool:
+    """
+    Write a JSON sidecar atomically
+
+    The content is written to a temporary file that then replaces the
+    sidecar, so a crash never leaves a truncated sidecar behind. Replacing
+    the file also detaches it from any hard or symbolic link to the source
+    dataset.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The sidecar file
+    data : dict
+        The content of the sidecar
+    skip_unchanged : bool, optional
+        Whether to leave the sidecar (and its modification time) untouched
+        when it already holds the same content, by default True
+
+    Returns
+    -------
+    bool
+        Whether the sidecar was written
+    """
+    path = Path(path)
+    if skip_unchanged:
+        try:
+            if read_json(path) == data:
+                return False
+        except (FileNotFoundError, ValueError):
+            pass
+    temporary = path.with_name(f".{path.name}.tmp")
+    with open(temporary, "w") as f:
+        f.write(dumps(data))
+    os.replace(temporary, path)
+    return True
+
+
+def read_jsons(paths: list, jobs: int = SIDECAR_JOBS) -> dict:
+    """
+    Read many JSON sidecars at once, in a pool of threads
+
+    Parameters
+    ----------
+    paths : list
+        The sidecar files
+    jobs : int, optional
+        The number of sidecars read at the same time, by default SIDECAR_JOBS
+
+    Returns
+    -------
+    dict
+        A dictionary mapping the sidecars' paths to their content, in the order of ``paths``
+    """
+    paths = list(paths)
+    if len(paths) <= 1 or jobs <= 1:
+        return {path: read_json(path) for path in paths}
+    with ThreadPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        return dict(zip(paths, executor.map(read_json, paths)))
+
+
+def write_jsons(sidecars: dict, jobs: int = SIDECAR_JOBS, skip_unchanged: bool = True) -> list:
+    """
+    Write many JSON sidecars at once, in a pool of threads
+
+    Parameters
+    ----------
+    sidecars : dict
+        A dictionary mapping the sidecars' paths to their content
+    jobs : int, optional
+        The number of sidecars written at the same time, by default SIDECAR_JOBS
+    skip_unchanged : bool, optional
+        Whether to leave the sidecars already holding the same content untouched, by default True
+
+    Returns
+    -------
+    list
+        The paths of the sidecars that were written
+    """
+    paths = list(sidecars)
+    if len(paths) <= 1 or jobs <= 1:
+        written = [write_json(path, sidecars[path], skip_unchanged=skip_unchanged) for path in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+            written = list(executor.map(lambda path: write_json(path, sidecars[path], skip_unchanged=skip_unchanged), paths))
+    return [path for path, was_written in zip(paths, written) if was_written]
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Union
+
+STATE_NAME = "state.sqlite"
+# WAL needs memory shared by the processes using a database, so it only works on a single host. Processes
+# running on several hosts (e.g. cooperative runs on a cluster) share their databases with a rollback journal.
+JOURNAL_MODE = "WAL"
+SHARED_JOURNAL_MODE = "DELETE"
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fingerprint TEXT,
+    outputs TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (session, stage)
+)
+"""
+
+
+def fingerprint(entries: dict) -> str:
+    """
+    Compute the fingerprint of a session from the entries of its files
+
+    Parameters
+    ----------
+    entries : dict
+        A dictionary mapping the files' relative paths to their entries (e.g. size and mtime)
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the entries
+    """
+    return hashlib.blake2b(json.dumps(entries, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+class RunState:
+    """
+    The outcome of each stage ("copy" or "fix") of each session, kept in a
+    SQLite database in the working directory so that an interrupted run can
+    be resumed
+
+    The database is in WAL mode by default, so that several processes can
+    record outcomes while others read them. WAL needs shared memory between
+    the writers, so processes on different nodes must use the rollback
+    journal instead (``SHARED_JOURNAL_MODE``), which still needs a filesystem
+    with working POSIX locks. Each process must open its own RunState: a
+    connection open when a process is forked must not be used, nor even be
+    open, in the child.
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: float = 60.0, journal_mode: str = JOURNAL_MODE):
+        """
+        Open (or create) the state database
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the database
+        timeout : float, optional
+            How long to wait for a lock held by another writer, in seconds, by default 60
+        journal_mode : str, optional
+            The journal mode of the database, by default JOURNAL_MODE ("WAL")
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the Manager may be driven from another thread than the one that created it (e.g. watching in the background)
+        self.connection = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(STATE_SCHEMA)
+
+    def __repr__(self) -> str:
+        return f"<RunState {self.path}>"
+
+    def close(self) -> None:
+        """
+        Close the connection to the database
+        """
+        self.connection.close()
+
+    def get(self, stage: str, session: str) -> dict:
+        """
+        Get the last outcome of a stage of a session
+
+        Parameters
+        ----------
+        stage : str
+            The stage ("copy" or "fix")
+        session : str
+            The path of the session relative to the dataset's root
+
+        Returns
+        -------
+        dict
+            The status, fingerprint, outputs and error recorded for the session,
+            or None if the stage never ran
+        """
+        row = self.connection.execute(
+            "SELECT status, fingerprint, outputs, error, updated FROM sessions WHERE session = ? AND stage = ?",
+            (session, stage),
+        ).fetchone()
+        if row is None:
+            return None
+        outcome = dict(row)
+        outcome["outputs"] = json.loads(outcome["outputs"]) if outcome["outputs"] is not None else None
+        return outcome
+
+    def is_done(self, stage: str, session: str) -> bool:
+        """
+        Whether a stage of a session completed successfully
+
+        Parameters
+        ----------
+        stage : str
+            The stage ("copy" or "fix")
+        session : str
+            The path of the session relative to the dataset's root
+        """
+        outcome = self.get(stage, session)
+        return outcome is not None and outcome["status"] == "done"
+
+    def sessions(self, stage: str, status: str) -> list:
+        """
+        Get the sessions whose last outcome of a stage has a given status
+
+        Parameters
+        ----------
+        stage : str
+            The stage ("copy" or "fix")
+        status : str
+            "done" or "failed"
+
+        Returns
+        -------
+        list
+            A sorted list of session paths, relative to the dataset's root
+        """
+        rows = self.connection.execute(
+            "SELECT session FROM sessions WHERE stage = ? AND status = ? ORDER BY session",
+            (stage, status),
+        )
+        return [row["session"] for row in rows]
+
+    def record(
+        self,
+        stage: str,
+        session: str,
+        status: str,
+        fingerprint: str = None,
+        outputs: dict = None,
+        error: str = None,
+    ) -> None:
+        """
+        Record the outcome of a stage of a session
+
+        Parameters
+        ----------
+        stage : str
+            The stage ("copy" or "fix")
+        session : str
+            The path of the session relative to the dataset's root
+        status : str
+            "done" or "failed"
+        fingerprint : str, optional
+            The fingerprint of the session's input, by default None
+        outputs : dict, optional
+            The outputs of the stage (e.g. the files changed by the fixes), by default None
+        error : str, optional
+            The error that made the stage fail, by default None
+        """
+        self.connection.execute(
+            "INSERT INTO sessions (session, stage, status, fingerprint, outputs, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session, stage) DO UPDATE SET "
+            "status = excluded.status, fingerprint = excluded.fingerprint, outputs = excluded.outputs, "
+            "error = excluded.error, updated = excluded.updated",
+            (session, stage, status, fingerprint, json.dumps(outputs) if outputs is not None else None, error, time.time()),
+        )
@@ -0,0 +1,122 @@
+import gzip
+import json
+import math
+import struct
+from pathlib import Path
+from typing import Union
+
+PAYLOADS = ("tiny", "sparse")
+
+NIFTI1_HEADER_SIZE = 348
+VOX_OFFSET = 352
+
+
+def write_nifti(path: Union[str, Path], shape: tuple, payload: str = "tiny") -> None:
+    """
+    Write a synthetic uint8 NIfTI-1 image
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path of the image (".nii" or ".nii.gz")
+    shape : tuple
+        The shape of the image
+    payload : str, optional
+        "tiny" to write the header only, or "sparse" to write an uncompressed
+        image whose voxels are a hole in the file, taking no disk space.
+        By default "tiny"
+    """
+    if payload not in PAYLOADS:
+        raise ValueError(f"Unknown payload {payload}, expected one of {PAYLOADS}")
+    header = bytearray(VOX_OFFSET)
+    struct.pack_into("<i", header, 0, NIFTI1_HEADER_SIZE)
+    struct.pack_into("<8h", header, 40, len(shape), *shape, *[1] * (7 - len(shape)))
+    struct.pack_into("<2h", header, 70, 2, 8)  # uint8 voxels
+    struct.pack_into("<8f", header, 76, 1, *[1] * 7)  # pixdim
+    struct.pack_into("<f", header, 108, VOX_OFFSET)
+    header[344:348] = b"n+1\0"
+    if payload == "sparse":
+        with open(path, "wb") as f:
+            f.write(bytes(header))
+            f.truncate(VOX_OFFSET + math.prod(shape))
+        return
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wb") as f:
+        f.write(bytes(header))
+
+
+def make_synthetic_dataset(
+    root: Union[str, Path],
+    n_subjects: int = 10,
+    n_sessions: int = 1,
+    dwi_runs: int = 1,
+    n_volumes: int = 5,
+    fieldmaps: bool = True,
+    payload: str = "tiny",
+    shape: tuple = (2, 2, 2),
+) -> Path:
+    """
+    Create a synthetic BIDS dataset
+
+    Every session holds a T1w image and ``dwi_runs`` DWI runs (each with its
+    bval, bvec and sidecar). Sessions with more than one run are the ones
+    ``fix_multiple_dwi_runs`` applies to; the last run has the most volumes.
+    With ``fieldmaps``, each session also holds a pair of reverse phase
+    encoding fieldmaps whose ``IntendedFor`` lists the DWI runs.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The root directory of the dataset
+    n_subjects : int, optional
+        The number of subjects, by default 10
+    n_sessions : int, optional
+        The number of sessions per subject, by default 1
+    dwi_runs : int, optional
+        The number of DWI runs per session, by default 1
+    n_volumes : int, optional
+        The number of volumes of the first DWI run, by default 5
+    fieldmaps : bool, optional
+        Whether to add fieldmaps, by default True
+    payload : str, optional
+        The payload of the images ("tiny" or "sparse"), by default "tiny"
+    shape : tuple, optional
+        The spatial shape of the images, by default (2, 2, 2)
+
+    Returns
+    -------
+    Path
+        The root directory of the dataset
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "dataset_description.json").write_text(json.dumps({"Name": "synthetic", "BIDSVersion": "1.8.0"}))
+    extension = "nii" if payload == "sparse" else "nii.gz"
+    sidecar = json.dumps({"RepetitionTime": 3.0, "PhaseEncodingDirection": "j"})
+    for i in range(n_subjects):
+        subject = f"sub-{i + 1:05d}"
+        for j in range(n_sessions):
+            session = f"ses-{j + 1}"
+            prefix = f"{subject}_{session}"
+            session_path = root / subject / session
+            (session_path / "anat").mkdir(parents=True)
+            (session_path / "dwi").mkdir()
+            write_nifti(session_path / "anat" / f"{prefix}_T1w.{extension}", shape, payload)
+            (session_path / "anat" / f"{prefix}_T1w.json").write_text(sidecar)
+            intended_for = []
+            for run in range(1, dwi_runs + 1):
+                name = f"{prefix}_dir-FWD_run-{run}_dwi" if dwi_runs > 1 else f"{prefix}_dir-FWD_dwi"
+                volumes = n_volumes + run - 1
+                write_nifti(session_path / "dwi" / f"{name}.{extension}", (*shape, volumes), payload)
+                (session_path / "dwi" / f"{name}.bval").write_text(" ".join(["0"] + ["1000"] * (volumes - 1)))
+                (session_path / "dwi" / f"{name}.bvec").write_text("\n".join([" ".join(["1"] * volumes)] * 3))
+                (session_path / "dwi" / f"{name}.json").write_text(sidecar)
+                intended_for.append(f"{session}/dwi/{name}.{extension}")
+            if not fieldmaps:
+                continue
+            (session_path / "fmap").mkdir()
+            for direction in ["AP", "PA"]:
+                name = f"{prefix}_acq-dwi_dir-{direction}_epi"
+                write_nifti(session_path / "fmap" / f"{name}.{extension}", shape, payload)
+                (session_path / "fmap" / f"{name}.json").write_text(json.dumps({"IntendedFor": intended_for}, indent=4))
+    return root
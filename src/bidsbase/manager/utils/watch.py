@@ -0,0 +1,320 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Union
+
+from bidsbase.manager.utils.manifest import scan_files
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    A minimal binding of Linux's inotify, through ctypes
+    """
+
+    def __init__(self):
+        """
+        Create an inotify instance
+
+        Raises
+        ------
+        OSError
+            If inotify is not available (e.g. not on Linux)
+        """
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify is not available: {e}")
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def __repr__(self) -> str:
+        return f"<Inotify fd={self.fd}>"
+
+    def add_watch(self, path: Union[str, Path], mask: int = WATCH_MASK) -> int:
+        """
+        Watch a directory
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The directory
+        mask : int, optional
+            The events to watch, by default WATCH_MASK
+
+        Returns
+        -------
+        int
+            The watch descriptor of the directory
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"Failed to watch {path}: {os.strerror(error)}")
+        return wd
+
+    def read(self, timeout: float = None) -> list:
+        """
+        Read the pending events, waiting up to timeout seconds for the first one
+
+        Parameters
+        ----------
+        timeout : float, optional
+            How long to wait for events, in seconds, by default forever
+
+        Returns
+        -------
+        list
+            A list of (watch descriptor, mask, name) events
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self) -> None:
+        """
+        Stop watching and release the inotify instance
+        """
+        os.close(self.fd)
+
+
+class SessionWatcher:
+    """
+    Watch the source root of a dataset for sessions that arrive or change
+
+    A session is reported once its files stopped changing for a quiescence
+    window, so that sessions still being transferred are not picked up.
+    Sessions present when the watch starts are only reported if they change.
+
+    Changes are detected with inotify when it is available, by watching
+    every directory under the root. Otherwise (or when the system's limit of
+    watches is reached), the root is polled: new session directories are
+    found by listing the root and the subjects, changes to the known sessions
+    by the modification times of their directories, and the files of the
+    sessions that are still changing are compared by size and modification time.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        quiet: float = 60.0,
+        interval: float = 5.0,
+        logger: logging.Logger = None,
+        use_inotify: bool = True,
+    ):
+        """
+        Start watching a dataset
+
+        Parameters
+        ----------
+        root : Union[str, Path]
+            The root directory of the BIDS dataset
+        quiet : float, optional
+            How long a session must not change before it is reported, in seconds, by default 60
+        interval : float, optional
+            How often the root is polled without inotify, in seconds, by default 5
+        logger : logging.Logger, optional
+            The logger, by default None
+        use_inotify : bool, optional
+            Whether to use inotify when it is available, by default True
+        """
+        self.root = Path(root)
+        self.quiet = quiet
+        self.interval = interval
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        # (subject, session) -> last time (monotonic) a change was seen
+        self._activity = {}
+        self._inotify = None
+        self._paths = {}
+        self._signatures = {}
+        self._last_poll = 0.0
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+                self._watch_tree(self.root)
+            except OSError as e:
+                self.logger.warning(f"Falling back to polling the dataset every {interval} seconds: {e}")
+                self._close_inotify()
+        if self._inotify is None:
+            self._signatures = {session: self._signature(session) for session in self._sessions()}
+            self._last_poll = time.monotonic()
+
+    def __repr__(self) -> str:
+        mode = "inotify" if self._inotify is not None else "polling"
+        return f"<SessionWatcher {self.root} ({mode}): {len(self._activity)} pending sessions>"
+
+    @property
+    def pending(self) -> list:
+        """
+        The sessions seen changing, not reported yet
+        """
+        return sorted(self._activity)
+
+    def poll(self, timeout: float = None) -> list:
+        """
+        Wait for changes, and get the sessions that became quiet
+
+        Parameters
+        ----------
+        timeout : float, optional
+            How long to wait for changes, in seconds, by default ``self.interval``
+
+        Returns
+        -------
+        list
+            A sorted list of (subject, session) label pairs
+        """
+        timeout = self.interval if timeout is None else timeout
+        if self._inotify is not None:
+            self._read_events(timeout)
+        else:
+            time.sleep(max(0.0, min(timeout, self._last_poll + self.interval - time.monotonic())))
+            if time.monotonic() - self._last_poll >= self.interval:
+                self._poll_sessions()
+        now = time.monotonic()
+        ready = sorted(session for session, last in self._activity.items() if now - last >= self.quiet)
+        for session in ready:
+            del self._activity[session]
+            if self._inotify is None:
+                self._signatures[session] = self._signature(session)
+        return ready
+
+    def close(self) -> None:
+        """
+        Stop watching
+        """
+        self._close_inotify()
+
+    def _close_inotify(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+        self._inotify = None
+        self._paths = {}
+
+    def _session_of(self, path: Path) -> tuple:
+        """
+        Get the (subject, session) labels of a path under a session directory, or None
+        """
+        parts = path.relative_to(self.root).parts
+        if len(parts) < 2 or not parts[0].startswith("sub-") or not parts[1].startswith("ses-"):
+            return None
+        return parts[0].split("-", 1)[-1], parts[1].split("-", 1)[-1]
+
+    def _touch(self, session: tuple) -> None:
+        if session not in self._activity:
+            self.logger.debug(f"Session sub-{session[0]}/ses-{session[1]} changed")
+        self._activity[session] = time.monotonic()
+
+    def _watch_tree(self, path: Path) -> None:
+        """
+        Watch a directory and the directories under it
+        """
+        self._paths[self._inotify.add_watch(path)] = path
+        with os.scandir(path) as it:
+            subdirectories = [Path(entry.path) for entry in it if entry.is_dir(follow_symlinks=False)]
+        for subdirectory in subdirectories:
+            self._watch_tree(subdirectory)
+
+    def _read_events(self, timeout: float) -> None:
+        for wd, mask, name in self._inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, every session may have changed
+                self.logger.warning("Too many changes at once, checking every session again")
+                for session in self._sessions():
+                    self._touch(session)
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            path = directory / name if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    self.logger.warning(f"Falling back to polling the dataset every {self.interval} seconds: {e}")
+                    self._close_inotify()
+                    self._signatures = {session: self._signature(session) for session in self._sessions()}
+                    self._last_poll = time.monotonic()
+                    return
+            session = self._session_of(path)
+            if session is not None:
+                self._touch(session)
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and path.parent == self.root and name.startswith("sub-"):
+                # a subject moved in with its sessions
+                for session in path.glob("ses-*"):
+                    self._touch(self._session_of(session))
+
+    def _sessions(self) -> list:
+        """
+        List the session directories under the root
+        """
+        sessions = []
+        for subject in sorted(self.root.glob("sub-*")):
+            if subject.is_dir():
+                sessions += [self._session_of(session) for session in sorted(subject.glob("ses-*")) if session.is_dir()]
+        return sessions
+
+    def _signature(self, session: tuple) -> object:
+        """
+        Describe a session: by its files while it changes, by the modification times of its directories otherwise
+        """
+        path = self.root / f"sub-{session[0]}" / f"ses-{session[1]}"
+        try:
+            if session in self._activity:
+                return scan_files(path)
+            return tuple((dirpath, os.stat(dirpath).st_mtime_ns) for dirpath, _, _ in os.walk(path))
+        except FileNotFoundError:
+            return None
+
+    def _poll_sessions(self) -> None:
+        signatures = {}
+        for session in self._sessions():
+            signature = self._signature(session)
+            if session not in self._signatures or signature != self._signatures[session]:
+                changing = session in self._activity
+                self._touch(session)
+                if not changing:
+                    # the session is now described by its files, compared at the next poll
+                    signature = self._signature(session)
+            signatures[session] = signature
+        self._signatures = signatures
+        self._last_poll = time.monotonic()
@@ -0,0 +1,44 @@
+import gzip
+import json
+import struct
+
+import pytest
+
+
+def write_nifti_header(path, shape):
+    """
+    Write a NIfTI-1 image holding only a header (no voxel data)
+    """
+    header = bytearray(352)
+    struct.pack_into("<i", header, 0, 348)
+    struct.pack_into("<8h", header, 40, len(shape), *shape, *[1] * (7 - len(shape)))
+    struct.pack_into("<2h", header, 70, 2, 8)  # uint8 voxels
+    struct.pack_into("<f", header, 108, 352)
+    header[344:348] = b"n+1\0"
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wb") as f:
+        f.write(bytes(header))
+
+
+def make_dataset(root, subjects=("01", "02"), sessions=("1",)):
+    """
+    Create a minimal BIDS dataset with empty images
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "dataset_description.json").write_text(json.dumps({"Name": "test", "BIDSVersion": "1.8.0"}))
+    for subject in subjects:
+        for session in sessions:
+            prefix = f"sub-{subject}_ses-{session}"
+            session_path = root / f"sub-{subject}" / f"ses-{session}"
+            (session_path / "anat").mkdir(parents=True)
+            (session_path / "dwi").mkdir()
+            (session_path / "anat" / f"{prefix}_T1w.nii.gz").write_bytes(b"T1w")
+            (session_path / "anat" / f"{prefix}_T1w.json").write_text("{}")
+            (session_path / "dwi" / f"{prefix}_dwi.nii.gz").write_bytes(b"dwi")
+            (session_path / "dwi" / f"{prefix}_dwi.bval").write_text("0 1000 1000")
+    return root
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    return make_dataset(tmp_path / "bids")
@@ -1,6 +1,58 @@
+import json
+
+import pytest
+from conftest import make_dataset
 
 from bidsbase.cli import main
+from bidsbase.cli import parse_shard
 
 
 def test_main():
     assert main([]) == 0
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    for value in ["4/4", "1", "a/b"]:
+        with pytest.raises(Exception):
+            parse_shard(value)
+
+
+def test_index_filters_and_shards(tmp_path, capsys):
+    root = make_dataset(tmp_path / "bids", subjects=("01", "02", "03"), sessions=("1", "2"))
+    arguments = ["index", str(root), "--no-validate", "--work-dir", str(tmp_path / "work")]
+    assert main(arguments + ["--participant-label", "sub-01", "03", "--session-label", "2"]) == 0
+    assert capsys.readouterr().out.split() == ["sub-01/ses-2", "sub-03/ses-2"]
+    shards = []
+    for index in range(4):
+        assert main(arguments + ["--shard", f"{index}/4"]) == 0
+        shards.append(capsys.readouterr().out.split())
+    assert sorted(session for shard in shards for session in shard) == [
+        f"sub-{subject}/ses-{session}" for subject in ("01", "02", "03") for session in ("1", "2")
+    ]
+    assert [len(shard) for shard in shards] == [2, 2, 1, 1]
+
+
+def test_sharded_copy_and_resume(tmp_path):
+    root = make_dataset(tmp_path / "bids", subjects=("01", "02", "03"))
+    copy_to, work_dir = tmp_path / "copy", tmp_path / "work"
+    arguments = ["--no-validate", "--copy-to", str(copy_to), "--work-dir", str(work_dir)]
+    for index in range(2):
+        assert main(["copy", str(root), "--shard", f"{index}/2"] + arguments) == 0
+    assert sorted(path.name for path in copy_to.iterdir()) == ["dataset_description.json", "sub-01", "sub-02", "sub-03"]
+    manifest = json.loads((work_dir / "manifest.json").read_text())
+    assert sorted(manifest["sessions"]) == [".", "sub-01/ses-1", "sub-02/ses-1", "sub-03/ses-1"]
+    assert main(["fix", str(root), "--skip-copy"] + arguments) == 0
+    # a resumed run skips the sessions completed by the previous ones
+    (root / "sub-02" / "ses-1" / "anat" / "sub-02_ses-1_T2w.json").write_text("{}")
+    assert main(["copy", str(root), "--resume"] + arguments) == 0
+    assert not (copy_to / "sub-02" / "ses-1" / "anat" / "sub-02_ses-1_T2w.json").exists()
+    assert main(["copy", str(root)] + arguments) == 0
+    assert (copy_to / "sub-02" / "ses-1" / "anat" / "sub-02_ses-1_T2w.json").exists()
+
+
+def test_bench(tmp_path, capsys):
+    assert main(["bench", "--subjects", "2", "--output", str(tmp_path)]) == 0
+    metrics = json.loads(capsys.readouterr().out)
+    assert metrics["counters"]["sessions_copied"] == 2
+    assert "fix.fix_multiple_dwi_runs" in metrics["stages"]
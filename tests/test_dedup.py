@@ -0,0 +1,44 @@
+import os
+
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.utils.dedup import deduplicate_tree
+
+
+def test_deduplicate_tree(tmp_path):
+    root = tmp_path / "copy"
+    for session in ["ses-1", "ses-2", "ses-3"]:
+        (root / session).mkdir(parents=True)
+        (root / session / "localizer.nii.gz").write_bytes(b"localizer" * 1000)
+        (root / session / "T1w.nii.gz").write_bytes(session.encode() * 3000)
+        (root / session / "empty.json").write_bytes(b"")
+    (root / "ses-1" / "other.nii.gz").write_bytes(b"unique size")
+    os.symlink(root / "ses-1" / "localizer.nii.gz", root / "ses-1" / "link.nii.gz")
+    cache = tmp_path / "work" / "hashes.sqlite"
+    result = deduplicate_tree(root, cache=cache, jobs=4)
+    # the files of a unique size are not hashed
+    assert (result.files, result.hashed, result.linked, result.bytes_reclaimed) == (11, 6, 2, 2 * 9000)
+    assert len({(root / session / "localizer.nii.gz").stat().st_ino for session in ["ses-1", "ses-2", "ses-3"]}) == 1
+    assert len({(root / session / "T1w.nii.gz").stat().st_ino for session in ["ses-1", "ses-2", "ses-3"]}) == 3
+    assert (root / "ses-3" / "localizer.nii.gz").read_bytes() == b"localizer" * 1000
+    assert not list(root.rglob(".*.dedup"))
+    # later passes only hash the new files, and link them to the files linked before
+    (root / "ses-4").mkdir()
+    (root / "ses-4" / "localizer.nii.gz").write_bytes(b"localizer" * 1000)
+    result = deduplicate_tree(root, cache=cache)
+    assert (result.hashed, result.linked) == (1, 1)
+    assert (root / "ses-4" / "localizer.nii.gz").stat().st_nlink == 4
+    assert deduplicate_tree(root, cache=cache).hashed == 0
+
+
+def test_manager_deduplicate(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", metrics=True)
+    result = manager.deduplicate()
+    # the images and sidecars of both subjects are identical
+    assert result.linked == 4
+    copied = manager.copy_to / "sub-02" / "ses-1" / "dwi" / "sub-02_ses-1_dwi.nii.gz"
+    assert copied.stat().st_nlink == 2
+    assert manager.metrics.to_dict()["counters"]["files_deduplicated"] == 4
+    # the source dataset is left untouched
+    assert all(path.stat().st_nlink == 1 for path in dataset.rglob("*") if path.is_file())
+    manager.fix_dataset()
+    assert not manager.fix_errors
@@ -0,0 +1,31 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bidsbase.manager.utils.description import check_root
+
+
+def test_check_root(tmp_path, caplog):
+    root, description = check_root(tmp_path)
+    assert root == tmp_path and description is None
+    assert "'dataset_description.json' is missing" in caplog.text
+    (tmp_path / "dataset_description.json").write_text(json.dumps({"Name": "test"}))
+    with caplog.at_level(logging.WARNING):
+        root, description = check_root(tmp_path)
+    assert description == {"Name": "test"}
+    assert "Mandatory fields missing from 'dataset_description.json': BIDSVersion" in caplog.text
+    with pytest.raises(ValueError):
+        check_root(tmp_path / "missing")
+
+
+def test_manager_without_validation_does_not_import_pybids(dataset, tmp_path):
+    code = (
+        "import sys; from bidsbase.manager.manager import Manager; "
+        f"Manager({str(dataset)!r}, validate=False, work_dir={str(tmp_path / 'work')!r}); "
+        "assert 'bids' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, env=os.environ)
@@ -0,0 +1,228 @@
+import json
+import logging
+
+import pytest
+from conftest import write_nifti_header
+
+from bidsbase.manager.session.common_fixes import decompress_nifti_images
+from bidsbase.manager.session.common_fixes import fix_multiple_dwi_runs
+from bidsbase.manager.session.common_fixes import generate_fieldmap_from_dwi
+from bidsbase.manager.session.common_fixes import normalize_nifti_compression
+from bidsbase.manager.session.common_fixes import update_fieldmap_json
+from bidsbase.manager.session.fieldmaps import FieldmapIndex
+from bidsbase.manager.session.journal import Journal
+from bidsbase.manager.session.session import Session
+from bidsbase.manager.session.snapshot import SessionSnapshot
+from bidsbase.manager.utils.nifti import get_n_volumes
+
+logger = logging.getLogger("test")
+
+
+def make_session(tmp_path):
+    session_path = tmp_path / "sub-01" / "ses-1"
+    (session_path / "dwi").mkdir(parents=True)
+    (session_path / "fmap").mkdir()
+    for run, n_volumes in [(1, 3), (2, 5)]:
+        write_nifti_header(session_path / "dwi" / f"sub-01_ses-1_dir-FWD_run-{run}_dwi.nii.gz", (2, 2, 2, n_volumes))
+        (session_path / "dwi" / f"sub-01_ses-1_dir-FWD_run-{run}_dwi.bval").write_text(" ".join(["1000"] * n_volumes))
+    intended_for = [
+        "ses-1/anat/sub-01_ses-1_T1w.nii.gz",
+        "ses-1/dwi/sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz",
+        "ses-1/dwi/sub-01_ses-1_dir-FWD_run-2_dwi.nii.gz",
+    ]
+    for direction in ["AP", "PA"]:
+        sidecar = session_path / "fmap" / f"sub-01_ses-1_acq-rest_dir-{direction}_epi.json"
+        sidecar.write_text(json.dumps({"IntendedFor": intended_for}))
+    return session_path
+
+
+def test_fieldmap_index(tmp_path):
+    session_path = make_session(tmp_path)
+    fieldmaps = FieldmapIndex(session_path, logger=logger)
+    dwi = session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz"
+    assert [sidecar.name for sidecar in fieldmaps.referencing(dwi)] == [
+        "sub-01_ses-1_acq-rest_dir-AP_epi.json",
+        "sub-01_ses-1_acq-rest_dir-PA_epi.json",
+    ]
+    renamed = dwi.with_name("sub-01_ses-1_dir-FWD_dwi.nii.gz")
+    fieldmaps.apply({dwi: renamed, session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-2_dwi.nii.gz": None})
+    assert fieldmaps.referencing(dwi) == []
+    assert len(fieldmaps.referencing(renamed)) == 2
+    assert len(fieldmaps.flush()) == 2
+    assert fieldmaps.flush() == []
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json").read_text())
+    assert sidecar["IntendedFor"] == ["ses-1/anat/sub-01_ses-1_T1w.nii.gz", "ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"]
+
+
+def test_session_snapshot(tmp_path):
+    session_path = make_session(tmp_path)
+    session = SessionSnapshot(session_path)
+    assert len(session) == 6
+    run_1 = session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz"
+    assert session.entities(run_1)["datatype"] == "dwi"
+    assert [path.name for path in session.query(datatype="dwi", run=1)] == [
+        "sub-01_ses-1_dir-FWD_run-1_dwi.bval",
+        "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz",
+    ]
+    assert len(session.associated(run_1)) == 2
+    renamed = run_1.with_name("sub-01_ses-1_dir-FWD_dwi.nii.gz")
+    session.rename(run_1, renamed)
+    session.delete(run_1.with_name("sub-01_ses-1_dir-FWD_run-1_dwi.bval"))
+    assert session.query(datatype="dwi", run=1) == []
+    assert session.physical(renamed) == run_1
+    sidecar = session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json"
+    session.create(sidecar, {"IntendedFor": []})
+    assert session.read_json(sidecar) == {"IntendedFor": []}
+
+
+def test_update_fieldmap_json(tmp_path):
+    session_path = make_session(tmp_path)
+    dwi = session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz"
+    update_fieldmap_json({dwi: None}, logger, session_path)
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-PA_epi.json").read_text())
+    assert "ses-1/dwi/sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz" not in sidecar["IntendedFor"]
+
+
+def test_fix_multiple_dwi_runs(tmp_path):
+    session_path = make_session(tmp_path)
+    fixed, files_mapping = fix_multiple_dwi_runs(logger, session_path)
+    assert fixed
+    assert sorted(path.name for path in (session_path / "dwi").iterdir()) == [
+        "sub-01_ses-1_dir-FWD_dwi.bval",
+        "sub-01_ses-1_dir-FWD_dwi.nii.gz",
+    ]
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json").read_text())
+    assert sidecar["IntendedFor"] == ["ses-1/anat/sub-01_ses-1_T1w.nii.gz", "ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"]
+
+
+def test_generate_fieldmap_from_dwi(tmp_path):
+    np = pytest.importorskip("numpy")
+    nib = pytest.importorskip("nibabel")
+    session_path = tmp_path / "sub-01" / "ses-1"
+    (session_path / "dwi").mkdir(parents=True)
+    forward = session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.nii.gz"
+    write_nifti_header(forward, (2, 2, 2, 3))
+    reverse = session_path / "dwi" / "sub-01_ses-1_dir-REV_dwi.nii.gz"
+    nib.Nifti1Image(np.ones((2, 2, 2, 2), dtype=np.float32), np.eye(4)).to_filename(str(reverse))
+    (session_path / "dwi" / "sub-01_ses-1_dir-REV_dwi.bval").write_text("0 1000")
+    (session_path / "dwi" / "sub-01_ses-1_dir-REV_dwi.bvec").write_text("0 1\n0 0\n0 0")
+    (session_path / "dwi" / "sub-01_ses-1_dir-REV_dwi.json").write_text(json.dumps({"PhaseEncodingDirection": "j-"}))
+    fixed, files_mapping = generate_fieldmap_from_dwi(logger, session_path)
+    assert fixed
+    sidecar = session_path / "fmap" / "sub-01_ses-1_acq-dwi_dir-REV_epi.json"
+    assert files_mapping[reverse.with_suffix("").with_suffix(".json")] == sidecar
+    # the new sidecar is written, even though its content was planned along with the fieldmap index
+    assert json.loads(sidecar.read_text()) == {
+        "PhaseEncodingDirection": "j-",
+        "IntendedFor": ["ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"],
+    }
+    assert nib.load(str(session_path / "fmap" / "sub-01_ses-1_acq-dwi_dir-REV_epi.nii.gz")).shape == (2, 2, 2)
+
+
+def test_normalize_nifti_compression(tmp_path):
+    session_path = make_session(tmp_path)
+    dwi = session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz"
+    fixed, files_mapping = decompress_nifti_images(logger, session_path)
+    assert fixed
+    assert files_mapping[dwi] == dwi.with_name("sub-01_ses-1_dir-FWD_run-1_dwi.nii")
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json").read_text())
+    assert sidecar["IntendedFor"][1] == "ses-1/dwi/sub-01_ses-1_dir-FWD_run-1_dwi.nii"
+    changed_files = Session(session_path, logger=logger).fix()
+    assert sorted(path.name for path in (session_path / "dwi").iterdir()) == [
+        "sub-01_ses-1_dir-FWD_dwi.bval",
+        "sub-01_ses-1_dir-FWD_dwi.nii.gz",
+    ]
+    dwi = session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.nii.gz"
+    assert changed_files[str(dwi.with_name("sub-01_ses-1_dir-FWD_dwi.nii"))] == str(dwi)
+    assert get_n_volumes(dwi) == 5
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json").read_text())
+    assert sidecar["IntendedFor"] == ["ses-1/anat/sub-01_ses-1_T1w.nii.gz", "ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"]
+    # the reverse is a fix of its own, so that it can be listed among the fixes
+    changed_files = Session(session_path, logger=logger).fix(fixes=[decompress_nifti_images])
+    assert changed_files[str(dwi)] == str(dwi.with_name("sub-01_ses-1_dir-FWD_dwi.nii"))
+    assert get_n_volumes(dwi.with_name("sub-01_ses-1_dir-FWD_dwi.nii")) == 5
+    assert not normalize_nifti_compression(logger, session_path, compress=False)[0]
+
+
+def test_session_fix(tmp_path):
+    session_path = make_session(tmp_path)
+    changed_files = Session(session_path, logger=logger).fix()
+    assert changed_files[str(session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.nii.gz")] == "deleted"
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-PA_epi.json").read_text())
+    assert sidecar["IntendedFor"][-1] == "ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"
+
+
+def snapshot(directory):
+    return {path.relative_to(directory): path.read_bytes() for path in sorted(directory.rglob("*")) if path.is_file()}
+
+
+def test_plan_is_read_only(tmp_path):
+    session_path = make_session(tmp_path)
+    before = snapshot(tmp_path)
+    plan = Session(session_path, logger=logger).plan()
+    assert snapshot(tmp_path) == before
+    assert plan.applied_fixes == ["fix_multiple_dwi_runs"]
+    assert [type(operation).__name__ for operation in plan.operations] == ["Rename", "Rename", "Delete", "Delete"] + [
+        "WriteJSON"
+    ] * 2
+    assert plan.cost()["files"] == 8
+    assert plan.snapshot.exists(session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.nii.gz")
+
+
+def test_plan_rolls_back_on_failure(tmp_path):
+    session_path = make_session(tmp_path)
+    before = snapshot(tmp_path)
+
+    def crash(**kwargs):
+        raise RuntimeError("crash")
+
+    plan = Session(session_path, logger=logger).plan()
+    plan.create(session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json", crash)
+    with pytest.raises(RuntimeError):
+        plan.execute(journal_dir=tmp_path / "journal")
+    assert snapshot(tmp_path) == before
+
+
+def test_session_fix_recovers_unfinished_batch(tmp_path):
+    session_path = make_session(tmp_path)
+    before = snapshot(tmp_path)
+
+    def die(**kwargs):
+        # not an Exception: the process dies without rolling the batch back
+        raise KeyboardInterrupt
+
+    plan = Session(session_path, logger=logger).plan()
+    plan.create(session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.bvec", die)
+    with pytest.raises(KeyboardInterrupt):
+        plan.execute()
+    assert (session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.nii.gz").exists()
+    assert (tmp_path / "sub-01" / ".ses-1.journal").exists()
+    # planning rolls the unfinished batch back before scanning the session
+    Session(session_path, logger=logger).plan()
+    assert snapshot(tmp_path) == before
+    changed_files = Session(session_path, logger=logger).fix()
+    assert changed_files[str(session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-2_dwi.bval")] == str(
+        session_path / "dwi" / "sub-01_ses-1_dir-FWD_dwi.bval"
+    )
+    assert sorted(path.name for path in (session_path / "dwi").iterdir()) == [
+        "sub-01_ses-1_dir-FWD_dwi.bval",
+        "sub-01_ses-1_dir-FWD_dwi.nii.gz",
+    ]
+    sidecar = json.loads((session_path / "fmap" / "sub-01_ses-1_acq-rest_dir-AP_epi.json").read_text())
+    assert sidecar["IntendedFor"] == ["ses-1/anat/sub-01_ses-1_T1w.nii.gz", "ses-1/dwi/sub-01_ses-1_dir-FWD_dwi.nii.gz"]
+    # the journal is removed once its batch is committed
+    assert not (tmp_path / "sub-01" / ".ses-1.journal").exists()
+
+
+def test_journal_recovers_unfinished_batch(tmp_path):
+    session_path = make_session(tmp_path)
+    before = snapshot(session_path)
+    journal = Journal(tmp_path / "journal")
+    journal.begin()
+    bval = session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-1_dwi.bval"
+    journal.rename(bval, bval.with_name("renamed.bval"))
+    journal.remove(session_path / "dwi" / "sub-01_ses-1_dir-FWD_run-2_dwi.bval")
+    # the process dies here, the next batch rolls the unfinished one back
+    assert Journal(tmp_path / "journal").pending
+    Journal(tmp_path / "journal").begin()
+    assert snapshot(session_path) == before
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# cumulative import times, in microseconds. pybids alone takes about 500ms.
+BUDGETS = {
+    "bidsbase": 50_000,
+    "bidsbase.cli": 100_000,
+    "bidsbase.manager.manager": 300_000,
+}
+HEAVY_MODULES = ("bids", "sqlalchemy", "numpy", "nibabel")
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter, and get the cumulative import time of each module
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=os.environ,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", BUDGETS)
+def test_import_time(module):
+    times = import_times(module)
+    assert not [name for name in times if name.split(".")[0] in HEAVY_MODULES]
+    assert times[module] < BUDGETS[module]
@@ -0,0 +1,102 @@
+import pytest
+
+from bidsbase.manager import index as index_module
+from bidsbase.manager.index import DatasetIndex
+from bidsbase.manager.index import parse_entities
+from bidsbase.manager.index import parse_filename
+from bidsbase.manager.utils.synthetic import make_synthetic_dataset
+
+
+def test_listing_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "RACY_MTIME_NS", 0)
+    root = make_synthetic_dataset(tmp_path / "bids", n_subjects=3, fieldmaps=False)
+    cache = tmp_path / "work" / index_module.INDEX_NAME
+    index = DatasetIndex(root, cache=cache)
+    n_directories = 1 + sum(1 for path in root.rglob("*") if path.is_dir())
+    assert (index.cache_hits, index.cache_misses) == (0, n_directories)
+    cached = DatasetIndex(root, cache=cache)
+    assert (cached.cache_hits, cached.cache_misses) == (n_directories, 0)
+    assert [record.filename for record in cached.records] == [record.filename for record in index.records]
+    assert cached.top_level == index.top_level
+    dwi = root / "sub-00002" / "ses-1" / "dwi"
+    next(dwi.glob("*.bval")).unlink()
+    refreshed = DatasetIndex(root, cache=cache)
+    assert (refreshed.cache_hits, refreshed.cache_misses) == (n_directories - 1, 1)
+    assert len(refreshed.records) == len(index.records) - 1
+    assert refreshed.records == refreshed.query()
+
+
+# file names from the BIDS specification's examples, by datatype
+CORPUS = {
+    "anat": [
+        "sub-01_ses-1_T1w.nii.gz",
+        "sub-01_ses-1_acq-mprage_rec-norm_run-01_T1w.nii.gz",
+        "sub-01_ses-1_inv-1_part-mag_MP2RAGE.nii.gz",
+        "sub-01_ses-1_echo-2_flip-1_mt-on_MPM.json",
+        "sub-01_ses-1_ce-gadolinium_T1w.json",
+        "sub-01_ses-1_chunk-02_T2starw.nii",
+    ],
+    "func": [
+        "sub-01_ses-1_task-rest_bold.nii.gz",
+        "sub-01_ses-1_task-nback_acq-multiband_dir-PA_run-2_echo-1_bold.json",
+        "sub-01_ses-1_task-rest_rec-magnitude_part-phase_bold.nii.gz",
+        "sub-01_ses-1_task-stroop_run-10_events.tsv",
+        "sub-01_ses-1_task-rest_recording-cardiac_physio.tsv.gz",
+        "sub-01_ses-1_task-rest_sbref.nii.gz",
+    ],
+    "dwi": [
+        "sub-01_ses-1_dwi.nii.gz",
+        "sub-01_ses-1_dir-FWD_run-1_dwi.bval",
+        "sub-01_ses-1_acq-multishell_dir-AP_dwi.bvec",
+        "sub-01_ses-1_acq-b1000+b2000_dwi.json",
+        "sub-01_ses-1_dir-REV_sbref.nii.gz",
+    ],
+    "fmap": [
+        "sub-01_ses-1_acq-dwi_dir-AP_epi.nii.gz",
+        "sub-01_ses-1_run-2_phasediff.json",
+        "sub-01_ses-1_magnitude1.nii.gz",
+        "sub-01_ses-1_acq-tb1tfl_TB1TFL.nii.gz",
+    ],
+    "perf": [
+        "sub-01_ses-1_acq-pcasl_asl.nii.gz",
+        "sub-01_ses-1_aslcontext.tsv",
+        "sub-01_ses-1_m0scan.json",
+    ],
+    "pet": [
+        "sub-01_ses-1_trc-FDG_rec-acdyn_pet.nii.gz",
+        "sub-01_ses-1_recording-manual_blood.tsv",
+    ],
+    "meg": [
+        "sub-01_ses-1_task-rest_proc-sss_meg.fif",
+        "sub-01_ses-1_acq-calibration_meg.dat",
+        "sub-01_ses-1_space-CTF_coordsystem.json",
+    ],
+    "micr": [
+        "sub-01_ses-1_sample-A_stain-LFB_chunk-1_BF.ome.tif",
+    ],
+    "mrs": [
+        "sub-01_ses-1_acq-press_voi-thalamus_nuc-1H_svs.nii.gz",
+    ],
+    "motion": [
+        "sub-01_ses-1_task-walk_tracksys-imu_motion.tsv",
+    ],
+}
+
+
+def test_parse_filename_matches_pybids():
+    layout = pytest.importorskip("bids.layout")
+    for datatype, filenames in CORPUS.items():
+        for filename in filenames:
+            expected = layout.parse_file_entities(f"/data/sub-01/ses-1/{datatype}/{filename}")
+            # entities pybids derives from the directory or from whole file names
+            for name in ("datatype", "fmap", "scans"):
+                expected.pop(name, None)
+            assert parse_entities(filename) == expected, filename
+
+
+def test_parse_filename_is_cached():
+    assert parse_filename("sub-01_ses-1_run-01_dwi.nii.gz") is parse_filename("sub-01_ses-1_run-01_dwi.nii.gz")
+    entities = parse_entities("sub-01_ses-1_run-01_dwi.nii.gz")
+    entities["datatype"] = "dwi"
+    assert "datatype" not in parse_filename("sub-01_ses-1_run-01_dwi.nii.gz")
+    assert parse_filename("sub-01_ses-1_run-01_dwi.nii.gz").get("run") == 1
@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from conftest import make_dataset
+
+from bidsbase.manager.index import DatasetIndex
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.utils.lease import LeaseDirectory
+
+
+def test_leases(tmp_path):
+    first = LeaseDirectory(tmp_path, ttl=60, owner="first")
+    second = LeaseDirectory(tmp_path, ttl=60, owner="second")
+    assert first.acquire("sub-01/ses-1")
+    assert not second.acquire("sub-01/ses-1")
+    assert first.status("sub-01/ses-1") == "held"
+    first.release("sub-01/ses-1", "done")
+    assert second.is_final("sub-01/ses-1")
+    assert not second.acquire("sub-01/ses-1")
+    assert first.acquire("sub-02/ses-1")
+    first.close()
+    assert first.status("sub-02/ses-1") is None
+    assert second.acquire("sub-02/ses-1")
+    second.close()
+
+
+def test_stale_lease_is_taken_over(tmp_path):
+    crashed = LeaseDirectory(tmp_path, ttl=60, owner="crashed")
+    assert crashed.acquire("sub-01/ses-1")
+    crashed._stop.set()
+    # the last heartbeat of the crashed process was long ago
+    os.utime(tmp_path / "sub-01_ses-1.lease", (0, 0))
+    other = LeaseDirectory(tmp_path, ttl=60, owner="other")
+    assert other.acquire("sub-01/ses-1")
+    assert other.held == ["sub-01/ses-1"]
+    other.close()
+
+
+def acquire_all(path, keys):
+    leases = LeaseDirectory(path, ttl=60)
+    acquired = [key for key in keys if leases.acquire(key)]
+    for key in acquired:
+        leases.release(key, "done")
+    leases.close()
+    return acquired
+
+
+def test_leases_are_exclusive_across_processes(tmp_path):
+    keys = [f"sub-{i:03d}/ses-1" for i in range(200)]
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        acquired = list(executor.map(acquire_all, [tmp_path] * 4, [keys] * 4))
+    assert sorted(key for keys in acquired for key in keys) == keys
+
+
+def test_process_dataset_cooperatively(dataset, tmp_path):
+    managers = [Manager(dataset, validate=False, work_dir=tmp_path / "work", run_id="42") for _ in range(2)]
+    assert not (managers[0].copy_to / "sub-01").exists()
+    managers[0].leases.acquire("sub-02/ses-1")
+    managers[0].leases.release("sub-02/ses-1", "done")
+    managers[1].process_dataset(batch_size=1)
+    assert (managers[1].copy_to / "sub-01" / "ses-1").exists()
+    assert not (managers[1].copy_to / "sub-02").exists()
+    assert (managers[1].copy_to / "dataset_description.json").exists()
+    assert (tmp_path / "work" / "sub-01" / "ses-1" / "fingerprint.json").exists()
+    assert managers[0].process_dataset() == {}
+    assert managers[0].copy_results == []
+
+
+def test_process_dataset_indexes_the_copy_once(dataset, tmp_path, monkeypatch):
+    make_dataset(dataset, subjects=["03", "04"])
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", run_id="42")
+    walks = []
+
+    def refresh(index):
+        walks.append(index.root)
+        original_refresh(index)
+
+    original_refresh = DatasetIndex.refresh
+    monkeypatch.setattr(DatasetIndex, "refresh", refresh)
+    manager.process_dataset(batch_size=1)
+    assert walks.count(manager.copy_to) == 1
+    assert sorted(manager.sessions) == ["01", "02", "03", "04"]
+    assert all(list(sessions) == ["1"] for sessions in manager.sessions.values())
+    assert len(manager.copy_index.files(datatype="dwi")) == 8
+    for subject in ["01", "02", "03", "04"]:
+        assert (tmp_path / "work" / f"sub-{subject}" / "ses-1" / "fingerprint.json").exists()
@@ -0,0 +1,27 @@
+import json
+
+from bidsbase.manager.utils.logger import get_session_logger
+from bidsbase.manager.utils.logger import initiate_logger
+from bidsbase.manager.utils.logger import shutdown_logging
+
+
+def test_initiate_logger_once(tmp_path):
+    for _ in range(3):
+        logger = initiate_logger(tmp_path, name="Test")
+    get_session_logger(logger, tmp_path / "sub-01" / "ses-1").info("fixed")
+    shutdown_logging()
+    log_files = list(tmp_path.glob("Test_*.txt"))
+    assert len(log_files) == 1
+    lines = log_files[0].read_text().splitlines()
+    assert len([line for line in lines if line.endswith("fixed")]) == 1
+    assert "bidsbase.Test.sub-01_ses-1" in lines[-1]
+
+
+def test_json_lines(tmp_path):
+    logger = initiate_logger(tmp_path, name="Json", json_lines=True)
+    logger.warning("careful")
+    shutdown_logging()
+    (log_file,) = tmp_path.glob("Json_*.jsonl")
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert entries[-1]["level"] == "WARNING"
+    assert entries[-1]["message"] == "careful"
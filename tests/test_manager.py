@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import shutil
+
+import pytest
+from conftest import make_dataset
+from conftest import write_nifti_header
+
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.utils.copy import copy_sessions
+from bidsbase.manager.utils.sidecars import write_json
+from bidsbase.manager.utils.state import RunState
+
+
+@pytest.mark.parametrize("copy_backend", ["python", "rsync"])
+def test_create_copy(dataset, tmp_path, copy_backend):
+    if copy_backend == "rsync" and shutil.which("rsync") is None:
+        pytest.skip("rsync is not available")
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", jobs=2, copy_backend=copy_backend)
+    assert sorted(result.status for result in manager.copy_results) == ["copied", "copied"]
+    assert (manager.copy_to / "dataset_description.json").exists()
+    assert (manager.copy_to / "sub-01" / "ses-1" / "dwi" / "sub-01_ses-1_dwi.nii.gz").read_bytes() == b"dwi"
+    results = manager.create_copy()
+    assert [result.status for result in results] == ["skipped", "skipped"]
+
+
+def test_copy_sessions_stop_on_first_crash(dataset, tmp_path):
+    def failing_copy(source, destination):
+        raise OSError(f"Cannot copy {source}")
+
+    sessions = [(session, tmp_path / "copy" / session.relative_to(dataset)) for session in dataset.glob("sub-*/ses-*")]
+    logger = logging.getLogger("test")
+    results = copy_sessions(sessions, failing_copy, logger=logger, jobs=2)
+    assert all(result.failed for result in results)
+    assert not any(destination.exists() for _, destination in sessions)
+    with pytest.raises(OSError):
+        copy_sessions(sessions, failing_copy, logger=logger, force=True, stop_on_first_crash=True)
+
+
+@pytest.mark.parametrize("copy_mode", ["full", "hardlink", "reflink", "symlink"])
+def test_copy_modes_never_change_the_source(dataset, tmp_path, copy_mode):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", copy_mode=copy_mode)
+    source = dataset / "sub-01" / "ses-1" / "anat" / "sub-01_ses-1_T1w.json"
+    copied = manager.copy_to / source.relative_to(dataset)
+    assert copied.is_symlink() == (copy_mode == "symlink")
+    if copy_mode == "hardlink":
+        assert copied.stat().st_ino == source.stat().st_ino
+    # fixes replace the files of the working copy instead of writing them in place
+    write_json(copied, {"IntendedFor": []})
+    assert not copied.is_symlink()
+    assert source.read_text() == "{}"
+    manager.create_copy(force=True)
+    assert source.read_text() == "{}"
+
+
+def test_incremental_copy(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", checksum=True)
+    session = dataset / "sub-01" / "ses-1"
+    (session / "anat" / "sub-01_ses-1_T2w.nii.gz").write_bytes(b"T2w")
+    (session / "dwi" / "sub-01_ses-1_dwi.bval").write_text("0 1000 1000 1000")
+    (session / "anat" / "sub-01_ses-1_T1w.json").unlink()
+    os.utime(session / "anat" / "sub-01_ses-1_T1w.nii.gz", ns=(0, 0))
+    results = {result.source.parent.name: result for result in manager.create_copy()}
+    assert results["sub-02"].status == "skipped"
+    assert results["sub-01"].status == "updated"
+    assert results["sub-01"].added == ["anat/sub-01_ses-1_T2w.nii.gz"]
+    assert results["sub-01"].changed == ["dwi/sub-01_ses-1_dwi.bval"]
+    assert results["sub-01"].removed == ["anat/sub-01_ses-1_T1w.json"]
+    copied = manager.copy_to / "sub-01" / "ses-1"
+    assert (copied / "dwi" / "sub-01_ses-1_dwi.bval").read_text() == "0 1000 1000 1000"
+    assert (copied / "anat" / "sub-01_ses-1_T2w.nii.gz").exists()
+    assert not (copied / "anat" / "sub-01_ses-1_T1w.json").exists()
+    assert [result.status for result in manager.create_copy()] == ["skipped", "skipped"]
+
+
+def test_incremental_top_level_copy(dataset, tmp_path):
+    (dataset / "derivatives" / "qc").mkdir(parents=True)
+    (dataset / "derivatives" / "qc" / "report.html").write_text("report")
+    (dataset / "README").write_text("readme")
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    report = manager.copy_to / "derivatives" / "qc" / "report.html"
+    description = manager.copy_to / "dataset_description.json"
+    inodes = report.stat().st_ino, description.stat().st_ino
+    (dataset / "README").write_text("updated readme")
+    (dataset / "derivatives" / "qc" / "new.html").write_text("new")
+    manager.create_copy()
+    assert (report.stat().st_ino, description.stat().st_ino) == inodes
+    assert (manager.copy_to / "README").read_text() == "updated readme"
+    assert (manager.copy_to / "derivatives" / "qc" / "new.html").read_text() == "new"
+    (dataset / "README").unlink()
+    manager.create_copy()
+    assert not (manager.copy_to / "README").exists()
+
+
+def test_create_copy_records_sessions_copied_before_a_crash(dataset, tmp_path, monkeypatch):
+    def failing_copy(source, destination):
+        if "sub-02" in source.parts:
+            raise OSError(f"Cannot copy {source}")
+        shutil.copytree(source, destination, dirs_exist_ok=True)
+
+    make_dataset(dataset, subjects=["03"])
+    monkeypatch.setattr("bidsbase.manager.manager.get_copy_function", lambda *args: failing_copy)
+    with pytest.raises(OSError):
+        Manager(dataset, validate=False, work_dir=tmp_path / "work", jobs=1, stop_on_first_crash=True)
+    manifest = json.loads((tmp_path / "work" / "manifest.json").read_text())
+    assert "sub-01/ses-1" in manifest["sessions"]
+    assert "sub-02/ses-1" not in manifest["sessions"]
+    state = RunState(tmp_path / "work" / "state.sqlite")
+    assert state.is_done("copy", "sub-01/ses-1")
+    assert not state.is_done("copy", "sub-02/ses-1")
+    state.close()
+
+
+def test_dataset_index(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    assert manager.subjects == ["01", "02"]
+    assert manager.sessions is manager.sessions
+    assert list(manager.sessions["01"]) == ["1"]
+    assert manager.sessions["01"]["1"].path == manager.copy_to / "sub-01" / "ses-1"
+    records = manager.source_index.files(subject="01", session="1", datatype="dwi")
+    assert [record.path.name for record in records] == ["sub-01_ses-1_dwi.bval", "sub-01_ses-1_dwi.nii.gz"]
+    record = records[1]
+    assert record.entities == {
+        "subject": "01",
+        "session": "1",
+        "suffix": "dwi",
+        "extension": ".nii.gz",
+        "datatype": "dwi",
+    }
+    assert sorted(path.name for path in manager.search("_dwi.bval")) == ["sub-01_ses-1_dwi.bval", "sub-02_ses-1_dwi.bval"]
+    assert manager.search("dataset_description.json") == [dataset / "dataset_description.json"]
+    assert manager.query(subject="01", datatype="dwi", suffix="dwi", extension=".nii.gz") == [record]
+    assert len(manager.query(suffix="dwi", extension=[".bval", ".nii.gz"])) == 4
+    assert manager.query(subject="01", datatype="dwi", run=None) == records
+    assert manager.query(subject="01", run="1") == []
+    make_dataset(dataset, subjects=["03"])
+    assert manager.subjects == ["01", "02"]
+    manager.refresh()
+    assert manager.subjects == ["01", "02", "03"]
+
+
+def test_search_without_sessions(tmp_path):
+    root = tmp_path / "bids"
+    make_dataset(root, subjects=[])
+    for subject in ["01", "02"]:
+        (root / f"sub-{subject}" / "anat").mkdir(parents=True)
+        (root / f"sub-{subject}" / "anat" / f"sub-{subject}_T1w.nii.gz").write_bytes(b"T1w")
+    manager = Manager(root, validate=False, work_dir=tmp_path / "work")
+    assert sorted(path.name for path in manager.search("_T1w.nii.gz")) == ["sub-01_T1w.nii.gz", "sub-02_T1w.nii.gz"]
+    records = manager.query(subject="01", datatype="anat", suffix="T1w")
+    assert [record.path for record in records] == [root / "sub-01" / "anat" / "sub-01_T1w.nii.gz"]
+
+
+def test_search_outside_subjects(dataset, tmp_path):
+    files = [
+        dataset / "derivatives" / "fmriprep" / "sub-01" / "anat" / "sub-01_desc-preproc_T1w.nii.gz",
+        dataset / "sourcedata" / "sub-01" / "sub-01_T1w.dcm",
+        dataset / "code" / "convert.py",
+    ]
+    for path in files:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    assert manager.search("_desc-preproc_T1w.nii.gz") == files[:1]
+    assert manager.search(".dcm") == files[1:2]
+    assert manager.search("convert.py") == files[2:]
+    # the files outside the subjects' directories are not queried by entities
+    assert len(manager.query(subject="01", suffix="T1w")) == 2
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_fix_dataset(dataset, tmp_path, jobs, caplog):
+    dwi = dataset / "sub-01" / "ses-1" / "dwi"
+    for run, n_volumes in [(1, 3), (2, 5)]:
+        write_nifti_header(dwi / f"sub-01_ses-1_run-{run}_dwi.nii.gz", (2, 2, 2, n_volumes))
+        for extension in ["bvec", "json"]:
+            (dwi / f"sub-01_ses-1_run-{run}_dwi.{extension}").write_text(str(run))
+        (dwi / f"sub-01_ses-1_run-{run}_dwi.bval").write_text(" ".join(["1000"] * n_volumes))
+    for extension in ["nii.gz", "bval"]:
+        (dwi / f"sub-01_ses-1_dwi.{extension}").unlink()
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", jobs=jobs, metrics=True)
+    summary = manager.fix_dataset()
+    copied = manager.copy_to / "sub-01" / "ses-1" / "dwi"
+    assert list(summary) == [copied.parent]
+    assert sorted(path.name for path in copied.iterdir()) == [f"sub-01_ses-1_dwi.{ext}" for ext in ["bval", "bvec", "json", "nii.gz"]]
+    assert (copied / "sub-01_ses-1_dwi.json").read_text() == "2"
+    assert (tmp_path / "work" / "sub-01" / "ses-1" / "fixes.json").exists()
+    assert manager.sessions["01"]["1"].fixed
+    assert "Multiple DWI runs found" in caplog.text
+    metrics = json.loads((tmp_path / "work" / "metrics.json").read_text())
+    assert {"create_copy", "fix_dataset", "fix_session", "fix.fix_multiple_dwi_runs", "apply.rename"} <= set(metrics["stages"])
+    assert metrics["counters"]["operations.delete"] == 4
+    assert metrics["counters"]["sessions_copied"] == 2
+
+
+def test_fix_dataset_skips_unchanged_sessions(dataset, tmp_path):
+    fixed = []
+
+    def record_fix(logger, session_path, auto_fix=True, plan=None):
+        fixed.append(session_path.parent.name)
+        return False, {}
+
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    manager.FIXES = [record_fix]
+    manager.fix_dataset()
+    assert (tmp_path / "work" / "sub-01" / "ses-1" / "fingerprint.json").exists()
+    manager.fix_dataset()
+    assert fixed == ["sub-01", "sub-02"]
+    (manager.copy_to / "sub-02" / "ses-1" / "dwi" / "sub-02_ses-1_dwi.bval").write_text("0 1000 1000")
+    manager.fix_dataset()
+    assert fixed == ["sub-01", "sub-02", "sub-02"]
+    manager.fix_dataset(force=True)
+    assert fixed == ["sub-01", "sub-02", "sub-02", "sub-01", "sub-02"]
+
+
+def test_fix_dataset_in_parallel_requires_auto_fix(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", auto_fix=False)
+    with pytest.raises(ValueError):
+        manager.fix_dataset(jobs=2)
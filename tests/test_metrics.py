@@ -0,0 +1,39 @@
+import io
+import json
+
+from bidsbase.manager.utils.metrics import Metrics
+from bidsbase.manager.utils.metrics import NullMetrics
+from bidsbase.manager.utils.metrics import Progress
+
+
+def test_metrics(tmp_path):
+    metrics = Metrics()
+    with metrics.stage("copy"):
+        metrics.count("bytes_copied", 10)
+    metrics.merge({"stages": {"copy": {"seconds": 1.0, "calls": 2}}, "counters": {"bytes_copied": 5}})
+    metrics.save(tmp_path)
+    saved = json.loads((tmp_path / "metrics.json").read_text())
+    assert saved["stages"]["copy"]["calls"] == 3
+    assert saved["counters"] == {"bytes_copied": 15}
+    prometheus = (tmp_path / "metrics.prom").read_text()
+    assert 'bidsbase_stage_calls_total{stage="copy"} 3' in prometheus
+    assert "bidsbase_bytes_copied_total 15" in prometheus
+
+
+def test_null_metrics(tmp_path):
+    metrics = NullMetrics()
+    with metrics.stage("copy"):
+        metrics.count("bytes_copied", 10)
+    metrics.save(tmp_path)
+    assert metrics.to_dict() == {"stages": {}, "counters": {}}
+    assert not list(tmp_path.iterdir())
+
+
+def test_progress():
+    stream = io.StringIO()
+    progress = Progress(4, "Copying sessions", stream=stream, interval=0)
+    for _ in range(4):
+        progress.update()
+    progress.close()
+    assert stream.getvalue().splitlines()[-1].startswith("Copying sessions: 4/4")
+    assert stream.getvalue().rstrip().endswith("ETA 00:00:00)")
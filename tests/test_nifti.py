@@ -0,0 +1,62 @@
+import gzip
+import logging
+import os
+
+import pytest
+
+from bidsbase.manager.session.common_fixes import extract_b0
+from bidsbase.manager.utils.nifti import compress_file
+from bidsbase.manager.utils.nifti import decompress_file
+from bidsbase.manager.utils.nifti import get_n_volumes
+from bidsbase.manager.utils.nifti import read_shape
+
+np = pytest.importorskip("numpy")
+nib = pytest.importorskip("nibabel")
+
+
+@pytest.mark.parametrize("extension", ["nii", "nii.gz"])
+def test_extract_b0_native(tmp_path, extension):
+    data = np.random.default_rng(0).random((4, 5, 6, 5)).astype(np.float32)
+    in_file = tmp_path / f"dwi.{extension}"
+    nib.Nifti1Image(data, np.diag([2, 2, 2, 1])).to_filename(str(in_file))
+    bval = tmp_path / "dwi.bval"
+    bval.write_text("0 1000 5 1000 2000")
+    out_file = tmp_path / "b0.nii.gz"
+    extract_b0(in_file, tmp_path / "dwi.bvec", bval, out_file, logger=logging.getLogger("test"), backend="native")
+    b0 = nib.load(str(out_file))
+    assert b0.shape == (4, 5, 6)
+    np.testing.assert_allclose(b0.affine, np.diag([2, 2, 2, 1]))
+    np.testing.assert_allclose(b0.get_fdata(), data[..., [0, 2]].mean(axis=3), rtol=1e-6)
+
+
+def test_extract_b0_without_b0(tmp_path):
+    in_file = tmp_path / "dwi.nii"
+    nib.Nifti1Image(np.zeros((2, 2, 2, 2), dtype=np.float32), np.eye(4)).to_filename(str(in_file))
+    (tmp_path / "dwi.bval").write_text("1000 1000")
+    with pytest.raises(ValueError):
+        extract_b0(in_file, None, tmp_path / "dwi.bval", tmp_path / "b0.nii", logger=logging.getLogger("test"), backend="native")
+
+
+@pytest.mark.parametrize("image_class", ["Nifti1Image", "Nifti2Image"])
+@pytest.mark.parametrize("extension", ["nii", "nii.gz"])
+def test_read_shape(tmp_path, image_class, extension):
+    path = tmp_path / f"dwi.{extension}"
+    getattr(nib, image_class)(np.zeros((3, 4, 5, 7), dtype=np.int16), np.eye(4)).to_filename(str(path))
+    assert read_shape(path) == (3, 4, 5, 7)
+    assert get_n_volumes(path) == 7
+    getattr(nib, image_class)(np.zeros((3, 4, 5), dtype=np.int16), np.eye(4)).to_filename(str(path))
+    os.utime(path, ns=(1, 1))
+    assert get_n_volumes(path) == 1
+
+
+@pytest.mark.parametrize("size", [0, 1000, 300_000])
+def test_compress_file_in_blocks(tmp_path, size):
+    data = (os.urandom(size // 3) + bytes(size - size // 3)) * 2
+    (tmp_path / "image.nii").write_bytes(data)
+    compress_file(tmp_path / "image.nii", tmp_path / "image.nii.gz", block_size=64 * 1024, jobs=4)
+    # a single standard gzip stream, identical for identical inputs
+    assert gzip.decompress((tmp_path / "image.nii.gz").read_bytes()) == data
+    compress_file(tmp_path / "image.nii", tmp_path / "again.nii.gz", block_size=64 * 1024, jobs=2)
+    assert (tmp_path / "again.nii.gz").read_bytes() == (tmp_path / "image.nii.gz").read_bytes()
+    decompress_file(tmp_path / "image.nii.gz", tmp_path / "round-trip.nii")
+    assert (tmp_path / "round-trip.nii").read_bytes() == data
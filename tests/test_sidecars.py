@@ -0,0 +1,25 @@
+import json
+import os
+
+from bidsbase.manager.utils.sidecars import read_jsons
+from bidsbase.manager.utils.sidecars import write_json
+from bidsbase.manager.utils.sidecars import write_jsons
+
+
+def test_write_json_skips_unchanged_sidecars(tmp_path):
+    sidecar = tmp_path / "sub-01_dwi.json"
+    sidecar.write_text(json.dumps({"PhaseEncodingDirection": "j-"}))
+    os.utime(sidecar, (0, 0))
+    assert not write_json(sidecar, {"PhaseEncodingDirection": "j-"})
+    assert sidecar.stat().st_mtime == 0
+    assert write_json(sidecar, {"PhaseEncodingDirection": "j"})
+    assert json.loads(sidecar.read_text()) == {"PhaseEncodingDirection": "j"}
+
+
+def test_read_and_write_many_sidecars(tmp_path):
+    sidecars = {tmp_path / f"sub-{i:02d}_epi.json": {"IntendedFor": [f"ses-1/dwi/sub-{i:02d}_dwi.nii.gz"]} for i in range(40)}
+    assert write_jsons(sidecars) == list(sidecars)
+    assert read_jsons(sidecars) == sidecars
+    changed = dict(sidecars)
+    changed[tmp_path / "sub-03_epi.json"] = {"IntendedFor": []}
+    assert write_jsons(changed) == [tmp_path / "sub-03_epi.json"]
@@ -0,0 +1,66 @@
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from bidsbase.manager.index import INDEX_NAME
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.utils.state import RunState
+
+
+def test_run_state(tmp_path):
+    state = RunState(tmp_path / "state.sqlite")
+    assert state.get("fix", "sub-01/ses-1") is None
+    state.record("fix", "sub-01/ses-1", "failed", error="boom")
+    assert not state.is_done("fix", "sub-01/ses-1")
+    state.record("fix", "sub-01/ses-1", "done", outputs={"a": "b"})
+    state.record("fix", "sub-02/ses-1", "failed")
+    outcome = RunState(tmp_path / "state.sqlite").get("fix", "sub-01/ses-1")
+    assert outcome["status"] == "done" and outcome["outputs"] == {"a": "b"} and outcome["error"] is None
+    assert state.sessions("fix", "failed") == ["sub-02/ses-1"]
+    assert state.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def record_sessions(path, worker):
+    state = RunState(path)
+    for i in range(50):
+        state.record("copy", f"sub-{worker}/ses-{i}", "done")
+    state.close()
+
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / "state.sqlite"
+    # connections must not be inherited by forked processes
+    RunState(path).close()
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(record_sessions, [path] * 4, range(4)))
+    assert len(RunState(path).sessions("copy", "done")) == 200
+
+
+def test_resume_retries_failed_sessions(dataset, tmp_path):
+    fixed = []
+
+    def flaky_fix(logger, session_path, auto_fix=True, plan=None):
+        fixed.append(session_path.parent.name)
+        if session_path.parent.name == "sub-01" and fixed.count("sub-01") == 1:
+            raise RuntimeError("flaky")
+        return False, {}
+
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    manager.FIXES = [flaky_fix]
+    manager.fix_dataset()
+    assert fixed == ["sub-01", "sub-02"]
+    assert manager.state.sessions("fix", "failed") == ["sub-01/ses-1"]
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", resume=True)
+    manager.FIXES = [flaky_fix]
+    manager.fix_dataset()
+    assert fixed == ["sub-01", "sub-02", "sub-01"]
+    assert manager.state.sessions("fix", "done") == ["sub-01/ses-1", "sub-02/ses-1"]
+
+
+def test_cooperative_runs_use_a_rollback_journal(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work", run_id="42")
+    assert manager.state.connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    manager.process_dataset(fix=False)
+    connection = sqlite3.connect(tmp_path / "work" / INDEX_NAME)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    connection.close()
+    assert not (tmp_path / "work" / f"{INDEX_NAME}-wal").exists()
@@ -0,0 +1,17 @@
+from bidsbase.manager.index import DatasetIndex
+from bidsbase.manager.session.session import Session
+from bidsbase.manager.utils.nifti import get_n_volumes
+from bidsbase.manager.utils.synthetic import make_synthetic_dataset
+
+
+def test_make_synthetic_dataset(tmp_path):
+    root = make_synthetic_dataset(tmp_path / "bids", n_subjects=2, n_sessions=3, dwi_runs=2, payload="sparse", shape=(64, 64, 40))
+    index = DatasetIndex(root)
+    assert len(index.session_paths) == 6
+    session_path = index.sessions("00001")["1"]
+    dwi = session_path / "dwi" / "sub-00001_ses-1_dir-FWD_run-2_dwi.nii"
+    assert get_n_volumes(dwi) == 6
+    # sparse images take (almost) no disk space
+    assert dwi.stat().st_blocks * 512 < dwi.stat().st_size
+    changed_files = Session(session_path).fix()
+    assert str(dwi) in changed_files
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+from conftest import make_dataset
+
+from bidsbase.manager.index import DatasetIndex
+from bidsbase.manager.manager import Manager
+from bidsbase.manager.utils.watch import SessionWatcher
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_session_watcher(dataset, use_inotify):
+    watcher = SessionWatcher(dataset, quiet=0.5, interval=0.05, use_inotify=use_inotify)
+    reported = []
+    try:
+        assert watcher.poll(timeout=0.1) == []
+        make_dataset(dataset, subjects=["03"])
+        wait_for(lambda: ("03", "1") in watcher.pending or reported.extend(watcher.poll(timeout=0.05)))
+        # the session is still being written to
+        (dataset / "sub-03" / "ses-1" / "dwi" / "sub-03_ses-1_dwi.bval").write_text("0 1000 1000 1000")
+        wait_for(lambda: reported.extend(watcher.poll(timeout=0.05)) or reported)
+        assert reported == [("03", "1")]
+        (dataset / "sub-01" / "ses-1" / "anat" / "sub-01_ses-1_T2w.nii.gz").write_bytes(b"T2w")
+        wait_for(lambda: reported.extend(watcher.poll(timeout=0.05)) or len(reported) == 2)
+        assert reported == [("03", "1"), ("01", "1")]
+    finally:
+        watcher.close()
+
+
+def test_manager_watch(dataset, tmp_path):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    manager.fix_dataset()
+    stop = threading.Event()
+    thread = threading.Thread(target=manager.watch, kwargs={"quiet": 0.2, "interval": 0.05, "stop": stop})
+    thread.start()
+    try:
+        time.sleep(0.2)
+        make_dataset(dataset, subjects=["03"])
+        wait_for(lambda: (tmp_path / "work" / "sub-03" / "ses-1" / "fingerprint.json").exists())
+    finally:
+        stop.set()
+        thread.join()
+    assert (manager.copy_to / "sub-03" / "ses-1" / "dwi" / "sub-03_ses-1_dwi.bval").exists()
+
+
+def test_arrivals_are_indexed_alone(dataset, tmp_path, monkeypatch):
+    manager = Manager(dataset, validate=False, work_dir=tmp_path / "work")
+    manager.fix_dataset()
+    make_dataset(dataset, subjects=["03"])
+    walks = []
+    monkeypatch.setattr(DatasetIndex, "refresh", lambda index: walks.append(index.root))
+    manager._process_arrivals([("03", "1")])
+    assert walks == []
+    assert manager.subjects == ["01", "02", "03"]
+    assert list(manager.sessions["03"]) == ["1"]
+    assert (tmp_path / "work" / "sub-03" / "ses-1" / "fingerprint.json").exists()
+    assert len(manager.query(subject="03", suffix="dwi")) == 2